@@ -0,0 +1,130 @@
+"""
+End to end benchmark: starts fake_doctolib_server.py, then drives AvailabilityReminder.run() against it through the 'local'
+transport, with an address search covering every fake practitioner. Reports:
+- wall time, and wall time per practitioner found
+- requests per second, and the number of requests per stage (search, organization, profile, availabilities, 429)
+- peak RSS of the reminder's process (the server runs in its own process)
+The results are printed, and written as json with --output so runs can be compared.
+Run from the repository root: python benchmarks/end_to_end_benchmark.py [--practitioners 2000] [--latency-ms 20] [--concurrency 8]
+                                                                          [--fetch-slot-window]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import resource
+import subprocess
+import urllib.request
+from pathlib import Path
+
+ROOT_FOLDER = Path(__file__).parent.parent.resolve()
+SERVER_SCRIPT = Path(__file__).parent/"fake_doctolib_server.py"
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, args):
+    server = subprocess.Popen([sys.executable, str(SERVER_SCRIPT), "--port", str(port), "--practitioners", str(args.practitioners),
+                               "--latency-ms", str(args.latency_ms), "--max-requests-per-s", str(args.max_requests_per_s)],
+                              stdout=subprocess.PIPE, text=True)
+    server.stdout.readline()  # the server prints a line once it listens
+    return server
+
+
+def get_server_stats(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/__stats") as response:
+        return json.loads(response.read())
+
+
+def build_config(port, args):
+    """ a config that searches every fake practitioner around the address, through the local transport, without sending emails """
+    return {
+        "search_around_address": True,
+        "visiting_motive_keywords": ["premiere", "consultation"],
+        "visiting_motive_forbidden_keywords": ["suivi", "chirurgie"],
+        "max_date_slot_for_reminder": None,
+        "max_days_from_today_for_reminder": 10,
+        "only_notify_new_slots": False,
+        "send_email_reminder": False,
+        "profile_urls": [],
+        "city": "Toulouse",
+        "zipcode": 31000,
+        "street_name": "rue des lois",
+        "street_number": 1,
+        "max_dist_from_address_km": args.practitioners * 0.005 + 1.0,  # see FakeDoctolib.km_per_practitioner
+        "max_search_pages": None,
+        "practitioner_types": ["dentiste"],
+        "save_url_request_time": False,
+        "cache_responses": False,
+        "max_wait_for_request_s": 60,
+        "max_concurrent_requests": args.concurrency,
+        "fetch_slot_window": args.fetch_slot_window,
+        "transport": "local",
+        "transport_options": {"local_base_url": f"http://127.0.0.1:{port}", "pool_maxsize": max(10, args.concurrency)},
+    }
+
+
+def run_benchmark(args):
+    port = get_free_port()
+    server = start_server(port, args)
+    try:
+        os.chdir(ROOT_FOLDER)
+        sys.path.insert(0, str(ROOT_FOLDER))
+        sys.path.insert(0, "sample")
+        for name, value in (("ES_SERVER_NAME", "localhost"), ("ES_PORT_NUMBER", "25"), ("ES_EMAIL_USER_NAME", "bench"), ("ES_EMAIL_PASSWORD", "bench")):
+            os.environ.setdefault(name, value)
+        from DoctolibUrlCom import DoctolibUrlCom, REQUEST_TIME_LIMIT_S
+        from AvailabilityReminder import AvailabilityReminder
+
+        config_data = build_config(port, args)
+        # the stand-in server isn't doctolib.fr, its own 429 answers are the only limit
+        DoctolibUrlCom(max_wait_for_request_s=60, transport="local", transport_options=config_data["transport_options"],
+                       request_limits={url_type: (10**9, 1.0) for url_type in REQUEST_TIME_LIMIT_S.keys()})
+        ar = AvailabilityReminder(config_data=config_data)
+        start = time.perf_counter()
+        ar.run()
+        wall_time_s = time.perf_counter() - start
+        stats = get_server_stats(port)
+    finally:
+        server.terminate()
+        server.wait()
+
+    num_of_requests = sum(count for kind, count in stats.items() if kind != "429")
+    return {
+        "practitioners": len(ar.practitioners),
+        "wall_time_s": round(wall_time_s, 3),
+        "wall_time_per_practitioner_ms": round(1000.0 * wall_time_s / max(1, len(ar.practitioners)), 3),
+        "requests": num_of_requests,
+        "requests_per_s": round(num_of_requests / wall_time_s, 1),
+        "requests_per_stage": stats,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),  # ru_maxrss is in KB on linux
+        "parameters": vars(args),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--practitioners", type=int, default=2000, help="number of practitioners listed by the address search")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--max-requests-per-s", type=float, default=0.0, help="above this rate the server answers 429, 0 for no limit")
+    parser.add_argument("--concurrency", type=int, default=8, help="max_concurrent_requests of the reminder")
+    parser.add_argument("--fetch-slot-window", action="store_true", help="fetch every slot of the reminder window, see config.yaml")
+    parser.add_argument("--output", help="json file the results are written to")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    print(json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""
+Local stand-in for doctolib.fr, serving generated but realistic payloads for every endpoint the reminder uses:
+- /<type>/<city>-<street>.json?page=N : address search, 20 doctors per page sorted by distance
+- /<org-type>/<city>/<org-slug>.json : organization, with its practitioners_by_speciality
+- /online_booking/draft/new.json?id=<slug> : practitioner or organization profile
+- /availabilities.json?... : slots of the requested motive/agendas/practice from start_date, for limit days, or the next_slot
+  after them when there is none
+- /__stats : number of requests served per endpoint, as json
+Every payload is derived from the seed and the practitioner index, so nothing is stored and tens of thousands of
+practitioners cost no memory. Latency and 429 answers can be configured to mimic the real server.
+Use it with the 'local' transport: transport_options' local_base_url = http://127.0.0.1:<port>
+usage: python benchmarks/fake_doctolib_server.py [--port 8080] [--practitioners 10000] [--latency-ms 0] [--max-requests-per-s 0]
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import date, timedelta
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PRACTITIONER_TYPE = "dentiste"
+ORGANIZATION_TYPE = "centre-de-sante"
+CITY = "toulouse"
+DOCTORS_PER_PAGE = 20
+MAX_DAYS_PER_REQUEST = 15  # like doctolib, availabilities.json never returns more days than this
+MOTIVE_NAMES = ["Première consultation dentaire", "Consultation de suivi", "Détartrage", "Urgence dentaire",
+                "Chirurgie dentaire", "Consultation enfant", "Blanchiment", "Pose d'implant"]
+
+
+class FakeDoctolib:
+    """ generates every payload from the seed. Practitioner i is at i*km_per_practitioner km, every org_every-th one is an organization """
+    def __init__(self, num_of_practitioners=10000, seed=0, km_per_practitioner=0.005, org_every=25, org_size=5, no_slot_ratio=0.2,
+                 open_day_ratio=0.3):
+        self.num_of_practitioners = num_of_practitioners
+        self.seed = seed
+        self.km_per_practitioner = km_per_practitioner
+        self.org_every = org_every
+        self.org_size = org_size
+        self.no_slot_ratio = no_slot_ratio
+        self.open_day_ratio = open_day_ratio  # ratio of the days after the first free one that have free slots too
+
+    def _rng(self, *keys):
+        # string seeds are hashed deterministically by random, unlike hash() which changes with every interpreter
+        return random.Random("|".join(str(k) for k in (self.seed,) + keys))
+
+    def is_organization(self, index):
+        return self.org_every > 0 and index % self.org_every == 0
+
+    def get_link(self, index):
+        if self.is_organization(index):
+            return f"/{ORGANIZATION_TYPE}/{CITY}/centre-{index}"
+        return f"/{PRACTITIONER_TYPE}/{CITY}/dr-{index}"
+
+    def search(self, page):
+        start = (page - 1) * DOCTORS_PER_PAGE
+        doctors = [{"link": self.get_link(i), "distance": round(i * self.km_per_practitioner, 3)}
+                   for i in range(start, min(start + DOCTORS_PER_PAGE, self.num_of_practitioners))]
+        return {"data": {"doctors": doctors}}
+
+    def organization(self, index):
+        # the members of an organization are extra practitioners, not listed in the search
+        members = [{"link": f"/{PRACTITIONER_TYPE}/{CITY}/dr-{index}-{j}"} for j in range(self.org_size)]
+        return {"data": {"practitioners_by_speciality": {PRACTITIONER_TYPE: members}}}
+
+    def profile(self, slug):
+        if slug.startswith("centre-"):
+            return {"data": {"profile": {"name_with_title": slug, "organization": True, "speciality": None},
+                             "places": [], "visit_motives": [], "agendas": []}}
+        rng = self._rng("profile", slug)
+        num_of_practices = rng.randint(1, 3)
+        practice_ids = [rng.randint(1, 10**6) for _ in range(num_of_practices)]
+        motives = [{"id": rng.randint(1, 10**7), "name": name, "speciality_id": 1} for name in rng.sample(MOTIVE_NAMES, rng.randint(2, 6))]
+        agendas = []
+        for _ in range(rng.randint(1, 8)):
+            agendas.append({"id": rng.randint(1, 10**6), "booking_disabled": rng.random() < 0.1, "booking_temporary_disabled": False,
+                            "speciality_id": 1,
+                            "visit_motive_ids_by_practice_id": {str(p): [m["id"] for m in motives if rng.random() < 0.7] for p in practice_ids}})
+        places = [{"practice_ids": [p], "address": f"{rng.randint(1, 200)} rue des lois", "zipcode": "31000", "city": "Toulouse",
+                   "latitude": 43.6 + rng.random() / 10, "longitude": 1.44 + rng.random() / 10} for p in practice_ids]
+        return {"data": {"profile": {"name_with_title": f"Dr {slug}", "organization": False,
+                                     "speciality": {"id": 1, "slug": PRACTITIONER_TYPE, "name": "Chirurgien-dentiste"}},
+                         "places": places, "visit_motives": motives, "agendas": agendas}}
+
+    def get_slot_times(self, key, day, first_day):
+        """ :return list of str : the HH:MM of the free slots of the day. The first day always has some, later ones sometimes """
+        if day < first_day:
+            return []
+        rng = self._rng("slots", key, day.isoformat())
+        if day != first_day and rng.random() > self.open_day_ratio:
+            return []
+        return [f"{hour:02d}:{minute:02d}" for hour, minute in sorted(rng.sample([(h, m) for h in range(8, 19) for m in (0, 30)], rng.randint(1, 4)))]
+
+    def availabilities(self, query):
+        """ the days from start_date to start_date+limit with their slots, or next_slot when there is none in that window """
+        key = "|".join(query.get(k, [""])[0] for k in ("visit_motive_ids", "agenda_ids", "practice_ids"))
+        today = date.today()
+        rng = self._rng("availabilities", key, today.isoformat())
+        if rng.random() < self.no_slot_ratio:
+            return {"availabilities": [], "total": 0, "message": "Aucune disponibilité en ligne."}
+        first_day = today + timedelta(days=int(rng.expovariate(1 / 60.0)))
+        start_day = max(today, date.fromisoformat(query.get("start_date", [today.isoformat()])[0]))
+        limit = min(MAX_DAYS_PER_REQUEST, int(query.get("limit", ["2"])[0]))
+        availabilities = []
+        for i in range(limit):
+            day = start_day + timedelta(days=i)
+            slots = [f"{day.isoformat()}T{time}:00.000+01:00" for time in self.get_slot_times(key, day, first_day)]
+            availabilities.append({"date": day.isoformat(), "slots": slots})
+        total = sum(len(a["slots"]) for a in availabilities)
+        if total:
+            return {"availabilities": availabilities, "total": total}
+        next_day = max(first_day, start_day + timedelta(days=limit))
+        while not self.get_slot_times(key, next_day, first_day):
+            next_day += timedelta(days=1)
+        return {"availabilities": availabilities, "total": 0, "next_slot": f"{next_day.isoformat()}T{self.get_slot_times(key, next_day, first_day)[0]}:00.000+01:00"}
+
+
+class FakeDoctolibHandler(BaseHTTPRequestHandler):
+    server_version = "FakeDoctolib/1.0"
+
+    def log_message(self, format, *args):
+        pass  # too verbose at thousands of requests per second
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        path = parts.path
+        if path == "/__stats":
+            return self._send(200, server.get_stats())
+
+        if path == "/availabilities.json":
+            kind = "availabilities"
+        elif path == "/online_booking/draft/new.json":
+            kind = "profile"
+        elif path.startswith(f"/{ORGANIZATION_TYPE}/"):
+            kind = "organization"
+        else:
+            kind = "search"
+        if not server.count_request(kind):
+            return self._send(429, {"error": "Too many requests"})
+        if server.latency_s:
+            time.sleep(server.latency_s)
+
+        fake = server.fake
+        if kind == "availabilities":
+            return self._send(200, fake.availabilities(query))
+        if kind == "profile":
+            return self._send(200, fake.profile(query.get("id", [""])[0]))
+        if kind == "organization":
+            return self._send(200, fake.organization(int(path.rsplit("-", 1)[1].split(".")[0])))
+        if path.endswith(".json") and path.count("/") == 2:
+            return self._send(200, fake.search(int(query.get("page", ["1"])[0])))
+        return self._send(404, {"error": "Not found"})
+
+    def _send(self, status_code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeDoctolibServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fake, latency_s=0.0, max_requests_per_s=0.0):
+        """
+        :param fake - FakeDoctolib
+        :param latency_s - float : added to every answer
+        :param max_requests_per_s - float : above this rate, answers are 429. 0 for no limit
+        """
+        super().__init__(address, FakeDoctolibHandler)
+        self.fake = fake
+        self.latency_s = latency_s
+        self.max_requests_per_s = max_requests_per_s
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._tokens = max_requests_per_s
+        self._updated_at = time.monotonic()
+
+    def count_request(self, kind):
+        """ counts the request and :return False if it has to be answered with a 429 """
+        with self._lock:
+            self._counts[kind] = self._counts.get(kind, 0) + 1
+            if not self.max_requests_per_s:
+                return True
+            now = time.monotonic()
+            self._tokens = min(self.max_requests_per_s, self._tokens + (now - self._updated_at) * self.max_requests_per_s)
+            self._updated_at = now
+            if self._tokens < 1.0:
+                self._counts["429"] = self._counts.get("429", 0) + 1
+                return False
+            self._tokens -= 1.0
+            return True
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--practitioners", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--max-requests-per-s", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeDoctolibServer(("127.0.0.1", args.port), FakeDoctolib(args.practitioners, args.seed),
+                                latency_s=args.latency_ms / 1000.0, max_requests_per_s=args.max_requests_per_s)
+    print(f"fake doctolib serving {args.practitioners} practitioners on http://127.0.0.1:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""
+Local stand-in for an SMTP server, to try the email outbox without sending real emails. It speaks just enough SMTP for
+smtplib (EHLO/HELO, AUTH PLAIN/LOGIN, MAIL, RCPT, DATA, RSET, NOOP, QUIT), accepts any credentials and doesn't support
+STARTTLS, so set ES_USE_STARTTLS=false. Received emails are printed, and counted with the connections and logins.
+--fail-every N answers a temporary error (451) to every Nth email, to see the retries.
+usage: python benchmarks/fake_smtp_server.py [--port 2525] [--fail-every 0]
+then : ES_SERVER_NAME=127.0.0.1 ES_PORT_NUMBER=2525 ES_EMAIL_USER_NAME=me ES_EMAIL_PASSWORD=x ES_USE_STARTTLS=false python main.py
+"""
+import sys
+import argparse
+import threading
+import socketserver
+from email import message_from_bytes
+
+
+class FakeSmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        server.count("connections")
+        self.reply("220 fake-smtp ready")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip()
+            verb = command.split(" ")[0].upper()
+            if verb == "EHLO":
+                self.reply("250-fake-smtp")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif verb == "HELO":
+                self.reply("250 fake-smtp")
+            elif verb == "AUTH":
+                if command.upper().startswith("AUTH LOGIN"):
+                    self.reply("334 VXNlcm5hbWU6")
+                    self.rfile.readline()
+                    self.reply("334 UGFzc3dvcmQ6")
+                    self.rfile.readline()
+                server.count("logins")
+                self.reply("235 authenticated")
+            elif verb == "MAIL":
+                recipients = []
+                if server.should_fail():
+                    self.reply("451 temporary failure, try again later")
+                else:
+                    self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.split(":", 1)[1].strip(" <>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 end with <CRLF>.<CRLF>")
+                data = b""
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b".\r\n", b".\n"):
+                        break
+                    data += data_line[1:] if data_line.startswith(b"..") else data_line
+                server.receive(recipients, message_from_bytes(data))
+                self.reply("250 OK queued")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 command not implemented")
+
+
+class FakeSmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, fail_every=0, verbose=False):
+        """
+        :param fail_every - int : every fail_every-th email gets a 451, 0 to never fail
+        """
+        super().__init__(address, FakeSmtpHandler)
+        self.fail_every = fail_every
+        self.verbose = verbose
+        self.messages = []  # list of (recipients, email.message.Message)
+        self._lock = threading.Lock()
+        self._counts = {"connections": 0, "logins": 0, "attempts": 0, "failures": 0}
+
+    def count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def should_fail(self):
+        with self._lock:
+            self._counts["attempts"] += 1
+            if self.fail_every and self._counts["attempts"] % self.fail_every == 0:
+                self._counts["failures"] += 1
+                return True
+            return False
+
+    def receive(self, recipients, message):
+        with self._lock:
+            self.messages.append((recipients, message))
+        if self.verbose:
+            print(f"--- email to {', '.join(recipients)} : {message['Subject']}\n{message.get_payload(0).get_payload()}", flush=True)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._counts, messages=len(self.messages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--fail-every", type=int, default=0)
+    args = parser.parse_args()
+
+    server = FakeSmtpServer(("127.0.0.1", args.port), fail_every=args.fail_every, verbose=True)
+    print(f"fake smtp listening on 127.0.0.1:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(server.get_stats())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Measures the cold start of main.main: importing main and creating the AvailabilityReminder (config, DoctolibUrlCom, EmailSender),
+without making any request. Each measure runs in a fresh interpreter. Exits with an error if the median is over the budget,
+or if heavy modules that are only needed for real requests got imported.
+Run from the repository root: python benchmarks/startup_benchmark.py [--runs N] [--budget-ms MS]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT_FOLDER = Path(__file__).parent.parent.resolve()
+
+# median startup time allowed, in milliseconds
+STARTUP_BUDGET_MS = 400.0
+# modules that must not be loaded before the first request
+LAZY_MODULES = ["requests", "requests_ip_rotator", "boto3", "smtplib"]
+
+STARTUP_SNIPPET = """
+import sys, json, time
+start = time.perf_counter()
+import main
+main.AvailabilityReminder()
+elapsed_ms = (time.perf_counter() - start) * 1000.0
+print(json.dumps({"elapsed_ms": elapsed_ms, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def measure_startup():
+    """ :return dict with elapsed_ms and the loaded lazy modules, measured in a fresh interpreter """
+    env = dict(os.environ)
+    # EmailSender.from_env only reads these, no connection is made at startup
+    for name, value in (("ES_SERVER_NAME", "localhost"), ("ES_PORT_NUMBER", "25"), ("ES_EMAIL_USER_NAME", "bench"), ("ES_EMAIL_PASSWORD", "bench")):
+        env.setdefault(name, value)
+    result = subprocess.run([sys.executable, "-c", STARTUP_SNIPPET], cwd=ROOT_FOLDER, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    args = parser.parse_args()
+
+    measures = [measure_startup() for _ in range(args.runs)]
+    median_ms = statistics.median(m["elapsed_ms"] for m in measures)
+    loaded = sorted(set(module for m in measures for module in m["loaded"]))
+    print(f"startup: median {median_ms:.1f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    if loaded:
+        print(f"FAILED: modules loaded at startup although they should be lazy: {loaded}")
+        return 1
+    if median_ms > args.budget_ms:
+        print("FAILED: startup is over budget")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
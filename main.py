@@ -1,14 +1,52 @@
 """
-For now works only for single page
+usage: python main.py [--daemon] [--configs CONFIG_FILE ...] [--shards N] [--profile [REPORT_FILE]]
+--daemon : keeps running and polls every practitioner on its own schedule, instead of checking everyone once
+--configs : runs several config files at once (one per person to remind), fetching what they have in common only once
+--shards : splits the practitioners across N worker processes, the reminders being sent once by the main process
+--profile : profiles the run, prints the functions using the most CPU time apart from the network wait, and writes a json
+            report that can be diffed between releases (data/profile_report.json by default). See sample/Profiler.py
 """
-from sample.DoctolibUrlCom import DoctolibUrlCom
+import sys
 from sample.AvailabilityReminder import AvailabilityReminder
 
 
+def get_option_values(args, option):
+    """ :return list of str : the arguments following option, up to the next option """
+    values = []
+    for a in args[args.index(option)+1:]:
+        if a.startswith("--"):
+            break
+        values.append(a)
+    return values
+
+
 def main(argc=None, argv=None):
-    duc = DoctolibUrlCom()
-    ar = AvailabilityReminder()
-    ar.run()
+    # on AWS lambda, main is called with (event, context), so argv is only parsed when it is a list of arguments
+    args = argv[1:] if isinstance(argv, list) else []
+    if "--configs" in args:
+        from sample.MultiTenantRunner import MultiTenantRunner
+        runner = MultiTenantRunner.from_files(get_option_values(args, "--configs"))
+        reminders = runner.tenants
+        run = runner.run
+    elif "--shards" in args:
+        from sample.ShardedRunner import ShardedRunner
+        runner = ShardedRunner(int(get_option_values(args, "--shards")[0]))
+        reminders = [runner.coordinator]
+        run = runner.run
+    else:
+        runner = AvailabilityReminder()
+        reminders = [runner]
+        run = runner.run_daemon if "--daemon" in args else runner.run
+
+    if "--profile" in args:
+        from sample.Profiler import profile_run, DEFAULT_REPORT_FILE
+        # the profiler only follows the main thread: with a single request at a time, discovery and probing are run in it
+        for reminder in reminders:
+            reminder.config_data["max_concurrent_requests"] = 1
+        report_file = (get_option_values(args, "--profile") or [DEFAULT_REPORT_FILE])[0]
+        profile_run(run, report_file)
+    else:
+        run()
 
 if __name__ == "__main__":
-    main()
+    main(len(sys.argv), sys.argv)
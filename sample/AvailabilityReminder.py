@@ -1,41 +1,247 @@
 """
 """
 import sys
+import time
+import threading
+from enum import Enum
 from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, Future, wait
 from datetime import datetime, timedelta
 
-sys.path.insert(0, "sample")
+if "sample" not in sys.path:
+    sys.path.insert(0, "sample")
 import utils
 from Practitioner import *
 from EmailSender import EmailSender
-from DoctolibUrlCom import DoctolibUrlCom
+from EmailOutbox import EmailOutbox
+from Notifier import Notifier, SlotEvent
+from Metrics import metrics
+from KeywordMatcher import KeywordMatcher
+from SlotState import SlotState
+from SlotStore import SlotStore
+from PollScheduler import PollScheduler
+from PractitionerCatalog import PractitionerCatalog
+from GeoIndex import GeoIndex, is_circle_covered, geocode_address
+from DoctolibUrlCom import DoctolibUrlCom, UrlType
 
 CURR_FOLDER = Path(__file__).parent.resolve()
 
 # available titles to be removed from names_with_titles
 AVAILABLE_TITLES = ["Dr", "M.", "Monsieur", "Mr", "Madame", "Mme", "Mlle", "Mademoiselle"]
 AVAILABILITY_REMINDER_DATA_FILE = CURR_FOLDER.parent/"data"/"availability_reminder_data.json"
+NUM_OF_EARLIEST_SLOTS_LOGGED = 5
+# keys of an address in the config's addresses, see get_addresses
+ADDRESS_KEYS = ("street_number", "street_name", "zipcode", "city", "latitude", "longitude", "max_dist_from_address_km")
+
+
+class SearchResult(Enum):
+    """ how a search around an address ended, see iter_doctors_around_address """
+    COMPLETE = 1           # every doctor within max_dist_from_address_km was found
+    MAX_PAGES_REACHED = 2  # max_search_pages was reached first
+    FAILED = 3             # a request failed, pages are missing
+
+
+class InlineExecutor():
+    """
+    same interface as ThreadPoolExecutor, but the submitted functions are run right away in the calling thread. Used for the
+    discovery when a single worker is allowed, e.g. under --profile as cProfile only follows the thread it is enabled in
+    """
+    def submit(self, function, *args):
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
 
 
 class AvailabilityReminder():
     """
     this is the main class that will setup your doctolib parser and globally make sure to send email reminders
     """
-    def __init__(self):
+    def __init__(self, config_data=None, url_com=None):
+        """
+        :param config_data - dict : as read from config.yaml. If None, config/config.yaml is read
+        :param url_com - object with a request_from_json_url method, used to fetch profiles, organizations and searches. If None,
+                         DoctolibUrlCom is used directly (see MultiTenantRunner for a shared one)
+        """
         self.dist_from_adress = {}    # dist_from_adress[name] = distance
         self.logger = utils.logger
-        self.config_data = utils.read_config_file()
+        self.config_data = config_data if config_data is not None else utils.read_config_file()
+        duc = DoctolibUrlCom.from_config(self.config_data)  # first instantiation of the singleton, so the config is taken into account
+        self.url_com = url_com if url_com is not None else duc
         
         self.practitioners = []  # this is the list that'll conain practitioners data in form of Practitioner types
+        # discovery of the practitioners is done on a worker pool, see _discovery_pool
+        self._discovery_executor = None
+        self._discovery_lock = threading.Lock()
+        self._discovery_futures = []
+        self._discovered_practitioners = []  # list of (order_key, Practitioner)
+        self._seen_slugs = set()             # slugs that have already been fetched or are being fetched
+        self.shard = None                    # (shard_index, num_of_shards) to only watch a part of the practitioners, see ShardedRunner
+        # profiles and searches are read from the catalog when it has them, the stale ones are refreshed in the background
+        self.catalog = PractitionerCatalog.from_config(self.config_data)
+        self._catalog_refresher = None
+        # compiled once, and shared by every practitioner so that motive names common to several of them are only scored once
+        self.keyword_matcher = KeywordMatcher(self.config_data["visiting_motive_keywords"], self.config_data["visiting_motive_forbidden_keywords"])
+        self.slot_state = SlotState(self.get_state_file()) if self.config_data.get("only_notify_new_slots") else None
         self.email_sender = EmailSender.from_env()
-        self.email_message = ""
+        self.email_outbox = EmailOutbox.from_config(self.email_sender, self.config_data)
+        self.notifier = Notifier.from_config(self.config_data, self.email_outbox)
+        self.slot_events = []  # list of SlotEvent to send, see add_practitioner_slot_events
     
+    def get_state_file(self):
+        """ :return pathlib.Path of the slot state file, the config's availability_reminder_data_file or AVAILABILITY_REMINDER_DATA_FILE """
+        if self.config_data.get("availability_reminder_data_file"):
+            return CURR_FOLDER.parent/self.config_data["availability_reminder_data_file"]
+        return AVAILABILITY_REMINDER_DATA_FILE
+
     def fetch_practitioners_data(self):
         """ depending on the config's read_config_file boolean, it'll extract the practitioner datas and store them in self.practitioners """
-        if self.config_data["search_around_address"]:
-            self.fetch_practitioners_around_address()
-        if self.config_data["profile_urls"]:
-            self.fetch_practitioners_from_urls()
+        with self._discovery_pool():
+            if self.config_data["search_around_address"]:
+                self.fetch_practitioners_around_address()
+            if self.config_data["profile_urls"]:
+                self.fetch_practitioners_from_urls()
+
+    @contextmanager
+    def _discovery_pool(self):
+        """
+        profiles are fetched on a worker pool. This context starts the pool if it isn't already running, and when leaving it, waits
+        for every discovery task (including the ones submitted by other tasks) and adds the found practitioners to self.practitioners,
+        in a deterministic order. With max_concurrent_requests = 1, the tasks are run inline instead.
+        """
+        if self._discovery_executor is not None:
+            yield
+            return
+        max_workers = max(1, int(self.config_data.get("max_concurrent_requests", 1) or 1))
+        with (ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else InlineExecutor()) as executor:
+            self._discovery_executor = executor
+            try:
+                yield
+                self._wait_for_discovery()
+            finally:
+                self._discovery_executor = None
+                self._discovery_futures = []
+        self.practitioners.extend(pract for _, pract in sorted(self._discovered_practitioners, key=lambda item: item[0]))
+        self._discovered_practitioners = []
+
+    def _submit_discovery(self, order_key, function, *args):
+        """ runs function(order_key, *args) on the discovery pool. order_key is a tuple used to sort the discovered practitioners """
+        # submitted outside of the lock : an inline task runs (and submits its own tasks) before submit returns
+        future = self._discovery_executor.submit(function, order_key, *args)
+        with self._discovery_lock:
+            self._discovery_futures.append(future)
+
+    def _wait_for_discovery(self):
+        """ waits until every discovery task is done. Tasks can submit new tasks, so we loop until nothing is pending """
+        while True:
+            with self._discovery_lock:
+                pending = [f for f in self._discovery_futures if not f.done()]
+            if not pending:
+                break
+            wait(pending)
+        for future in self._discovery_futures:
+            if future.exception():
+                self.logger.error(f"Failed to discover a practitioner: {future.exception()}")
+
+    def _claim_slug(self, slug_name):
+        """ returns True if slug_name hasn't been seen yet (fetched or in flight) and marks it as seen """
+        with self._discovery_lock:
+            if slug_name is None or slug_name in self._seen_slugs:
+                return False
+            self._seen_slugs.add(slug_name)
+            return True
+
+    def _discover_profile(self, order_key, profile_url, expand_organization=False):
+        """
+        finds the profile behind profile_url, unless its slug was already seen, and stores the resulting practitioner.
+        The profile is read from the catalog if it has it, and fetched otherwise.
+        :param expand_organization - bool : if the profile is an organization, look for its practitioners instead
+        """
+        slug_name = get_slug_from_profile_url(profile_url)
+        if not self._claim_slug(slug_name):
+            return
+        entry = self.catalog.get(slug_name) if self.catalog is not None else None
+        if entry is not None and (entry[1] is not None or not (expand_organization and entry[0]["profile"]["organization"])):
+            (json_data, pract_urls, fetched_at) = entry
+            name = slug_name
+            metrics.inc("catalog_hits_total")
+            if self.catalog.is_stale(fetched_at):
+                self._schedule_catalog_refresh(self._fetch_profile, profile_url, expand_organization)
+        else:
+            if self.catalog is not None:
+                metrics.inc("catalog_misses_total")
+            (name, json_data, pract_urls) = self._fetch_profile(profile_url, expand_organization)
+        if not json_data:
+            return
+        if expand_organization and json_data["profile"]["organization"]:
+            for i, p_url in enumerate(pract_urls or []):
+                self._submit_discovery(order_key + (i,), self._discover_profile, p_url)
+            return
+        with metrics.time_stage("profile_parse"):
+            pract = Practitioner(name, json_data)
+        if pract.is_ok:
+            with self._discovery_lock:
+                self._discovered_practitioners.append((order_key, pract))
+
+    def _fetch_profile(self, profile_url, expand_organization=False):
+        """
+        fetches the profile behind profile_url, and the urls of its practitioners if it's an organization to expand, and stores
+        them in the catalog.
+        :return (slug_name, json_data, practitioner_urls) : (str, dict, list of str or None)
+        """
+        with metrics.time_stage("profile_fetch"):
+            (name, json_data) = fetch_json_data_from_profile_url(profile_url, self.url_com)
+        if not json_data:
+            return (name, json_data, None)
+        pract_urls = None
+        if expand_organization and json_data["profile"]["organization"]:
+            # this is an organization. We have to parse it and exctract all potential practitioners that practice config's practitioner_types
+            self.logger.info(f"An organization was found: {name}\nLet's parse it to retrieve any practitioner that might be relevant...")
+            with metrics.time_stage("organization_crawl"):
+                pract_urls = self.fetch_practitioner_urls_from_organization(profile_url)
+        if self.catalog is not None and (pract_urls is not None or not (expand_organization and json_data["profile"]["organization"])):
+            self.catalog.put(name, json_data, pract_urls)
+        return (name, json_data, pract_urls)
+
+    def _schedule_catalog_refresh(self, function, *args):
+        """ runs function(*args) on a single background thread, so that refreshing the catalog never delays the run """
+        with self._discovery_lock:
+            if self._catalog_refresher is None:
+                self._catalog_refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="CatalogRefresh")
+            metrics.inc("catalog_refreshes_total")
+            self._catalog_refresher.submit(function, *args)
+
+    def wait_for_catalog_refresh(self):
+        """
+        waits until the stale catalog entries found during this run are refreshed, so that the next run finds them fresh, and
+        logs the size of the catalog
+        """
+        with self._discovery_lock:
+            refresher, self._catalog_refresher = self._catalog_refresher, None
+        if refresher is not None:
+            refresher.shutdown(wait=True)
+        if self.catalog is not None:
+            (num_of_entries, num_of_stale_entries) = self.catalog.count()
+            self.logger.info(f"the catalog has {num_of_entries} profiles, {num_of_stale_entries} of them are stale")
+
+    def is_in_shard(self, profile_url):
+        """
+        :return bool : True if the profile belongs to this reminder's shard (see ShardedRunner), always True without shard.
+                       The practitioners of an organization belong to the organization's shard
+        """
+        if self.shard is None:
+            return True
+        (shard_index, num_of_shards) = self.shard
+        return get_shard_of_slug(get_slug_from_profile_url(profile_url) or profile_url, num_of_shards) == shard_index
 
     def fetch_practitioners_from_urls(self):
         """
@@ -45,70 +251,208 @@ class AvailabilityReminder():
             self.logger.warning("'profile_urls' is not part of the config file keys. You should leave it there "
                                 "and set keep it to empty if you don't want any URLs to be added to parser")
             return False
-        for url in self.config_data["profile_urls"]:
-            (name, json_data) = fetch_json_data_from_profile_url(url)
-            pract = Practitioner(name, json_data)
-            if pract.is_ok:
-                self.practitioners.append(pract)
+        with self._discovery_pool():
+            for i, url in enumerate(self.config_data["profile_urls"]):
+                if self.is_in_shard(url):
+                    self._submit_discovery((1, i), self._discover_profile, url)
     
     def fetch_practitioners_around_address(self):
         """
-        will fetch all practitioners around given address within wanted distance. Please refer to the config.yaml file for setup
+        will fetch all practitioners around the given addresses within wanted distance. Please refer to the config.yaml file for setup.
+        Search results are consumed as a stream: every doctor is handed over to the discovery pool as soon as its page arrives.
+        With the catalog, an address inside the circles already searched is answered from the local geo index instead, once
+        the searches of this run are done (see is_search_covered).
         """
         if not self.config_data["practitioner_types"]:
             self.logger.error("while requesting to look around address in the config, no practitioner type has been given to look for...")
             return False
 
-        self.logger.info(f"starting to look for any practitionner that practice {self.config_data['practitioner_types']} around given address in config.yaml:\n"
-                         f"{self.config_data['street_number']}, {self.config_data['street_name']}\n{self.config_data['zipcode']}, {self.config_data['city']}")      
-            
-        for practitioner_type in list(self.config_data["practitioner_types"]):
-            city = self.config_data["city"]
-            street_name = self.config_data["street_name"]
-            max_dist_km = 10000.0
-            if self.config_data["max_dist_from_address_km"]:
-                max_dist_km = self.config_data["max_dist_from_address_km"]
-
-            # first we generate the search url that will be requested from doctolib.fr that'll return all practitioners around address
-            practitioner_type = practitioner_type.replace(" ", "-").lower()
-            city = city.replace(" ", "-").lower()
-            street_name = street_name.replace(" ", "-").lower()
-            base_url = "https://www.doctolib.fr"
-            url = f"{base_url}/{practitioner_type}/{city}-{street_name}.json"
-
-            self.logger.info(f"Address URL to parse : {url}")
-            # and finally we go and parse the url, retrieve all practitioner names around given adress.
-            # TODO: figure out a way to parse more than 1 page (ie more than 20 results)
-            json_data = DoctolibUrlCom().request_from_json_url(url)
-            if json_data:
-                for doctor in json_data.get("data", {}).get("doctors", []):
-                    if 'distance' not in doctor.keys() or float(doctor['distance']) < max_dist_km:
-                        link = doctor['link']
-                        url = base_url + link
-                        (name, json_data) = fetch_json_data_from_profile_url(url)
-                        if not json_data["profile"]["organization"]:
-                            # if it's a practitioner
-                            pract = Practitioner(name, json_data)
-                            if pract.is_ok:
-                                self.practitioners.append(pract)
-                        else:
-                            # this is an organization. We have to parse it and exctract all potential practitioners that practice config's practitioner_types
-                            self.logger.info(f"An organization was found: {name}\nLet's parse it to retrieve any practitioner that might be relevant...")
-                            pract_urls = self.fetch_practitioner_urls_from_organization(url)
-                            if pract_urls:
-                                for p_url in pract_urls:
-                                    (name, json_data) = fetch_json_data_from_profile_url(p_url)
-                                    if not json_data["profile"]["organization"]:
-                                        # if it's a practitioner
-                                        pract = Practitioner(name, json_data)
-                                        if pract.is_ok:
-                                            self.practitioners.append(pract)
-                            
-                    else: # max distance has been reached, we can stop
-                        break
-            else:
-                return False
+        addresses = self.get_addresses()
+        self.logger.info(f"starting to look for any practitionner that practice {self.config_data['practitioner_types']} around given addresses in config.yaml:\n"
+                         + "\n".join(self.format_address(address) for address in addresses))
+
+        found_doctor = False
+        with self._discovery_pool():
+            for type_index, practitioner_type in enumerate(list(self.config_data["practitioner_types"])):
+                local_searches = []  # list of (address_index, location, max_dist_km) answered by the geo index
+                for address_index, address in enumerate(addresses):
+                    location = self.get_address_location(address)
+                    max_dist_km = self.get_max_dist_from_address_km(address)
+                    if (self.catalog is not None and location is not None and self.catalog.get_search(self.get_search_key(practitioner_type, address)) is None
+                            and self.is_search_covered(practitioner_type, address, location)):
+                        local_searches.append((address_index, location, max_dist_km))
+                        continue
+                    for i, link in enumerate(self.iter_doctor_links_around_address(practitioner_type, address, location)):
+                        found_doctor = True
+                        self._submit_doctor_link((0, type_index, address_index, i), link)
+                if not local_searches:
+                    continue
+                # the profiles found by this run's searches have to be in the catalog before the geo index is built
+                self._wait_for_discovery()
+                geo_index = GeoIndex(self.catalog.get_search_practices(practitioner_type))
+                for (address_index, location, max_dist_km) in local_searches:
+                    links = [link for (_, link) in geo_index.query_radius(location[0], location[1], max_dist_km)]
+                    self.logger.info(f"{len(links)} {practitioner_type} found in the catalog around {self.format_address(addresses[address_index])}")
+                    metrics.inc("geo_index_searches_total")
+                    for i, link in enumerate(links):
+                        found_doctor = True
+                        self._submit_doctor_link((0, type_index, address_index, i), link)
+        return found_doctor
+
+    def _submit_doctor_link(self, order_key, link):
+        profile_url = "https://www.doctolib.fr" + link
+        if self.is_in_shard(profile_url):
+            self._submit_discovery(order_key, self._discover_profile, profile_url, True)
+
+    def get_addresses(self):
+        """
+        :return list of dict : the config's addresses, each one with the keys of ADDRESS_KEYS it has. Without addresses, the
+                               config's single address (city, street_name...)
+        """
+        if self.config_data.get("addresses"):
+            return [dict(address) for address in self.config_data["addresses"]]
+        return [{key: self.config_data.get(key) for key in ADDRESS_KEYS}]
+
+    @staticmethod
+    def format_address(address):
+        return " ".join(str(address[key]) for key in ("street_number", "street_name", "zipcode", "city") if address.get(key))
+
+    def get_address_location(self, address):
+        """
+        :return (lat, lng) : the address' latitude and longitude if set in the config, geocoded otherwise (and kept in the catalog).
+                             None without catalog, as the geo index is built from it, or if the address couldn't be geocoded.
+                             Addresses aren't geocoded with the transports that only reach doctolib.fr (local, replay)
+        """
+        if address.get("latitude") is not None and address.get("longitude") is not None:
+            return (float(address["latitude"]), float(address["longitude"]))
+        if self.catalog is None:
+            return None
+        address_text = self.format_address(address)
+        location = self.catalog.get_geocode(address_text)
+        if location is None:
+            if not DoctolibUrlCom().transport.reaches_third_parties:
+                self.logger.info(f"'{address_text}' isn't geocoded with this transport, set its latitude and longitude in the config")
+                return None
+            location = geocode_address(address_text, self.url_com)
+            if location is None:
+                return None
+            self.catalog.put_geocode(address_text, *location)
+        return tuple(location)
+
+    def is_search_covered(self, practitioner_type, address, location):
+        """
+        :return bool : True if the circle around the address was already searched for practitioner_type, in one or several
+                       searches (around other addresses). If only stale searches cover it, it is searched again in the background
+        """
+        max_dist_km = self.get_max_dist_from_address_km(address)
+        coverage = self.catalog.get_search_coverage(practitioner_type)
+        if is_circle_covered(location[0], location[1], max_dist_km,
+                             [(lat, lng, radius_km) for (lat, lng, radius_km, fetched_at) in coverage if not self.catalog.is_stale(fetched_at)]):
             return True
+        if not is_circle_covered(location[0], location[1], max_dist_km, [(lat, lng, radius_km) for (lat, lng, radius_km, _) in coverage]):
+            return False
+        self._schedule_catalog_refresh(self._refresh_search, practitioner_type, address, location)
+        return True
+
+    def get_search_url(self, practitioner_type, address=None):
+        """
+        :param address - dict : one of get_addresses(), the config's address if None
+        :return str : url of doctolib.fr's search that returns all practitioners of practitioner_type around the address
+        """
+        address = address or self.get_addresses()[0]
+        practitioner_type = practitioner_type.replace(" ", "-").lower()
+        city = address["city"].replace(" ", "-").lower()
+        street_name = address["street_name"].replace(" ", "-").lower()
+        return f"https://www.doctolib.fr/{practitioner_type}/{city}-{street_name}.json"
+
+    def get_max_dist_from_address_km(self, address=None):
+        """ :return float : the address' max_dist_from_address_km if it has one, the config's otherwise """
+        if address and address.get("max_dist_from_address_km"):
+            return address["max_dist_from_address_km"]
+        if self.config_data["max_dist_from_address_km"]:
+            return self.config_data["max_dist_from_address_km"]
+        return 10000.0
+
+    def get_search_key(self, practitioner_type, address=None):
+        """ :return str : identifies a search in the catalog """
+        return f"{self.get_search_url(practitioner_type, address)}|{self.get_max_dist_from_address_km(address)}|{self.config_data.get('max_search_pages')}"
+
+    def iter_doctor_links_around_address(self, practitioner_type, address=None, location=None):
+        """
+        generator of the profile links (/type/city/name) of the practitioners of practitioner_type around the address.
+        They come from the catalog if it has this search, refreshed in the background when stale. Otherwise they are searched
+        (see iter_doctors_around_address) and stored in the catalog.
+        :param location - (lat, lng) : of the address, to record the circle searched in the catalog. Not recorded if None
+        """
+        entry = self.catalog.get_search(self.get_search_key(practitioner_type, address)) if self.catalog is not None else None
+        if entry is not None:
+            (links, fetched_at) = entry
+            metrics.inc("catalog_hits_total")
+            if self.catalog.is_stale(fetched_at):
+                self._schedule_catalog_refresh(self._refresh_search, practitioner_type, address, location)
+            yield from links
+            return
+        if self.catalog is not None:
+            metrics.inc("catalog_misses_total")
+        yield from self._iter_searched_doctor_links(practitioner_type, address, location)
+
+    def _iter_searched_doctor_links(self, practitioner_type, address, location):
+        """ searches the profile links around the address on doctolib.fr, and stores them in the catalog once they are all found """
+        links = []
+        doctors = self.iter_doctors_around_address(practitioner_type, address)
+        while True:
+            try:
+                doctor = next(doctors)
+            except StopIteration as stop:
+                result = stop.value
+                break
+            links.append(doctor['link'])
+            yield doctor['link']
+        if self.catalog is None:
+            return
+        if result == SearchResult.FAILED:
+            # the links found so far aren't the whole search, it is done again next run
+            self.logger.warn(f"search {self.get_search_url(practitioner_type, address)} failed, it isn't stored in the catalog")
+            return
+        if links:  # an empty search is more likely a blocked request, it is done again next run
+            self.catalog.put_search(self.get_search_key(practitioner_type, address), links)
+        if result == SearchResult.COMPLETE and location is not None:
+            self.catalog.put_search_coverage(practitioner_type, location[0], location[1], self.get_max_dist_from_address_km(address), links)
+
+    def _refresh_search(self, practitioner_type, address, location):
+        for _ in self._iter_searched_doctor_links(practitioner_type, address, location):
+            pass
+
+    def iter_doctors_around_address(self, practitioner_type, address=None):
+        """
+        generator that lazily pages through doctolib's search results of practitioner_type around the address.
+        Doctors are yielded as their page arrives, and no more pages are fetched once a doctor is further than max_dist_from_address_km
+        (results are sorted by distance).
+        :param practitioner_type - str : as given in the config's practitioner_types
+        :param address - dict : one of get_addresses(), the config's address if None
+        :return generator of doctor dicts, as returned in the search's data/doctors. Its return value is a SearchResult
+        """
+        max_dist_km = self.get_max_dist_from_address_km(address)
+        max_pages = self.config_data.get("max_search_pages")
+        url = self.get_search_url(practitioner_type, address)
+
+        page = 1
+        while not max_pages or page <= max_pages:
+            page_url = url if page == 1 else f"{url}?page={page}"
+            self.logger.info(f"Address URL to parse : {page_url}")
+            with metrics.time_stage("address_search"):
+                json_data = self.url_com.request_from_json_url(page_url)
+            if not json_data:
+                return SearchResult.FAILED
+            doctors = json_data.get("data", {}).get("doctors", [])
+            if not doctors:
+                return SearchResult.COMPLETE  # we went past the last page
+            for doctor in doctors:
+                if 'distance' in doctor.keys() and float(doctor['distance']) >= max_dist_km:
+                    return SearchResult.COMPLETE  # max distance has been reached, we can stop
+                yield doctor
+            page += 1
+        return SearchResult.MAX_PAGES_REACHED
 
     def fetch_practitioner_urls_from_organization(self, organization_profile_url):
         """
@@ -126,7 +470,7 @@ class AvailabilityReminder():
 
         # fetch all necessary data to sort out and classify our profile(s)
         url = f"{p_url}.json"
-        json_data = DoctolibUrlCom().request_from_json_url(url)
+        json_data = self.url_com.request_from_json_url(url)
         if json_data is None:
             utils.logger.error(f"[ERROR] link {url} couldn't fetch the json data. Does {organization_profile_url} have the format (...)doctolib.fr/type/city/name(...) ?")
             return None
@@ -140,51 +484,107 @@ class AvailabilityReminder():
                         practitioner_urls.append(f"https://www.doctolib.fr{link}")
         return practitioner_urls
 
-    def find_available_slots(self):
-        """
-        will parse all of the practitioners calendars and extract the next available slot for each of the visit motives
-        that might interest us. If the next available slot is within the maximum date set in the config, it'll add the info
-        to any mail content and send an email reminder.
-        """
-        available_slot = False
+    def get_max_reminder_date(self):
+        """ :return str YYYY-MM-DD : latest slot date that triggers a reminder, based on the config """
         max_date = datetime.today()
         if self.config_data["max_days_from_today_for_reminder"]:
             max_date = max_date + timedelta(days=int(self.config_data["max_days_from_today_for_reminder"]))
         max_date = max_date.strftime("%Y-%m-%d")
         if self.config_data["max_date_slot_for_reminder"]:
-            if utils.compare_dates(self.config_data["max_date_slot_for_reminder"], datetime.today()) == -1:
+            max_date_slot_for_reminder = str(self.config_data["max_date_slot_for_reminder"])
+            if utils.compare_dates(max_date_slot_for_reminder, datetime.today().strftime("%Y-%m-%d")) == -1:
                 # in case the date given is previous to today, we ignore the value.
                 pass
-            elif utils.compare_dates(self.config_data["max_date_slot_for_reminder"], max_date) == -1:
-                max_date = self.config_data["max_date_slot_for_reminder"]
- 
+            elif utils.compare_dates(max_date_slot_for_reminder, max_date) == -1:
+                max_date = max_date_slot_for_reminder
+        return max_date
+
+    def narrow_practitioner(self, practitioner):
+        """ trims the practitioner's visit motives and agendas based on the config's keywords """
+        with metrics.time_stage("keyword_narrowing"):
+            practitioner.narrow_search_based_on_keywords(keyword_matcher=self.keyword_matcher)
+
+    def check_practitioner_slots(self, practitioner, max_date):
+        """
+        fetches the next available slots of the practitioner, flags the ones that need a reminder and adds them to the email.
+        :param max_date - str : YYYY-MM-DD, see get_max_reminder_date
+        :return bool : True if at least one slot needs a reminder
+        """
+        self.fetch_practitioner_slots(practitioner, max_date)
+        return self.evaluate_practitioner_slots(practitioner, max_date)
+
+    def fetch_practitioner_slots(self, practitioner, max_date):
+        """
+        fills the practitioner's next_slots. With the config's fetch_slot_window, every slot up to max_date is fetched (with
+        their times), else only the next available date of each motive/agenda/practice
+        """
+        max_concurrent_requests = self.config_data.get("max_concurrent_requests", 1)
+        with metrics.time_stage("availability_probing"):
+            if self.config_data.get("fetch_slot_window"):
+                practitioner.get_available_slots_in_window(max_date, max_concurrent_requests=max_concurrent_requests)
+            else:
+                practitioner.get_next_available_appointment(max_concurrent_requests=max_concurrent_requests)
+
+    def evaluate_practitioner_slots(self, practitioner, max_date):
+        """
+        flags the practitioner's next_slots that need a reminder and adds them to the email, without fetching anything.
+        :param max_date - str : YYYY-MM-DD, see get_max_reminder_date
+        :return bool : True if at least one slot needs a reminder
+        """
+        return self.evaluate_slots([practitioner], max_date)
+
+    def evaluate_slots(self, practitioners, max_date):
+        """
+        same as evaluate_practitioner_slots for several practitioners at once : their slots are gathered in a SlotStore, so
+        the slots within the reminder window are found in a single vectorized pass.
+        :return bool : True if at least one slot needs a reminder
+        """
+        store = SlotStore(practitioners)
+        practitioners_to_remind = set()  # indexes in practitioners
+        slots_in_window = {}             # slots_in_window[index in practitioners] = list of slot dicts before max_date
+        for row in store.rows_before(max_date):
+            practitioner = store.get_practitioner(row)
+            slots_in_window.setdefault(int(store.practitioner_indexes[row]), []).append(store.slots[row])
+            if self.slot_state is None or self.slot_state.is_new_or_earlier(practitioner.slug_name, store.slots[row]):
+                store.slots[row]["send_reminder"] = True
+                practitioners_to_remind.add(int(store.practitioner_indexes[row]))
+        for i, practitioner in enumerate(practitioners):
+            if i in practitioners_to_remind:
+                self.add_practitioner_slot_events(practitioner)
+            if self.slot_state is not None:
+                # only the slots within the window are remembered, the later ones are reminded once the window reaches them
+                self.slot_state.update_practitioner(practitioner.slug_name, slots_in_window.get(i, []), practitioner.answered_triples)
+        if len(practitioners) > 1 and len(store):
+            earliest_rows = store.earliest_rows(NUM_OF_EARLIEST_SLOTS_LOGGED)
+            self.logger.info("earliest slots found:\n" + "\n".join(store.describe_row(row) for row in earliest_rows))
+        return len(practitioners_to_remind) > 0
+
+    def find_available_slots(self):
+        """
+        will parse all of the practitioners calendars and extract the next available slot for each of the visit motives
+        that might interest us. If the next available slot is within the maximum date set in the config, it'll add the info
+        to any mail content and send an email reminder.
+        """
+        max_date = self.get_max_reminder_date()
         for p in self.practitioners:
             self.logger.info(f"Looking for slots in {p.practitioner_name}'s calendar...")
-            p.narrow_search_based_on_keywords(keywords=self.config_data["visiting_motive_keywords"], 
-                                              forbidden_keywords=self.config_data["visiting_motive_forbidden_keywords"])
-            found_slot = p.get_next_available_appointment()
-            if found_slot:
-                for slot in p.next_slots:
-                    if utils.compare_dates(slot["date"], max_date) == -1:
-                        slot["send_reminder"] = True
-                        available_slot = True
-                if any(slot.get("send_reminder") for slot in p.next_slots):                
-                    self.add_practitioner_slot_to_email(p)
-        return available_slot
+            self.narrow_practitioner(p)
+            self.fetch_practitioner_slots(p, max_date)
+        return self.evaluate_slots(self.practitioners, max_date)
         
-    def add_practitioner_slot_to_email(self, practitioner):
-        """ 
-        if any of the practitionner's next_slots has a send_reminder set to true, it'll add all the reminders
-        to the email bloc.
-        """
-        if practitioner.next_slots and not any(slot.get("send_reminder") for slot in practitioner.next_slots):
-            return
-        self.email_message += f"Practitioner : {practitioner.practitioner_name}\nType : {practitioner.speciality_name}\n"
-        self.email_message += f"Next available slots :\n"
-        for slot in practitioner.next_slots:
-            if slot["send_reminder"]:
-                self.email_message += f"{practitioner.visit_motives[slot['motive_id']]} : {slot['date']}\n"
-        self.email_message += "\n\n"
+    def add_practitioner_slot_events(self, practitioner):
+        """ adds a SlotEvent for each of the practitioner's next_slots that has send_reminder set to true, to be sent by send_reminders """
+        self.slot_events += [SlotEvent.from_slot(practitioner, slot) for slot in practitioner.next_slots if slot["send_reminder"]]
+
+    def send_reminders(self):
+        """ hands the events added by add_practitioner_slot_events to the notifier's sinks, they are delivered in the background """
+        self.notifier.notify(self.slot_events)
+        self.slot_events = []
+
+    def export_metrics(self):
+        """ writes the metrics collected so far to the config's metrics_file, if any """
+        if self.config_data.get("metrics_file"):
+            metrics.export(CURR_FOLDER.parent/self.config_data["metrics_file"], self.config_data.get("metrics_format") or "prometheus")
 
     def run(self):
         """
@@ -192,14 +592,67 @@ class AvailabilityReminder():
         """
         self.fetch_practitioners_data()
         available_slots = self.find_available_slots()
+        if self.slot_state is not None:
+            self.slot_state.save()
         if available_slots:
-            self.email_sender.create_email_message(subject="[Doctolib Availability Reminder] New slots available !",
-                                                   message=self.email_message)  # assuming environment variable ES_RECEIPIENTS is set
-            self.email_sender.send_email()
+            self.send_reminders()
         else:
             self.logger.info("no available slots were found")
-            
+        self.notifier.flush()
+        self.wait_for_catalog_refresh()
+        DoctolibUrlCom().flush()
+        self.export_metrics()
+
+    def run_daemon(self, max_polls=None):
+        """
+        resident mode: practitioners are discovered once, then each of them is polled on its own schedule (see PollScheduler),
+        and a reminder is sent as soon as a poll finds a new slot. Stops after max_polls polls if given, or on KeyboardInterrupt.
+        """
+        if self.slot_state is None:
+            # without it, every poll would remind the same slots again
+            self.logger.info("daemon mode always remembers the reminded slots, as if only_notify_new_slots was set")
+            self.slot_state = SlotState(self.get_state_file())
+        self.fetch_practitioners_data()
+        for p in self.practitioners:
+            self.narrow_practitioner(p)
+        practitioners_by_slug = {p.slug_name: p for p in self.practitioners}
+
+        scheduler = PollScheduler(min_interval_s=float(self.config_data.get("daemon_min_poll_interval_s") or 5*60),
+                                  max_interval_s=float(self.config_data.get("daemon_max_poll_interval_s") or 6*60*60))
+        scheduler.set_budget([len(p.plan_availability_queries()) for p in self.practitioners],
+                             *DoctolibUrlCom().request_limits[UrlType.AVALIABILITIES])
+        for i, p in enumerate(self.practitioners):
+            scheduler.add(p.slug_name, delay_s=i * scheduler.budget_floor_s / max(1, len(self.practitioners)))  # spread the first polls
+        self.logger.info(f"daemon started, polling {len(self.practitioners)} practitioners, at most every {scheduler.budget_floor_s:.0f}s each")
+
+        num_of_polls = 0
+        metrics_export_interval_s = float(self.config_data.get("metrics_export_interval_s") or 60)
+        last_metrics_export = time.time()
+        try:
+            while len(scheduler) and (max_polls is None or num_of_polls < max_polls):
+                slug_name, wait_s = scheduler.pop_next()
+                if wait_s > 0.0:
+                    time.sleep(wait_s)
+                p = practitioners_by_slug[slug_name]
+                previous_date = min((slot["date"] for slot in p.next_slots), default=None)
+                max_date = self.get_max_reminder_date()
+                self.logger.info(f"Looking for slots in {p.practitioner_name}'s calendar...")
+                if self.check_practitioner_slots(p, max_date):
+                    self.send_reminders()
+                self.slot_state.save()
+                DoctolibUrlCom().flush()
+                new_date = min((slot["date"] for slot in p.next_slots), default=None)
+                scheduler.add(slug_name, scheduler.get_interval(previous_date, new_date, max_date))
+                num_of_polls += 1
+                if time.time() - last_metrics_export >= metrics_export_interval_s:
+                    self.export_metrics()
+                    last_metrics_export = time.time()
+        except KeyboardInterrupt:
+            self.logger.info("daemon stopped")
+        self.notifier.flush()
+        DoctolibUrlCom().flush()
+        self.export_metrics()
+        
 if __name__ == "__main__":
-    duc = DoctolibUrlCom()
     ar = AvailabilityReminder()
     ar.run()
\ No newline at end of file
@@ -4,16 +4,19 @@ number of requests made.
 TODO: use it more appropriately, check the allowed number of requests of every call made to doctolib and tune this file in accordance to it
 """
 import sys
-import json
-import requests
+import time
+import threading
 
 from enum import Enum
 from pathlib import Path
-from datetime import datetime
-from requests_ip_rotator import ApiGateway
 
-sys.path.insert(0, "sample")
+if "sample" not in sys.path:
+    sys.path.insert(0, "sample")
 import utils
+from Metrics import metrics
+from RateLimiter import RateLimiter
+from RequestLedger import RequestLedger
+from ResponseCache import ResponseCache
 
 
 CURR_FOLDER = Path(__file__).parent.resolve()
@@ -41,6 +44,13 @@ REQUEST_RATE_PER_TIME_LIMIT = {
     UrlType.ONLINE_BOOKING:   5000
 }
 
+# how many seconds a cached response can be served instead of requesting doctolib.fr again
+CACHE_TTL_S = {
+    UrlType.MAIN_DOCTOLIB_FR: 6*60*60,   # 6 hours, address searches and organizations
+    UrlType.AVALIABILITIES:   5*60,      # 5 minutes
+    UrlType.ONLINE_BOOKING:   12*60*60   # 12 hours, profiles
+}
+
 class Singleton(type):
     _instances = {}
     def __call__(cls, *args, **kwargs):
@@ -55,43 +65,91 @@ class DoctolibUrlCom(metaclass=Singleton):
     class that will communicate with doctolib.fr. Used mainly torequest and track amount
     of requests as to not become banned, so there should only be one instance of this class
     """
-    def __init__(self, save_url_request_time=False, *args, **kwargs):
+    def __init__(self, save_url_request_time=False, cache_responses=False, cache_max_entries=5000, max_wait_for_request_s=0.0,
+                 transport="gateway", transport_options=None, request_limits=None, *args, **kwargs):
+        """
+        :param save_url_request_time - bool : if True, requests are recorded in a RequestLedger shared by every process of the machine,
+                                              so the limits are respected across runs
+        :param cache_responses - bool : if True, responses are cached on disk, see ResponseCache. Ignored by the offline transports
+                                         and the record transport, see transport
+        :param cache_max_entries - int : maximum number of cached responses
+        :param max_wait_for_request_s - float : how long request_from_json_url can wait for the rate limiter before giving up
+        :param transport - str : how requests are sent, one of Transport.TRANSPORTS' keys (direct, gateway, local, record, replay)
+        :param transport_options - dict : given to the transport's constructor (pool_maxsize, keep_alive, local_base_url...)
+        :param request_limits - dict : request_limits[url_type] = (rate, period_s), defaults to REQUEST_RATE_PER_TIME_LIMIT and
+                                       REQUEST_TIME_LIMIT_S. Only meant for stand-in servers, doctolib.fr needs the defaults
+        """
         self.save_url_request_time = save_url_request_time
-        self._builtin_open = open  # to be able to call it during destruction
+        self.max_wait_for_request_s = max_wait_for_request_s
         self.logger =  utils.logger
-        self.gateway_doctoliburl = ApiGateway("http://www.doctolib.fr")
-        self.gateway_doctoliburl.start()
-        self.session = requests.Session()         
+        self.response_cache = ResponseCache(max_entries=cache_max_entries) if cache_responses else None
+        self.request_limits = request_limits or {url_type: (REQUEST_RATE_PER_TIME_LIMIT[url_type], REQUEST_TIME_LIMIT_S[url_type])
+                                                 for url_type in REQUEST_TIME_LIMIT_S.keys()}
+        self.rate_limiter = RateLimiter(self.request_limits)
+        # the transport (requests, and the ApiGateway for the gateway transport) is only loaded on the first real request
+        self._transport = None
+        self._transport_name = transport
+        self._transport_options = transport_options or {}
+        self._transport_lock = threading.Lock()
+        self.request_ledger = None
         if self.save_url_request_time:
-            url_com_data = utils.get_file_json_data(URL_COM_FILE)
-        else:
-            url_com_data = None
+            self.request_ledger = RequestLedger(max_period_s=max(period_s for _, period_s in self.request_limits.values()))
+            self.import_url_com_file()
+
+    def import_url_com_file(self):
+        """
+        older versions stored the date of every request in URL_COM_FILE. If the ledger is still empty, these requests are imported
+        """
+        if not URL_COM_FILE.exists() or not self.request_ledger.is_empty():
             return
-        if url_com_data and {'MAIN_DOCTOLIB_FR', 'AVALIABILITIES', 'ONLINE_BOOKING'}.issubset(url_com_data.keys()):
-            self._requests_dates = {
-                UrlType.MAIN_DOCTOLIB_FR: url_com_data['MAIN_DOCTOLIB_FR'],
-                UrlType.AVALIABILITIES: url_com_data['AVALIABILITIES'],
-                UrlType.ONLINE_BOOKING: url_com_data['ONLINE_BOOKING']
-            }
-        else:
-            self._requests_dates = {
-                UrlType.MAIN_DOCTOLIB_FR: [],
-                UrlType.AVALIABILITIES: [],
-                UrlType.ONLINE_BOOKING: []
-            }
+        url_com_data = utils.get_file_json_data(URL_COM_FILE)
+        if not url_com_data:
+            return
+        for url_type in REQUEST_TIME_LIMIT_S.keys():
+            if isinstance(url_com_data[url_type.name], list):
+                self.request_ledger.import_request_dates(url_type.name, url_com_data[url_type.name])
 
-    def __del__(self):
-        if self.save_url_request_time:
-            self.dump_to_url_com_file()
-    
-    def dump_to_url_com_file(self):
-        dump_data = {
-            'MAIN_DOCTOLIB_FR': self._requests_dates[UrlType.MAIN_DOCTOLIB_FR],
-            'AVALIABILITIES':self._requests_dates[UrlType.AVALIABILITIES],
-            'ONLINE_BOOKING':self._requests_dates[UrlType.ONLINE_BOOKING]
-        }
-        with self._builtin_open(URL_COM_FILE, 'w') as f:
-            json.dump(dump_data, f, indent=4, sort_keys=True, default=str)
+    @classmethod
+    def from_config(cls, config_data, request_limits=None):
+        """
+        creates the instance with the SOFTWARE_CONFIG values of the config.yaml. As it is a singleton, this has to be the first
+        instantiation to be taken into account
+        :param config_data - dict : as returned by utils.read_config_file()
+        :param request_limits - dict : see __init__
+        """
+        return cls(save_url_request_time=bool(config_data.get("save_url_request_time")),
+                   cache_responses=bool(config_data.get("cache_responses")),
+                   cache_max_entries=int(config_data.get("cache_max_entries") or 5000),
+                   max_wait_for_request_s=float(config_data.get("max_wait_for_request_s") or 0.0),
+                   transport=config_data.get("transport") or "gateway",
+                   transport_options=config_data.get("transport_options"),
+                   request_limits=request_limits)
+
+    def flush(self):
+        """
+        writes what is kept in memory to disk, i.e. the response cache's index. Call it at the end of every run (or poll): the
+        singleton is never finalized, and without its index the next run can neither read nor evict the cached responses
+        """
+        if self.response_cache is not None:
+            self.response_cache.save()
+
+    @property
+    def transport(self):
+        """
+        the Transport used to send requests, created on first use. The response cache is disabled for the offline transports,
+        so that archived responses never end up in the live cache (and are always the ones replayed), and for the record
+        transport, as cached responses never reach it and would be missing from the recording
+        """
+        if self._transport is None:
+            with self._transport_lock:
+                if self._transport is None:
+                    from Transport import create_transport
+                    transport = create_transport(self._transport_name, **self._transport_options)
+                    if self.response_cache is not None and (transport.is_offline or self._transport_name == "record"):
+                        self.logger.info(f"response cache disabled with the {self._transport_name} transport")
+                        self.response_cache = None
+                    self._transport = transport
+        return self._transport
 
     def request_from_json_url(self, url):
         """
@@ -99,38 +157,68 @@ class DoctolibUrlCom(metaclass=Singleton):
         """
         # Parse the JSON content
         url_type = self.get_url_type(url)
-        if self.is_request_allowed(url_type):
+        # the transport is created (and its modules imported) before the cache lookup, as it tells whether the cache can be used,
+        # and before the timer, so the wait only measures the rate limits
+        self.transport
+        if self.response_cache is not None and url_type in CACHE_TTL_S:
+            json_data = self.response_cache.get(url, CACHE_TTL_S[url_type])
+            metrics.inc("cache_lookups_total", url_type=url_type.name, result="miss" if json_data is None else "hit")
+            if json_data is not None:
+                return utils.CustomJSON(json_data)
+        wait_start = time.perf_counter()
+        request_allowed = self.is_request_allowed(url_type, self.max_wait_for_request_s)
+        metrics.observe("rate_limiter_wait_seconds", time.perf_counter() - wait_start, url_type=url_type.name)
+        if request_allowed:
+            import requests  # only loaded once a request is really made
+            request_start = time.perf_counter()
             try:
-                self.session.mount(url, self.gateway_doctoliburl)
-                headers = {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
-                }
-                response = self.session.get(url, headers=headers)
+                response = self.transport.get(url)
+                metrics.inc("responses_total", url_type=url_type.name, status_code=response.status_code)
+                self.rate_limiter.report_response(url_type, response.status_code)
                 response.raise_for_status()  # Check for any request errors
-                json_data = response.json()
-            except requests.exceptions.RequestException as e:
+                json_data = utils.json_loads(response.content)
+            except (requests.exceptions.RequestException, ValueError) as e:  # json decoding errors are ValueErrors
+                metrics.inc("request_errors_total", url_type=url_type.name, error=type(e).__name__)
                 self.logger.error(f"Error: Unable to fetch JSON data from the URL: {e}")
                 return False
-            if self.save_url_request_time:
-                self._requests_dates[url_type].append(datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f"))
-                self.dump_to_url_com_file()
+            finally:
+                metrics.observe("request_duration_seconds", time.perf_counter() - request_start, url_type=url_type.name)
+            if self.response_cache is not None and url_type in CACHE_TTL_S:
+                self.response_cache.put(url, json_data)
             return utils.CustomJSON(json_data)
         else:
+            metrics.inc("requests_denied_total", url_type=url_type.name)
             return None
     
-    def is_request_allowed(self, url_type):
+    def is_request_allowed(self, url_type, max_wait_s=0.0):
         """
-        cleans the too old requests from given type, and returns if we can request or not 
+        takes a token from the rate limiter of given type and, if requests are saved, records the request in the shared ledger.
+        Returns if we can request or not
+        :param max_wait_s - float : how long we can wait for the request to be allowed
         """
         if type(url_type) != UrlType or url_type == UrlType.NONE:
             return False
-        elif url_type == UrlType.UNKNOWN or not self.save_url_request_time:
+        elif url_type == UrlType.UNKNOWN or self.transport.is_offline:
+            return True
+        deadline = time.time() + (max_wait_s or 0.0)
+        if max_wait_s and max_wait_s > 0.0:
+            if not self.rate_limiter.acquire(url_type, timeout=max_wait_s):
+                return False
+        elif not self.rate_limiter.try_acquire(url_type):
+            return False
+        if self.request_ledger is None:
             return True
-        
-        curr_time = datetime.now()
-        # first we clean the _requests_dates
-        self._requests_dates[url_type] = [d for d in self._requests_dates[url_type] if (curr_time - datetime.strptime(d, '%Y-%m-%d %H:%M:%S.%f')).total_seconds() < REQUEST_TIME_LIMIT_S[url_type]]
-        return len(self._requests_dates[url_type]) < REQUEST_RATE_PER_TIME_LIMIT[url_type]
+
+        # the ledger enforces the budget of every process of the machine. If it denies the request, the token is given back
+        while True:
+            (rate, period_s) = self.request_limits[url_type]
+            retry_after_s = self.request_ledger.try_record(url_type.name, rate, period_s)
+            if retry_after_s == 0.0:
+                return True
+            if time.time() + retry_after_s > deadline:
+                self.rate_limiter.release(url_type)
+                return False
+            time.sleep(retry_after_s)
 
     @staticmethod
     def get_url_type(url):
@@ -0,0 +1,160 @@
+"""
+Sends the reminder emails in the background, so that polling never waits on the SMTP server:
+- emails are queued by enqueue, and a worker thread sends them on a single authenticated SMTP connection, kept open while
+  there is something to send and closed after idle_timeout_s
+- the emails waiting for the same recipients are merged into a single email, up to max_batch_size of them
+- failed emails are retried with an exponential backoff, and dropped after max_retries attempts
+Call flush before the process exits (e.g. at the end of a run on AWS lambda), to wait for the queue to be sent.
+"""
+import sys
+import time
+import queue
+import threading
+
+if "sample" not in sys.path:
+    sys.path.insert(0, "sample")
+import utils
+from Metrics import metrics
+
+
+class OutgoingEmail:
+    def __init__(self, subject, message, recipients):
+        self.subject = subject
+        self.message = message
+        self.recipients = recipients
+        self.attempts = 0
+        self.not_before = 0.0  # time.time() before which it isn't retried
+
+
+class EmailOutbox:
+    def __init__(self, email_sender, max_batch_size=20, max_retries=5, initial_backoff_s=5.0, max_backoff_s=300.0, idle_timeout_s=30.0):
+        """
+        :param email_sender - EmailSender
+        :param max_batch_size - int : how many queued emails to the same recipients can be merged into one
+        :param max_retries - int : attempts before an email is dropped
+        :param initial_backoff_s - float : wait before the first retry, doubled at every retry up to max_backoff_s
+        :param idle_timeout_s - float : the SMTP connection is closed when nothing was sent for that long
+        """
+        self.logger = utils.logger
+        self.email_sender = email_sender
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_retries = max(1, int(max_retries))
+        self.initial_backoff_s = initial_backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.idle_timeout_s = idle_timeout_s
+        self._queue = queue.Queue()
+        self._retries = []  # OutgoingEmail waiting for their backoff, only used by the worker
+        self._pending = 0   # emails enqueued and not sent or dropped yet
+        self._pending_changed = threading.Condition()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, email_sender, config_data):
+        return cls(email_sender,
+                   max_batch_size=int(config_data.get("email_max_batch_size") or 20),
+                   max_retries=int(config_data.get("email_max_retries") or 5),
+                   initial_backoff_s=float(config_data.get("email_retry_backoff_s") or 5.0))
+
+    def enqueue(self, subject, message, recipients=None):
+        """
+        queues an email, sent in the background.
+        :param recipients - str : comma separated, the ES_RECIPIENTS environment variable if None
+        :return bool : False if there is no recipient to send it to
+        """
+        recipients = self.email_sender.get_recipients(recipients)
+        if recipients is None:
+            return False
+        with self._pending_changed:
+            self._pending += 1
+        self._queue.put(OutgoingEmail(subject, message, recipients))
+        self._start_worker()
+        return True
+
+    def flush(self, timeout_s=None):
+        """
+        waits until every queued email is sent or dropped.
+        :return bool : False if timeout_s expired first
+        """
+        with self._pending_changed:
+            return self._pending_changed.wait_for(lambda: self._pending == 0, timeout=timeout_s)
+
+    def _start_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                # daemon, so a forgotten outbox never keeps the process alive. Use flush to make sure everything is sent
+                self._worker = threading.Thread(target=self._run, name="EmailOutbox", daemon=True)
+                self._worker.start()
+
+    def _done(self, num_of_emails):
+        with self._pending_changed:
+            self._pending -= num_of_emails
+            self._pending_changed.notify_all()
+
+    def _next_batch(self):
+        """ :return list of OutgoingEmail ready to be sent, waiting for at most idle_timeout_s. Empty if there are none """
+        now = time.time()
+        ready = [email for email in self._retries if email.not_before <= now]
+        self._retries = [email for email in self._retries if email.not_before > now]
+        if not ready:
+            timeout_s = self.idle_timeout_s
+            if self._retries:
+                timeout_s = min(timeout_s, max(0.0, min(email.not_before for email in self._retries) - now))
+            try:
+                ready.append(self._queue.get(timeout=timeout_s))
+            except queue.Empty:
+                return []
+        while True:
+            try:
+                ready.append(self._queue.get_nowait())
+            except queue.Empty:
+                return ready
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self._retries:
+                    continue  # woke up for a retry that isn't due yet
+                # idle for idle_timeout_s
+                self.email_sender.close()
+                with self._worker_lock:
+                    # enqueue starts a new worker if an email comes in after this check
+                    if self._queue.empty():
+                        self._worker = None
+                        return
+                continue
+            # emails to the same recipients are merged, max_batch_size at a time
+            emails_by_recipients = {}
+            for email in batch:
+                emails_by_recipients.setdefault(email.recipients, []).append(email)
+            for recipients, emails in emails_by_recipients.items():
+                for i in range(0, len(emails), self.max_batch_size):
+                    self._send(recipients, emails[i:i + self.max_batch_size])
+
+    def _send(self, recipients, emails):
+        if len(emails) == 1:
+            subject, message = emails[0].subject, emails[0].message
+        else:
+            subject = emails[-1].subject
+            message = "\n\n".join(email.message for email in emails)
+        try:
+            with metrics.time_stage("email"):
+                self.email_sender.send_message(self.email_sender.build_message(subject, message, recipients))
+        except Exception as e:
+            metrics.inc("email_send_errors_total", error=type(e).__name__)
+            dropped = 0
+            for email in emails:
+                email.attempts += 1
+                if email.attempts >= self.max_retries:
+                    dropped += 1
+                    continue
+                email.not_before = time.time() + min(self.max_backoff_s, self.initial_backoff_s * 2 ** (email.attempts - 1))
+                self._retries.append(email)
+            self.logger.error(f"Error sending email reminder to {recipients}: {str(e)}. "
+                              f"{len(emails) - dropped} emails will be retried, {dropped} are dropped")
+            self._done(dropped)
+            return
+        metrics.inc("emails_sent_total")
+        self.logger.info(f"Email sent successfully to {recipients}! ({len(emails)} reminders)")
+        self._done(len(emails))
@@ -1,30 +1,37 @@
 """
 Class that'll allow the email reminders. For now it only supports the smtp way.
+A connection can be kept open to send several messages (see connect, send_message and close), EmailOutbox uses it to send
+reminders in the background.
 TODO: improve credentials handeling
 TODO: allow other type of email sending
 TODO: Error management
 """
 import os
 import sys
-import smtplib
 from pathlib import Path
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
-sys.path.insert(0, "sample")
+if "sample" not in sys.path:
+    sys.path.insert(0, "sample")
 import utils
 
 CURR_FOLDER = Path(__file__).parent.resolve()
 
 
 class EmailSender:
-    def __init__(self, server_name, port_number, email_user_name, email_password):
+    def __init__(self, server_name, port_number, email_user_name, email_password, use_starttls=True):
+        """
+        :param use_starttls - bool : False for servers that don't support it, like a local SMTP stand-in
+        """
         self.logger = utils.logger
         self.server_name = server_name
         self.port_number = port_number
         self.email_user_name = email_user_name
         self.email_password = email_password
-        self.mime_message = MIMEMultipart()
+        self.use_starttls = use_starttls
+        self.mime_message = None
+        self.server = None
     
     @classmethod
     def from_file(cls, json_file):
@@ -39,7 +46,8 @@ class EmailSender:
             port_number = smtp_conf_data['port_number']
             email_user_name = smtp_conf_data['email_user_name']
             email_password = smtp_conf_data['email_password']
-            return cls(server_name, port_number, email_user_name, email_password)
+            use_starttls = smtp_conf_data['use_starttls'] is not False  # CustomJSON gives None when missing
+            return cls(server_name, port_number, email_user_name, email_password, use_starttls)
         else:
             raise Exception(f"couldn't initialize with json file {json_file}")
 
@@ -47,13 +55,33 @@ class EmailSender:
     def from_env(cls):
         """
         In case you have your credentials as environment variables:
-        ES_SERVER_NAME, ES_PORT_NUMBER, ES_EMAIL_USER_NAME, ES_EMAIL_PASSWORD
+        ES_SERVER_NAME, ES_PORT_NUMBER, ES_EMAIL_USER_NAME, ES_EMAIL_PASSWORD, and optionally ES_USE_STARTTLS (true by default)
         """
         server_name = os.environ['ES_SERVER_NAME']
         port_number = int(os.environ['ES_PORT_NUMBER'])
         email_user_name = os.environ['ES_EMAIL_USER_NAME']
         email_password = os.environ['ES_EMAIL_PASSWORD']
-        return cls(server_name, port_number, email_user_name, email_password)
+        use_starttls = os.environ.get('ES_USE_STARTTLS', 'true').lower() not in ('false', '0', 'no')
+        return cls(server_name, port_number, email_user_name, email_password, use_starttls)
+
+    def get_recipients(self, recipients=None):
+        """ :return str : recipients, or the ES_RECIPIENTS environment variable if None. None if there are none """
+        if recipients is None:
+            try:
+                recipients=os.environ['ES_RECIPIENTS']
+            except Exception as e:
+                self.logger.error("No reciepients were given to emailSender, and couldn't fetch any from ES_RECEIPIENTS's environment variable either.")
+                return None
+        return recipients
+
+    def build_message(self, subject, message, recipients):
+        """ :return MIMEMultipart : a new message, so that messages never share their parts """
+        mime_message = MIMEMultipart()
+        mime_message['From'] = self.email_user_name
+        mime_message['To'] = recipients
+        mime_message['Subject'] = subject
+        mime_message.attach(MIMEText(message, 'plain'))
+        return mime_message
 
     def create_email_message(self, subject, message, recipients=None):
         """
@@ -61,31 +89,63 @@ class EmailSender:
         a single string separated by commas:'foo@bar.com, foo2@bar2.com'. If None, receipients
         will be taken from environment variable ES_RECEIPIENTS.
         """
-        self.mime_message['From'] = self.email_user_name
+        recipients = self.get_recipients(recipients)
         if recipients is None:
-            try:
-                recipients=os.environ['ES_RECIPIENTS']
-            except Exception as e:
-                self.logger.error("No reciepients were given to emailSender, and couldn't fetch any from ES_RECEIPIENTS's environment variable either.")
-                return False
-        self.mime_message['To'] = recipients
-        self.mime_message['Subject'] = subject
-        # Attach the message
-        self.mime_message.attach(MIMEText(message, 'plain'))
+            return False
+        self.mime_message = self.build_message(subject, message, recipients)
         return True
 
-    def send_email(self):
+    def connect(self):
+        """ opens and authenticates the SMTP connection, unless it is already open """
+        import smtplib  # only needed when an email is really sent
+        if self.server is not None:
+            return
+        server = smtplib.SMTP(self.server_name, self.port_number)
+        try:
+            if self.use_starttls:
+                server.starttls()
+            server.login(self.email_user_name, self.email_password)
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+
+    def close(self):
+        if self.server is None:
+            return
         try:
-            self.server = smtplib.SMTP(self.server_name, self.port_number)
-            self.server.starttls()
-            self.server.login(self.email_user_name, self.email_password)
-            self.server.sendmail(self.email_user_name, self.mime_message['To'], self.mime_message.as_string())
             self.server.quit()
+        except Exception:
+            self.server.close()  # the connection might already be lost
+        self.server = None
+
+    def send_message(self, mime_message):
+        """
+        sends mime_message on the open connection (opened if needed). Exceptions are raised, so the caller can retry. On a
+        connection error, the connection is dropped so that the next call opens a new one.
+        """
+        import smtplib
+        self.connect()
+        try:
+            self.server.sendmail(self.email_user_name, [r.strip() for r in mime_message['To'].split(",")], mime_message.as_string())
+        except Exception as e:
+            # SMTPExceptions are OSErrors too, only the disconnections and the socket errors mean the connection is lost
+            if isinstance(e, smtplib.SMTPServerDisconnected) or not isinstance(e, smtplib.SMTPException):
+                self.server.close()
+                self.server = None
+            raise
+
+    def send_email(self):
+        """ sends the message created by create_email_message on its own connection """
+        try:
+            self.send_message(self.mime_message)
             self.logger.info("Email sent successfully!")
             return True
         except Exception as e:
             self.logger.error(f"Error sending email reminder: {str(e)}")
             return False
+        finally:
+            self.close()
 
 if __name__ == "__main__":
     es = EmailSender.from_env()
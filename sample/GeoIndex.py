@@ -0,0 +1,143 @@
+"""
+Local geospatial index of the practices already discovered, so that searches around a new address can be answered without
+doctolib.fr when the practitioners around it are already known:
+- GeoIndex buckets points by geohash, and answers radius queries with the haversine distance
+- is_circle_covered tells if a search circle is inside the union of the circles already searched, i.e. if every practitioner
+  in it should already be known
+- geocode_address turns an address into coordinates with the api of the Base Adresse Nationale (api-adresse.data.gouv.fr)
+"""
+import sys
+import math
+from urllib.parse import urlencode
+
+if "sample" not in sys.path:
+    sys.path.insert(0, "sample")
+import utils
+
+EARTH_RADIUS_KM = 6371.0
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOCODING_URL = "https://api-adresse.data.gouv.fr/search/"
+# points of a search circle checked by is_circle_covered: its center, and COVERAGE_SAMPLES_PER_RING points on each ring
+COVERAGE_RINGS = (0.5, 0.85, 1.0)
+COVERAGE_SAMPLES_PER_RING = 16
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """ :return float : great-circle distance between two points, in km """
+    (lat1, lng1, lat2, lng2) = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2.0) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def encode_geohash(lat, lng, precision):
+    """ :return str : geohash of precision characters of the point """
+    (lat_range, lng_range) = ([-90.0, 90.0], [-180.0, 180.0])
+    geohash = ""
+    (bits, num_of_bits, is_lng) = (0, 0, True)
+    while len(geohash) < precision:
+        (value, value_range) = (lng, lng_range) if is_lng else (lat, lat_range)
+        middle = (value_range[0] + value_range[1]) / 2.0
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            value_range[0] = middle
+        else:
+            value_range[1] = middle
+        is_lng = not is_lng
+        num_of_bits += 1
+        if num_of_bits == 5:
+            geohash += GEOHASH_BASE32[bits]
+            (bits, num_of_bits) = (0, 0)
+    return geohash
+
+
+def get_geohash_cell_size(precision):
+    """ :return (lat_degrees, lng_degrees) : size of the cells of a geohash of that precision """
+    num_of_bits = 5 * precision
+    return (180.0 / 2 ** (num_of_bits // 2), 360.0 / 2 ** ((num_of_bits + 1) // 2))
+
+
+def get_destination(lat, lng, distance_km, bearing_rad):
+    """ :return (lat, lng) : the point at distance_km from (lat, lng) in the direction of bearing_rad (0 is north) """
+    angle = distance_km / EARTH_RADIUS_KM
+    (lat, lng) = (math.radians(lat), math.radians(lng))
+    dest_lat = math.asin(math.sin(lat) * math.cos(angle) + math.cos(lat) * math.sin(angle) * math.cos(bearing_rad))
+    dest_lng = lng + math.atan2(math.sin(bearing_rad) * math.sin(angle) * math.cos(lat), math.cos(angle) - math.sin(lat) * math.sin(dest_lat))
+    return (math.degrees(dest_lat), (math.degrees(dest_lng) + 540.0) % 360.0 - 180.0)
+
+
+def is_circle_covered(lat, lng, radius_km, circles):
+    """
+    :param circles - list of (lat, lng, radius_km) : the circles already searched
+    :return bool : True if the circle is inside the union of circles. Checked on sample points of the circle (see COVERAGE_RINGS),
+                   so a gap narrower than the space between them can be missed
+    """
+    points = [(lat, lng)] + [get_destination(lat, lng, ring * radius_km, 2.0 * math.pi * i / COVERAGE_SAMPLES_PER_RING)
+                             for ring in COVERAGE_RINGS for i in range(COVERAGE_SAMPLES_PER_RING)]
+    return all(any(haversine_km(p_lat, p_lng, c_lat, c_lng) <= c_radius_km for (c_lat, c_lng, c_radius_km) in circles)
+               for (p_lat, p_lng) in points)
+
+
+def geocode_address(address, url_com):
+    """
+    :param address - str : e.g. "1 rue des lois 31000 Toulouse"
+    :param url_com - object with a request_from_json_url method, e.g. DoctolibUrlCom, so the request goes through its transport
+    :return (lat, lng) - (float, float) : coordinates of the best match, None if the address couldn't be geocoded
+    """
+    json_data = url_com.request_from_json_url(f"{GEOCODING_URL}?{urlencode({'q': address, 'limit': 1})}")
+    if not json_data:
+        utils.logger.error(f"Failed to geocode '{address}', set its latitude and longitude in the config")
+        return None
+    features = json_data.get("features") or []
+    if not features:
+        utils.logger.error(f"No coordinates were found for '{address}', set its latitude and longitude in the config")
+        return None
+    (lng, lat) = features[0]["geometry"]["coordinates"]
+    return (lat, lng)
+
+
+class GeoIndex:
+    def __init__(self, points, precision=5):
+        """
+        :param points - iterable of (key, lat, lng) : a key can have several points, e.g. the practices of a practitioner
+        :param precision - int : geohash length of the buckets. 5 gives cells of about 5x5km
+        """
+        self.precision = precision
+        self.cell_size = get_geohash_cell_size(precision)
+        self._cells = {}  # _cells[geohash] = list of (key, lat, lng)
+        for (key, lat, lng) in points:
+            self._cells.setdefault(encode_geohash(lat, lng, precision), []).append((key, lat, lng))
+
+    def __len__(self):
+        return sum(len(points) for points in self._cells.values())
+
+    def _get_cells_around(self, lat, lng, radius_km):
+        """ :return set of str : geohashes of every cell intersecting the bounding box of the circle """
+        lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+        lng_delta = lat_delta / max(0.01, math.cos(math.radians(min(89.0, abs(lat) + lat_delta))))
+        (min_lat, max_lat) = (max(-90.0, lat - lat_delta), min(90.0, lat + lat_delta))
+        (min_lng, max_lng) = (max(-180.0, lng - lng_delta), min(180.0, lng + lng_delta))
+        (lat_step, lng_step) = self.cell_size
+        cells = set()
+        cell_lat = min_lat
+        while True:
+            cell_lng = min_lng
+            while True:
+                cells.add(encode_geohash(cell_lat, cell_lng, self.precision))
+                if cell_lng >= max_lng:
+                    break
+                cell_lng = min(max_lng, cell_lng + lng_step)
+            if cell_lat >= max_lat:
+                break
+            cell_lat = min(max_lat, cell_lat + lat_step)
+        return cells
+
+    def query_radius(self, lat, lng, radius_km):
+        """ :return list of (distance_km, key) : the keys with a point within radius_km of (lat, lng), closest first """
+        distance_by_key = {}
+        for cell in self._get_cells_around(lat, lng, radius_km):
+            for (key, p_lat, p_lng) in self._cells.get(cell, ()):
+                distance_km = haversine_km(lat, lng, p_lat, p_lng)
+                if distance_km <= radius_km and distance_km < distance_by_key.get(key, math.inf):
+                    distance_by_key[key] = distance_km
+        return sorted((distance_km, key) for key, distance_km in distance_by_key.items())
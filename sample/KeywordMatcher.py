@@ -0,0 +1,99 @@
+"""
+Matches the visiting_motive_keywords and visiting_motive_forbidden_keywords of a config against visit motive names.
+The keywords are normalized and compiled once per config into an Aho-Corasick automaton, that finds every keyword found in a
+motive (overlapping ones included) in a single pass over its text. Scores are memoized by motive text, as many clinics
+share the same motive names, so each distinct name is only scanned once per run.
+"""
+
+TRANSLATION_TABLE = str.maketrans("ëéèêàïîô'ç", "eeeeaiio-c")
+FORBIDDEN = -1  # keyword index of the forbidden keywords in the automaton's outputs
+
+
+def normalize_text(text):
+    """ lower case, without accents, as visit motives are stored in Practitioner """
+    return text.lower().translate(TRANSLATION_TABLE)
+
+
+class KeywordMatcher:
+    def __init__(self, keywords=[], forbidden_keywords=[]):
+        """
+        :param keywords - list of str : the more of them a motive has, the better
+        :param forbidden_keywords - list of str : motives containing any of them are rejected
+        """
+        self.keywords = [normalize_text(k) for k in keywords]
+        self.forbidden_keywords = [normalize_text(k) for k in forbidden_keywords]
+        self._scores = {}  # _scores[motive] = (is_forbidden, number of keywords found)
+        # automaton : _goto[state][char] = next state, _fail[state] = longest proper suffix state, _outputs[state] = keyword indexes
+        self._goto = [{}]
+        self._fail = [0]
+        self._outputs = [set()]
+        for index, keyword in enumerate(self.keywords):
+            self._add_keyword(keyword, index)
+        for keyword in self.forbidden_keywords:
+            self._add_keyword(keyword, FORBIDDEN)
+        self._build_fail_links()
+
+    def _add_keyword(self, keyword, index):
+        if not keyword:
+            return
+        state = 0
+        for char in keyword:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append(set())
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._outputs[state].add(index)
+
+    def _build_fail_links(self):
+        # breadth first, so the fail state of a node is always computed before the node's children need it
+        queue = list(self._goto[0].values())
+        while queue:
+            next_queue = []
+            for state in queue:
+                for char, child in self._goto[state].items():
+                    fail = self._fail[state]
+                    while fail and char not in self._goto[fail]:
+                        fail = self._fail[fail]
+                    self._fail[child] = self._goto[fail].get(char, 0) if state else 0
+                    self._outputs[child] |= self._outputs[self._fail[child]]
+                    next_queue.append(child)
+            queue = next_queue
+
+    def _scan(self, text):
+        """ :return set of the indexes of the keywords found in text, FORBIDDEN included if a forbidden keyword was found """
+        found = set()
+        state = 0
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if outputs[state]:
+                found |= outputs[state]
+        return found
+
+    def score(self, motive):
+        """
+        :param motive - str : normalized motive name (see normalize_text)
+        :return (is_forbidden, num_of_keyword_matches) - (bool, int) : whether motive contains a forbidden keyword, and the
+                number of distinct keywords it contains
+        """
+        score = self._scores.get(motive)
+        if score is None:
+            found = self._scan(motive)
+            score = (FORBIDDEN in found, len(found - {FORBIDDEN}))
+            self._scores[motive] = score  # several threads may compute the same score, they all get the same result
+        return score
+
+    def select_motives(self, visit_motives):
+        """
+        :param visit_motives - dict : visit_motives[motive_id] = normalized motive name
+        :return set of the motive ids to keep : the ones without forbidden keywords that have the highest number of keyword
+                matches among all motives (forbidden ones included)
+        """
+        scores = {motive_id: self.score(motive) for motive_id, motive in visit_motives.items()}
+        highest_num_of_keyword_matches = max([0] + [num_of_matches for _, num_of_matches in scores.values()])
+        return {motive_id for motive_id, (is_forbidden, num_of_matches) in scores.items()
+                if not is_forbidden and num_of_matches >= highest_num_of_keyword_matches}
@@ -0,0 +1,133 @@
+"""
+Counters and histograms collected during a run, to see where the time and the request budget go:
+- DoctolibUrlCom records the latency, status codes and errors of every request, the cache hits/misses and the time spent
+  waiting for the rate limiter, per UrlType
+- AvailabilityReminder times each stage of the pipeline with time_stage (address search, organization crawl, profile fetch
+  and parse, keyword narrowing, availability probing, email)
+The metrics can be exported as a Prometheus textfile (for node_exporter's textfile collector) or as json.
+Use the module's `metrics` instance, the same way as utils.logger.
+"""
+import json
+import time
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+# upper bounds of the histogram buckets, in seconds
+DURATION_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_PREFIX = "doctolib_reminder_"
+
+
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS_S):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)  # not cumulative, see cumulative_counts
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def cumulative_counts(self):
+        counts, total = [], 0
+        for count in self.bucket_counts:
+            total += count
+            counts.append(total)
+        return counts
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # _counters[(name, labels)] = value, labels being a sorted tuple of (key, value)
+        self._histograms = {}  # _histograms[(name, labels)] = Histogram
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(value)
+
+    @contextmanager
+    def time_stage(self, stage):
+        """ times the enclosed block as a pipeline stage. Stages can run on several threads at once, so their sum can exceed the wall time """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_duration_seconds", time.perf_counter() - start, stage=stage)
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+    def to_prometheus(self):
+        """ :return str in Prometheus' text exposition format """
+        lines = []
+        with self._lock:
+            for name in sorted(set(name for name, _ in self._counters)):
+                lines.append(f"# TYPE {METRICS_PREFIX}{name} counter")
+                for (n, labels), value in sorted(self._counters.items()):
+                    if n == name:
+                        lines.append(f"{METRICS_PREFIX}{name}{self._format_labels(labels)} {value}")
+            for name in sorted(set(name for name, _ in self._histograms)):
+                lines.append(f"# TYPE {METRICS_PREFIX}{name} histogram")
+                for (n, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if n != name:
+                        continue
+                    for upper_bound, count in zip(histogram.buckets, histogram.cumulative_counts()):
+                        lines.append(f"{METRICS_PREFIX}{name}_bucket{self._format_labels(labels, (('le', upper_bound),))} {count}")
+                    lines.append(f"{METRICS_PREFIX}{name}_bucket{self._format_labels(labels, (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{METRICS_PREFIX}{name}_sum{self._format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{METRICS_PREFIX}{name}_count{self._format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        """ :return dict that can be dumped in json """
+        with self._lock:
+            return {
+                "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in sorted(self._counters.items())],
+                "histograms": [{"name": name, "labels": dict(labels), "count": h.count, "sum": h.sum,
+                                "buckets": dict(zip([str(b) for b in h.buckets], h.cumulative_counts()))}
+                               for (name, labels), h in sorted(self._histograms.items(), key=lambda item: item[0])],
+            }
+
+    def export(self, file_path, metrics_format="prometheus"):
+        """
+        writes the metrics to file_path, atomically so a collector never reads half a file
+        :param metrics_format - str : 'prometheus' or 'json'
+        """
+        file_path = Path(file_path)
+        if metrics_format == "json":
+            content = json.dumps(self.to_dict(), indent=4)
+        else:
+            content = self.to_prometheus()
+        tmp_file = file_path.with_suffix(file_path.suffix + ".tmp")
+        tmp_file.write_text(content)
+        tmp_file.replace(file_path)
+
+
+metrics = Metrics()
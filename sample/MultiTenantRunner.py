@@ -0,0 +1,158 @@
+"""
+Runs several configs (one per person to remind) at once, while fetching everything they have in common only once:
+- profiles, organizations and address searches go through a SharedUrlCom, so a URL requested by several tenants is fetched once
+- the availabilities of a practitioner watched by several tenants are probed once, for the union of the tenants'
+  (motive, agenda, practice) triples, and the slots found are then handed back to each tenant
+Each tenant then applies its own date window, slot state and email recipients.
+The software part of the config (rate limits, cache, transport...) is taken from the first config, as DoctolibUrlCom is shared.
+"""
+import sys
+import copy
+import threading
+from pathlib import Path
+
+if "sample" not in sys.path:
+    sys.path.insert(0, "sample")
+import utils
+from Practitioner import project_profile_data
+from AvailabilityReminder import AvailabilityReminder
+from DoctolibUrlCom import DoctolibUrlCom, UrlType
+
+
+class SharedUrlCom:
+    """
+    wraps DoctolibUrlCom so that profiles, organizations and searches are fetched only once per run, even when several tenants
+    request them at the same time. Profiles are stored projected (see project_profile_data). Availabilities are not memoized, they are deduplicated by MultiTenantRunner itself.
+    """
+    def __init__(self, url_com):
+        self.url_com = url_com
+        self.num_of_shared_requests = 0
+        self._lock = threading.Lock()
+        self._results = {}    # _results[url] = json_data
+        self._in_flight = {}  # _in_flight[url] = threading.Event set once the result is available
+
+    def request_from_json_url(self, url):
+        if self.url_com.get_url_type(url) == UrlType.AVALIABILITIES:
+            return self.url_com.request_from_json_url(url)
+        with self._lock:
+            if url in self._results:
+                self.num_of_shared_requests += 1
+                return self._results[url]
+            event = self._in_flight.get(url)
+            is_owner = event is None
+            if is_owner:
+                event = self._in_flight[url] = threading.Event()
+        if not is_owner:
+            event.wait()
+            with self._lock:
+                self.num_of_shared_requests += 1
+                return self._results.get(url)
+        json_data = None
+        try:
+            json_data = self.url_com.request_from_json_url(url)
+            if json_data and self.url_com.get_url_type(url) == UrlType.ONLINE_BOOKING:
+                # profiles are kept for the whole run, only what Practitioner reads is kept
+                json_data = utils.CustomJSON({"data": project_profile_data(json_data.get("data"))})
+        finally:
+            with self._lock:
+                self._results[url] = json_data
+                del self._in_flight[url]
+            event.set()
+        return json_data
+
+
+class MultiTenantRunner:
+    def __init__(self, configs):
+        """
+        :param configs - list of (tenant_name, config_data)
+        """
+        self.logger = utils.logger
+        if not configs:
+            raise Exception("MultiTenantRunner needs at least one config")
+        self.shared_url_com = SharedUrlCom(DoctolibUrlCom.from_config(configs[0][1]))
+        self.tenants = []
+        for tenant_name, config_data in configs:
+            if not config_data.get("availability_reminder_data_file"):
+                # tenants can't share the same slot state, each one remembers what it has been reminded of
+                config_data["availability_reminder_data_file"] = f"data/availability_reminder_data_{tenant_name}.json"
+            self.tenants.append(AvailabilityReminder(config_data=config_data, url_com=self.shared_url_com))
+
+    @classmethod
+    def from_files(cls, config_files):
+        """ :param config_files - list of paths to config.yaml files. Each file's name (without extension) is the tenant name """
+        return cls([(Path(f).stem, utils.read_config_file(f)) for f in config_files])
+
+    @staticmethod
+    def merge_practitioners(practitioners):
+        """
+        creates a practitioner whose valid triples are the union of the given practitioners' ones (same slug, narrowed differently)
+        :param practitioners - list of Practitioner
+        :return Practitioner
+        """
+        merged = copy.copy(practitioners[0])
+        merged.visit_motives = {}
+        merged.agendas = {}
+        merged.next_slots = []
+        merged.answered_triples = set()
+        seen_triples = set()
+        for p in practitioners:
+            for motive_id, agenda_id, practice_id in p.get_valid_triples():
+                if (motive_id, agenda_id, practice_id) in seen_triples:
+                    continue
+                seen_triples.add((motive_id, agenda_id, practice_id))
+                merged.visit_motives[motive_id] = p.visit_motives[motive_id]
+                merged.agendas.setdefault(agenda_id, {}).setdefault(practice_id, []).append(motive_id)
+        return merged
+
+    @staticmethod
+    def dispatch_slots(merged, practitioner):
+        """
+        gives practitioner the slots of merged that belong to its own triples. A slot found for a group of agendas is kept if
+        any of them is one of the practitioner's. The answered triples are the ones of the queries (motive and practice) it shares
+        with merged, as its slots can be reported under any agenda of the query.
+        """
+        triples = {(motive_id, agenda_id, str(practice_id)) for motive_id, agenda_id, practice_id in practitioner.get_valid_triples()}
+        motive_practice_ids = {(motive_id, practice_id) for motive_id, _, practice_id in triples}
+        practitioner.answered_triples = {(motive_id, agenda_id, practice_id) for motive_id, agenda_id, practice_id in merged.answered_triples
+                                         if (motive_id, str(practice_id)) in motive_practice_ids}
+        practitioner.next_slots = []
+        for slot in merged.next_slots:
+            agenda_ids = slot.get("agenda_ids") or [slot["agenda_id"]]
+            if any((slot["motive_id"], agenda_id, str(slot["practice_id"])) in triples for agenda_id in agenda_ids):
+                practitioner.next_slots.append(dict(slot))
+
+    def run(self):
+        """ discovers and probes every tenant's practitioners once, then sends each tenant its own reminders """
+        for tenant in self.tenants:
+            tenant.fetch_practitioners_data()
+            for p in tenant.practitioners:
+                tenant.narrow_practitioner(p)
+
+        practitioners_by_slug = {}
+        for tenant in self.tenants:
+            for p in tenant.practitioners:
+                practitioners_by_slug.setdefault(p.slug_name, []).append(p)
+        self.logger.info(f"{len(self.tenants)} tenants watch {sum(len(t.practitioners) for t in self.tenants)} practitioners, "
+                         f"{len(practitioners_by_slug)} of them are unique")
+
+        # with fetch_slot_window, the window has to cover every tenant's
+        max_date = max(tenant.get_max_reminder_date() for tenant in self.tenants)
+        for slug_name, practitioners in practitioners_by_slug.items():
+            merged = self.merge_practitioners(practitioners)
+            self.logger.info(f"Looking for slots in {merged.practitioner_name}'s calendar...")
+            self.tenants[0].fetch_practitioner_slots(merged, max_date)
+            for p in practitioners:
+                self.dispatch_slots(merged, p)
+
+        for tenant in self.tenants:
+            max_date = tenant.get_max_reminder_date()
+            available_slots = tenant.evaluate_slots(tenant.practitioners, max_date)
+            if tenant.slot_state is not None:
+                tenant.slot_state.save()
+            if available_slots:
+                tenant.send_reminders()
+        for tenant in self.tenants:
+            tenant.notifier.flush()
+        self.shared_url_com.url_com.flush()
+        self.logger.info(f"{self.shared_url_com.num_of_shared_requests} requests were shared between tenants")
+        self.tenants[0].export_metrics()
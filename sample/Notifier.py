@@ -0,0 +1,302 @@
+"""
+Dispatches the slots to remind, as SlotEvents, to every configured sink:
+- email: the reminder email, sent through EmailOutbox (logged instead when send_email_reminder is false)
+- webhook: the events are POSTed as json to an HTTP endpoint
+- jsonl: the events are appended to a file, one json per line
+- unix_socket: the events are written to a local unix socket, one json per line
+Every sink has its own queue and worker thread, so a slow or unreachable sink never delays the polling, nor the other sinks.
+A sink delivers at most once every min_interval_s seconds: the events coming in meanwhile are delivered together. Failed
+deliveries are retried with an exponential backoff, up to max_retries times.
+"""
+import sys
+import json
+import time
+import queue
+import socket
+import threading
+from pathlib import Path
+from datetime import datetime
+
+if "sample" not in sys.path:
+    sys.path.insert(0, "sample")
+import utils
+from Metrics import metrics
+
+CURR_FOLDER = Path(__file__).parent.resolve()
+EMAIL_SUBJECT = "[Doctolib Availability Reminder] New slots available !"
+MAX_SLOTS_PER_MOTIVE_IN_EMAIL = 10
+
+
+class SlotEvent:
+    """ a slot to remind """
+    __slots__ = ("slug_name", "practitioner_name", "speciality_name", "motive", "motive_id", "agenda_id", "practice_id",
+                 "address", "date", "slots", "found_at")
+
+    def __init__(self, slug_name, practitioner_name, speciality_name, motive, motive_id, agenda_id, practice_id, address, date,
+                 slots=None, found_at=None):
+        """
+        :param date - str : YYYY-MM-DD of the earliest slot
+        :param slots - list of dict : the slots of the window (see Practitioner.get_available_slots_in_window), empty if unknown
+        :param found_at - str : ISO date and time the slot was found at, now if None
+        """
+        self.slug_name = slug_name
+        self.practitioner_name = practitioner_name
+        self.speciality_name = speciality_name
+        self.motive = motive
+        self.motive_id = motive_id
+        self.agenda_id = agenda_id
+        self.practice_id = practice_id
+        self.address = address
+        self.date = date
+        self.slots = slots or []
+        self.found_at = found_at or datetime.now().isoformat(timespec="seconds")
+
+    @classmethod
+    def from_slot(cls, practitioner, slot):
+        """ :param slot - dict : one of the practitioner's next_slots """
+        return cls(practitioner.slug_name, practitioner.practitioner_name, practitioner.speciality_name,
+                   practitioner.visit_motives.get(slot["motive_id"]), slot["motive_id"], slot["agenda_id"], slot["practice_id"],
+                   practitioner.practice_address_by_id.get(slot["practice_id"]), slot["date"], slot.get("slots"))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Sink:
+    """ delivers events from its own queue and worker thread. Subclasses implement deliver """
+    def __init__(self, min_interval_s=0.0, max_retries=3, retry_backoff_s=5.0, idle_timeout_s=30.0):
+        """
+        :param min_interval_s - float : minimum time between two deliveries, the events coming in meanwhile are delivered together
+        :param max_retries - int : attempts before a batch of events is dropped
+        :param retry_backoff_s - float : wait before the first retry, doubled at every retry
+        :param idle_timeout_s - float : the worker thread stops after that long without events, and is restarted by submit
+        """
+        self.logger = utils.logger
+        self.name = type(self).__name__
+        self.min_interval_s = float(min_interval_s)
+        self.max_retries = max(1, int(max_retries))
+        self.retry_backoff_s = float(retry_backoff_s)
+        self.idle_timeout_s = idle_timeout_s
+        self._queue = queue.Queue()
+        self._pending = 0  # events submitted and not delivered or dropped yet
+        self._pending_changed = threading.Condition()
+        self._last_delivery = 0.0
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def deliver(self, events):
+        """ delivers a batch of SlotEvents, raises on failure so that the batch is retried """
+        raise NotImplementedError
+
+    def close(self):
+        """ releases what deliver keeps open between batches. Called by the worker when it stops """
+        pass
+
+    def submit(self, events):
+        """ queues the events, they are delivered in the background """
+        if not events:
+            return
+        with self._pending_changed:
+            self._pending += len(events)
+        for event in events:
+            self._queue.put(event)
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+
+    def flush(self, timeout_s=None):
+        """ waits until every submitted event is delivered or dropped. :return bool : False if timeout_s expired first """
+        with self._pending_changed:
+            return self._pending_changed.wait_for(lambda: self._pending == 0, timeout=timeout_s)
+
+    def _run(self):
+        while True:
+            try:
+                events = [self._queue.get(timeout=self.idle_timeout_s)]
+            except queue.Empty:
+                self.close()
+                with self._worker_lock:
+                    # submit starts a new worker if an event comes in after this check
+                    if self._queue.empty():
+                        self._worker = None
+                        return
+                continue
+            # throttling : the events coming in until the next allowed delivery are delivered together
+            wait_s = self._last_delivery + self.min_interval_s - time.time()
+            if wait_s > 0.0:
+                time.sleep(wait_s)
+            while True:
+                try:
+                    events.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._deliver_with_retries(events)
+            self._last_delivery = time.time()
+            with self._pending_changed:
+                self._pending -= len(events)
+                self._pending_changed.notify_all()
+
+    def _deliver_with_retries(self, events):
+        for attempt in range(self.max_retries):
+            try:
+                self.deliver(events)
+                metrics.inc("notifications_delivered_total", value=len(events), sink=self.name)
+                return
+            except Exception as e:
+                metrics.inc("notification_errors_total", sink=self.name, error=type(e).__name__)
+                if attempt + 1 == self.max_retries:
+                    self.logger.error(f"{self.name} failed to deliver {len(events)} slot events, they are dropped: {str(e)}")
+                    return
+                self.logger.error(f"{self.name} failed to deliver {len(events)} slot events, retrying: {str(e)}")
+                time.sleep(self.retry_backoff_s * 2 ** attempt)
+
+
+class EmailSink(Sink):
+    def __init__(self, email_outbox, recipients=None, dry_run=False, **kwargs):
+        """
+        :param email_outbox - EmailOutbox sending the emails, it has its own retries
+        :param recipients - str : comma separated, the ES_RECIPIENTS environment variable if None
+        :param dry_run - bool : the email is logged instead of being sent
+        """
+        super().__init__(**kwargs)
+        self.email_outbox = email_outbox
+        self.recipients = recipients
+        self.dry_run = dry_run
+
+    @staticmethod
+    def format_message(events):
+        """ :return str : the reminder email's text, the events grouped by practitioner """
+        events_by_slug = {}
+        for event in events:
+            events_by_slug.setdefault(event.slug_name, []).append(event)
+        message = ""
+        for slug_events in events_by_slug.values():
+            message += f"Practitioner : {slug_events[0].practitioner_name}\nType : {slug_events[0].speciality_name}\n"
+            message += f"Next available slots :\n"
+            for event in slug_events:
+                message += f"{event.motive} : {event.date}\n"
+                # with fetch_slot_window, every slot of the window is listed
+                for slot in event.slots[:MAX_SLOTS_PER_MOTIVE_IN_EMAIL]:
+                    message += f"    - {slot['date']} {slot['time'] or ''} at {slot['address']}\n"
+                if len(event.slots) > MAX_SLOTS_PER_MOTIVE_IN_EMAIL:
+                    message += f"    - and {len(event.slots) - MAX_SLOTS_PER_MOTIVE_IN_EMAIL} more\n"
+            message += "\n\n"
+        return message
+
+    def deliver(self, events):
+        message = self.format_message(events)
+        if self.dry_run:
+            self.logger.info(f"send_email_reminder is disabled, here is the reminder that would have been sent:\n{message}")
+            return
+        self.email_outbox.enqueue(subject=EMAIL_SUBJECT, message=message, recipients=self.recipients)
+
+    def flush(self, timeout_s=None):
+        # the emails are only sent once the outbox is flushed too
+        return super().flush(timeout_s) and self.email_outbox.flush(timeout_s)
+
+
+class WebhookSink(Sink):
+    def __init__(self, url, timeout_s=10.0, headers=None, **kwargs):
+        """
+        :param url - str : the events are POSTed to it as {"events": [event, ...]}
+        :param headers - dict : added to the request, e.g. an authorization token
+        """
+        super().__init__(**kwargs)
+        self.url = url
+        self.timeout_s = float(timeout_s)
+        self.headers = headers or {}
+
+    def deliver(self, events):
+        import requests  # only loaded once an event is really posted
+        response = requests.post(self.url, json={"events": [event.to_dict() for event in events]}, headers=self.headers,
+                                 timeout=self.timeout_s)
+        response.raise_for_status()
+
+
+class JsonlFileSink(Sink):
+    def __init__(self, file, **kwargs):
+        """ :param file - str : relative to the repository's root, or absolute """
+        super().__init__(**kwargs)
+        self.file_path = CURR_FOLDER.parent/file
+
+    def deliver(self, events):
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.file_path.open('a') as f:
+            f.write("".join(json.dumps(event.to_dict()) + "\n" for event in events))
+
+
+class UnixSocketSink(Sink):
+    def __init__(self, path, timeout_s=5.0, **kwargs):
+        """ :param path - str : path of a unix stream socket another local process listens on """
+        super().__init__(**kwargs)
+        self.path = path
+        self.timeout_s = float(timeout_s)
+        self._socket = None
+
+    def deliver(self, events):
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(self.timeout_s)
+            try:
+                self._socket.connect(self.path)
+            except OSError:
+                self.close()
+                raise
+        try:
+            self._socket.sendall("".join(json.dumps(event.to_dict()) + "\n" for event in events).encode())
+        except OSError:
+            self.close()  # reconnects on the retry
+            raise
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+SINKS = {
+    "email": EmailSink,
+    "webhook": WebhookSink,
+    "jsonl": JsonlFileSink,
+    "unix_socket": UnixSocketSink,
+}
+
+
+class Notifier:
+    def __init__(self, sinks):
+        """ :param sinks - list of Sink """
+        self.logger = utils.logger
+        self.sinks = sinks
+
+    @classmethod
+    def from_config(cls, config_data, email_outbox):
+        """
+        creates the sinks of the config's notification_sinks, a list of dicts with a type (one of SINKS' keys) and the sink's
+        options. Without notification_sinks, reminders are only emailed.
+        """
+        sinks = []
+        for sink_config in config_data.get("notification_sinks") or [{"type": "email"}]:
+            options = dict(sink_config)
+            sink_type = options.pop("type", None)
+            if sink_type not in SINKS:
+                raise Exception(f"unknown notification sink '{sink_type}', available sinks are {list(SINKS.keys())}")
+            if sink_type == "email":
+                options.setdefault("recipients", config_data.get("email_recipients"))
+                options.setdefault("dry_run", config_data.get("send_email_reminder") is False)
+                options["email_outbox"] = email_outbox
+            sinks.append(SINKS[sink_type](**options))
+        return cls(sinks)
+
+    def notify(self, events):
+        """ hands the events to every sink, without waiting for them to be delivered """
+        for sink in self.sinks:
+            sink.submit(events)
+
+    def flush(self, timeout_s=None):
+        """ waits until every sink has delivered its events. :return bool : False if timeout_s expired first """
+        deadline = None if timeout_s is None else time.time() + timeout_s
+        flushed = True
+        for sink in self.sinks:
+            flushed = sink.flush(None if deadline is None else max(0.0, deadline - time.time())) and flushed
+        return flushed
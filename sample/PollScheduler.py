@@ -0,0 +1,65 @@
+"""
+Scheduler used by the daemon mode. Every practitioner has its own next poll time, kept in a priority queue, and the interval
+until its next poll adapts to what was seen: practitioners whose next slot just moved, or sits close to the reminder window,
+are polled often, while the ones that are booked months ahead are polled rarely.
+Intervals never go below the budget floor, which is computed so that polling everyone at that pace stays within the
+availabilities request budget of DoctolibUrlCom.
+"""
+import time
+import heapq
+import itertools
+from datetime import date
+
+
+class PollScheduler:
+    def __init__(self, min_interval_s=5*60, max_interval_s=6*60*60, far_away_days=180, clock=time.time):
+        """
+        :param min_interval_s - float : interval for practitioners whose next slot just moved
+        :param max_interval_s - float : interval for practitioners whose next slot is far_away_days after the reminder window or more
+        :param far_away_days - int : when the next slot is that many days after the reminder window or more, max_interval_s is used
+        :param clock - function returning the current time in seconds
+        """
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max_interval_s
+        self.far_away_days = far_away_days
+        self.clock = clock
+        self.budget_floor_s = 0.0
+        self._queue = []  # heap of (next_poll_at, sequence, key)
+        self._sequence = itertools.count()  # ties are popped in insertion order
+
+    def set_budget(self, num_of_requests_per_poll, rate, period_s):
+        """
+        computes the budget floor: the minimum interval so that polling every key at that interval stays within rate requests per period_s.
+        :param num_of_requests_per_poll - list of int : cost of polling each key once
+        """
+        self.budget_floor_s = sum(num_of_requests_per_poll) * float(period_s) / float(rate)
+
+    def add(self, key, delay_s=0.0):
+        heapq.heappush(self._queue, (self.clock() + delay_s, next(self._sequence), key))
+
+    def __len__(self):
+        return len(self._queue)
+
+    def pop_next(self):
+        """ :return (key, wait_s) : the key to poll next, and the seconds to wait until its poll time """
+        next_poll_at, _, key = heapq.heappop(self._queue)
+        return (key, max(0.0, next_poll_at - self.clock()))
+
+    def get_interval(self, previous_date, new_date, max_reminder_date):
+        """
+        :param previous_date - str : earliest next slot date (YYYY-MM-DD) before the poll, None if there was none
+        :param new_date - str : earliest next slot date after the poll, None if there is none
+        :param max_reminder_date - str : latest date that triggers a reminder
+        :return interval_s - float : seconds until the next poll of this key
+        """
+        if new_date is None:
+            interval_s = self.max_interval_s / 2
+        elif new_date != previous_date:
+            interval_s = self.min_interval_s
+        else:
+            # the further the slot is from the reminder window, the longer the interval. A slot within the window has already
+            # been reminded, but we keep a close eye on it as an earlier one might show up
+            days_to_window = max(0, (date.fromisoformat(new_date) - date.fromisoformat(max_reminder_date)).days)
+            ratio = min(1.0, days_to_window / float(self.far_away_days))
+            interval_s = self.min_interval_s + ratio * (self.max_interval_s - self.min_interval_s)
+        return max(interval_s, self.budget_floor_s)
@@ -2,19 +2,26 @@
 This class will regroup all the info per practitionner. can definetly be improved, the usage is too narrow still.
 """
 import sys
+import hashlib
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
-sys.path.insert(0, "sample")
+if "sample" not in sys.path:
+    sys.path.insert(0, "sample")
 import utils as utils
 from DoctolibUrlCom import DoctolibUrlCom
+from KeywordMatcher import KeywordMatcher, TRANSLATION_TABLE, normalize_text
+# doctolib's availabilities.json accepts several agenda ids in a single request, separated by this character
+AGENDA_IDS_SEPARATOR = "-"
+# availabilities.json doesn't return more days than this in a single request, whatever the limit asked for
+AVAILABILITIES_MAX_DAYS_PER_REQUEST = 15
 
-TRANSLATION_TABLE = str.maketrans("ëéèêàïîô'ç", "eeeeaiio-c")
 
-
-def fetch_json_data_from_profile_url(profile_url):
+def get_slug_from_profile_url(profile_url):
     """
-    This function takes the URL of a profile on doctolib and returns the json data from it.
+    extracts the slug name from the URL of a profile on doctolib.
     :param profile_url - url copy pasted from doctolib.fr's profile.
-    :return (slug_name, json_data) : (str, dict)
+    :return slug_name - str, None if the url does not have the format 'type/city/name'
     """
     p_url = profile_url
     if "doctolib.fr/" in p_url:
@@ -22,37 +29,92 @@ def fetch_json_data_from_profile_url(profile_url):
     p_url = p_url.split("?")[0]                 # remove any aditional unecessary parameters at end of link
     splitted_link = p_url.split("/")
     if len(splitted_link) != 3:
+        return None
+    return splitted_link[2]
+
+
+def get_shard_of_slug(slug_name, num_of_shards):
+    """
+    :return int in [0, num_of_shards) : the shard the practitioner belongs to. It is the same in every process and every run,
+                                        unlike python's hash()
+    """
+    return int(hashlib.sha1(slug_name.encode()).hexdigest(), 16) % num_of_shards
+
+
+def fetch_json_data_from_profile_url(profile_url, url_com=None):
+    """
+    This function takes the URL of a profile on doctolib and returns the json data from it.
+    :param profile_url - url copy pasted from doctolib.fr's profile.
+    :param url_com - object with a request_from_json_url method, DoctolibUrlCom() if None
+    :return (slug_name, json_data) : (str, dict)
+    """
+    slug_name = get_slug_from_profile_url(profile_url)
+    if slug_name is None:
         utils.logger.error(f"[ERROR] link {profile_url} does not have format 'type/city/name'.")
         return (None, None)
-    slug_name = splitted_link[2]
 
     # fetch all necessary data to sort out and classify our profile(s)
     url = f"https://www.doctolib.fr/online_booking/draft/new.json?id={slug_name}"
     utils.logger.info(f"Profile URL : {url}")
-    json_data = DoctolibUrlCom().request_from_json_url(url)
-    if json_data is None:
+    json_data = (url_com or DoctolibUrlCom()).request_from_json_url(url)
+    if not json_data:
         utils.logger.error(f"[ERROR] link {url} couldn't fetch the json data. Does {profile_url} have the format (...)doctolib.fr/type/city/name(...) ?")
         return (None, None)
-    return (slug_name, json_data.get("data", {}))
+    # the rest of the payload is freed as soon as we return
+    return (slug_name, project_profile_data(json_data.get("data") or {}))
+
+
+def project_profile_data(json_data):
+    """
+    keeps only the fields of a profile that Practitioner and AvailabilityReminder read, out of the whole payload of
+    draft/new.json (which also has the practitioner's biography, opening hours, payment means...). Missing fields are None,
+    Practitioner reports them. Projecting a projected profile gives the same profile.
+    :param json_data - dict : the "data" of https://www.doctolib.fr/online_booking/draft/new.json?id=<slug_name>
+    :return dict with the same structure as json_data, empty if json_data is
+    """
+    if not json_data:
+        return {}
+    profile = json_data.get("profile") or {}
+    speciality = profile.get("speciality")
+    return {
+        "profile": {
+            "name_with_title": profile.get("name_with_title"),
+            "organization": profile.get("organization"),
+            "speciality": {k: speciality.get(k) for k in ("id", "slug", "name")} if speciality else None,
+        },
+        "places": [{k: place.get(k) for k in ("practice_ids", "address", "zipcode", "city", "latitude", "longitude")}
+                   for place in json_data.get("places") or []],
+        "visit_motives": [{k: vm.get(k) for k in ("id", "name", "speciality_id")} for vm in json_data.get("visit_motives") or []],
+        "agendas": [{k: ag.get(k) for k in ("id", "booking_disabled", "booking_temporary_disabled", "speciality_id", "visit_motive_ids_by_practice_id")}
+                    for ag in json_data.get("agendas") or []],
+    }
 
 
 class Practitioner:
+    # thousands of practitioners can be watched at once, __slots__ saves the per instance __dict__
+    __slots__ = ("is_ok", "slug_name", "next_slots", "answered_triples", "glob_type", "speciality_id", "practitioner_name", "speciality_name",
+                 "practice_address_by_id", "visit_motives", "agendas")
+    logger = utils.logger
+
     def __init__(self, slug_name, json_data):
         """ 
         :param slug_name - str : this is the name visible in a profile's URL. Usually it's the first-and-lastname without any special characters
-        :param json_data - dict: data retrieved from the response of https://www.doctolib.fr/online_booking/draft/new.json?id=<slug_name>
+        :param json_data - dict: data retrieved from the response of https://www.doctolib.fr/online_booking/draft/new.json?id=<slug_name>,
+                                 preferably projected by project_profile_data
         """
         self.is_ok = False
-        self.logger = utils.logger
         if json_data:
             try:
                 if not json_data["profile"]["speciality"] or \
                 not json_data["visit_motives"]         or \
                 not json_data["agendas"]                   :
-                    self.logger.debug(f"the json_data provided is missing mandatory data, here is a dump of the data for debug:\n{json_data}")
+                    self.logger.debug("the json_data provided is missing mandatory data, here is a dump of the data for debug:\n%s", json_data)
                     raise Exception(f"the json_data provided is missing mandatory data")
                 self.slug_name = slug_name
                 self.next_slots = []
+                # (motive_id, agenda_id, practice_id) of the availability queries answered by the last probe. The next_slots of
+                # the other ones are unknown, as their request failed or was denied
+                self.answered_triples = set()
                 
                 # fetch all necessary data :
                 self.glob_type = json_data["profile"]["speciality"]["slug"]
@@ -69,38 +131,37 @@ class Practitioner:
                 for vm in list(json_data["visit_motives"]):
                     if (vm["speciality_id"] != self.speciality_id):
                         continue
-                    self.visit_motives[vm["id"]] = vm["name"].lower().translate(TRANSLATION_TABLE)
+                    self.visit_motives[vm["id"]] = normalize_text(vm["name"])
 
                 self.agendas = {}
                 for ag in list(json_data["agendas"]):
                     if ag["booking_disabled"] or ag["booking_temporary_disabled"] or ag["speciality_id"] != self.speciality_id:
                         continue
-                    self.agendas[ag["id"]] = ag["visit_motive_ids_by_practice_id"]  # ag["visit_motive_ids_by_practice_id"] is a dictionnary :  key = practice id, item = [motive ids]
+                    # ag["visit_motive_ids_by_practice_id"] is a dictionnary :  key = practice id, item = [motive ids]. It is copied, as narrowing
+                    # removes practices from it and json_data can be shared with other practitioners (see MultiTenantRunner). Kept as tuples
+                    self.agendas[ag["id"]] = {practice_id: tuple(motive_ids) for practice_id, motive_ids in ag["visit_motive_ids_by_practice_id"].items()}
 
                 self.is_ok = True
                 self.logger.info(f"Practitioner {self.practitioner_name}'s object was successfully created")
             except Exception as e:
                 self.logger.error(f"Failed to create a Practitionner object:\n{e}")
 
-    def narrow_search_based_on_keywords(self, keywords=[], forbidden_keywords=[]):
+    def narrow_search_based_on_keywords(self, keywords=[], forbidden_keywords=[], keyword_matcher=None):
         """
         Some practitionners have way too many agendas and/or visit motives, and he/she might have an abailability on some visit motive
         that does not interest the user. So this function is to trim any agenda/visit_motive that is not required to be looked at
+        :param keyword_matcher - KeywordMatcher compiled from the keywords, to be shared between practitioners. If None, one is
+                                 compiled from keywords and forbidden_keywords
         """
-        keywords = [k.lower().translate(TRANSLATION_TABLE) for k in keywords]
-        forbidden_keywords = [k.lower().translate(TRANSLATION_TABLE) for k in forbidden_keywords]
-        self.logger.debug(f"Removing any visit_motive or agenda to narrow the availability search.\nLooking for these keywords: {keywords}\nRefusing these keywords:{forbidden_keywords}")
+        if keyword_matcher is None:
+            keyword_matcher = KeywordMatcher(keywords, forbidden_keywords)
+        self.logger.debug("Removing any visit_motive or agenda to narrow the availability search.\nLooking for these keywords: %s\nRefusing these keywords:%s",
+                          keyword_matcher.keywords, keyword_matcher.forbidden_keywords)
 
         # first we trim the visit motives. We'll remove any motive that has a forbidden keyword, and keep the ones that have the
         # highest number of matches with keywords
-        highest_num_of_keyword_matches = 0
-        for _, motive in self.visit_motives.items():
-            highest_num_of_keyword_matches = max(highest_num_of_keyword_matches, sum(k in motive for k in keywords))
-
-        motive_ids_to_remove = []
-        for id, motive in self.visit_motives.items():
-            if any(word in motive for word in forbidden_keywords) or sum(word in motive for word in keywords) < highest_num_of_keyword_matches:
-                motive_ids_to_remove.append(id)
+        motive_ids_to_keep = keyword_matcher.select_motives(self.visit_motives)
+        motive_ids_to_remove = [id for id in self.visit_motives if id not in motive_ids_to_keep]
 
         # Removing items from 'self.visit_motives' based on 'motive_ids_to_remove'
         for id in motive_ids_to_remove:
@@ -108,11 +169,11 @@ class Practitioner:
 
         # no we can trim the agendas
         agenda_ids_to_remove = []
-        visit_motive_ids = list(self.visit_motives.keys())
+        visit_motive_ids = set(self.visit_motives.keys())
         for agenda_id, visit_motive_ids_by_practice_id in self.agendas.items():
             practice_ids_to_remove = []
             for practice_id, agenda_motive_ids in visit_motive_ids_by_practice_id.items():
-                if not utils.arrays_have_common_elements(agenda_motive_ids, visit_motive_ids):
+                if visit_motive_ids.isdisjoint(agenda_motive_ids):
                     practice_ids_to_remove.append(practice_id)
             # Removing items from 'visit_motive_ids_by_practice_id' based on 'practice_ids_to_remove'
             for practice_id in practice_ids_to_remove:
@@ -128,35 +189,213 @@ class Practitioner:
             return None
         self.logger.debug(f"SUCCESS: {len(motive_ids_to_remove)} visit_motives have been removed and {len(agenda_ids_to_remove)} agendas.")
 
-    def get_next_available_appointment(self):
-        """ will parse all agendas and visit motives of current practitionner, and look at the next available slots """
+    def get_valid_triples(self):
+        """
+        enumerates only the (motive_id, agenda_id, practice_id) combinations that really exist, meaning the motive is
+        listed in the agenda's visit_motive_ids_by_practice_id for that practice.
+        :return triples - list of (int, int, str), ordered by motive, then agenda, then practice
+        """
+        triples = []
+        for motive_id in self.visit_motives.keys():
+            for agenda_id, visit_motive_ids_by_practice_id in self.agendas.items():
+                for practice_id, agenda_motive_ids in visit_motive_ids_by_practice_id.items():
+                    if motive_id in agenda_motive_ids:
+                        triples.append((motive_id, agenda_id, practice_id))
+        return triples
+
+    def plan_availability_queries(self, start_day="2000-01-01", limit=2):
+        """
+        groups the valid triples into as few availabilities.json requests as possible. The endpoint accepts several agenda ids
+        in a single request (separated by AGENDA_IDS_SEPARATOR), so all the agendas sharing a motive and a practice are queried together.
+        :return queries - list of dict with keys motive_id, practice_id, agenda_ids and url
+        """
+        queries_by_key = {}
+        for motive_id, agenda_id, practice_id in self.get_valid_triples():
+            query = queries_by_key.setdefault((motive_id, practice_id), {"motive_id": motive_id,
+                                                                          "practice_id": practice_id,
+                                                                          "agenda_ids": []})
+            query["agenda_ids"].append(agenda_id)
+        queries = list(queries_by_key.values())
+        for query in queries:
+            query["url"] = self.get_availabilities_url(query, start_day, limit)
+        return queries
+
+    @staticmethod
+    def get_availabilities_url(query, start_day, limit):
+        """ :return str : availabilities.json's url for the query (see plan_availability_queries), from start_day and for limit days """
+        return f"https://www.doctolib.fr/availabilities.json?" +\
+               f"start_date={start_day}&"                      +\
+               f"visit_motive_ids={query['motive_id']}&"       +\
+               f"agenda_ids={AGENDA_IDS_SEPARATOR.join(str(a) for a in query['agenda_ids'])}&" +\
+               f"practice_ids={query['practice_id']}&limit={limit}"
+
+    @staticmethod
+    def get_group_agenda_id(query):
+        """
+        :return the agenda id to report for an answer that can't be attributed to one of the query's agendas : the lowest of
+                them, so that it stays the same from one run to the next (it is part of SlotState's keys) as long as that agenda
+                is still listed. The whole group is reported in the next slot's agenda_ids
+        """
+        return min(query["agenda_ids"])
+
+    @staticmethod
+    def split_query_answer(query, json_data):
+        """
+        reads the answer of a grouped availabilities.json request made from a day in the past (see get_next_available_appointment).
+        Such an answer has no slots, only the group's next_slot, which can't be attributed to one of the agendas: it is
+        returned once for the whole group, under get_group_agenda_id.
+        :return answers - list of (agenda_id, date) : (int, str)
+        """
+        if json_data["next_slot"] and "Aucune" not in json_data["next_slot"]:
+            return [(Practitioner.get_group_agenda_id(query), json_data["next_slot"].split("T")[0])]
+        return []
+
+    @staticmethod
+    def split_window_answer(query, json_data):
+        """
+        lists the slots of an availabilities.json answer. Slots carrying their agenda_id are attributed to it, the others to
+        the whole group of agendas (see get_group_agenda_id).
+        :return slots - list of dict with keys agenda_id, start_date (as given by doctolib), date (YYYY-MM-DD) and time (HH:MM)
+        """
+        slots = []
+        for availability in json_data.get("availabilities") or []:
+            for slot in availability.get("slots") or []:
+                agenda_id = Practitioner.get_group_agenda_id(query)
+                if isinstance(slot, dict):
+                    if slot.get("agenda_id") in query["agenda_ids"]:
+                        agenda_id = slot["agenda_id"]
+                    slot = slot.get("start_date")
+                if not slot:
+                    continue
+                (date, _, time) = slot.partition("T")
+                slots.append({"agenda_id": agenda_id, "start_date": slot, "date": date, "time": time[:5] or None})
+        return slots
+
+    def add_answered_query(self, query):
+        """ adds the triples of the query (see plan_availability_queries) to answered_triples """
+        for agenda_id in query["agenda_ids"]:
+            self.answered_triples.add((query["motive_id"], agenda_id, int(query["practice_id"])))
+
+    def get_next_available_appointment(self, max_concurrent_requests=1):
+        """
+        will parse all agendas and visit motives of current practitionner, and look at the next available slots
+        :param max_concurrent_requests - int : how many availability requests can be in flight at the same time. Every request
+                                               still goes through DoctolibUrlCom's rate limiter, and next_slots keeps the same order
+                                               as a sequential parsing
+        """
         self.logger.info("Looking into the agendas and visit motives, and checking the next available slots...")
         found_slot = False
-        start_day = "2000-01-01"  # we take an old day to make sure no appointment will be available, so we can simply fetch the "next_slot" value
-        for motive_id, _ in self.visit_motives.items():
-            for agenda_id, visit_motive_ids_by_practice_id in self.agendas.items():
-                for practice_id, _ in visit_motive_ids_by_practice_id.items():
-                    url_to_check = f"https://www.doctolib.fr/availabilities.json?" +\
-                                    f"start_date={start_day}&"                     +\
-                                    f"visit_motive_ids={motive_id}&"      +\
-                                    f"agenda_ids={agenda_id}&"                  +\
-                                    f"practice_ids={practice_id}&limit=2"
-                    json_data = DoctolibUrlCom().request_from_json_url(url_to_check)
-                    if json_data:
-                        if "next_slot" in json_data.keys() and "Aucune" not in json_data["next_slot"]:
-                            next_slot = {}
-                            next_slot["date"] = json_data["next_slot"].split("T")[0]
-                            next_slot["motive_id"] = motive_id
-                            next_slot["agenda_id"] = agenda_id
-                            next_slot["practice_id"] = int(practice_id)
-                            next_slot["send_reminder"] = False
-                            self.next_slots.append(next_slot)
-                            found_slot = True
-                            self.logger.info(f"Next available slot for {self.visit_motives[motive_id]} : {next_slot['date']}")
+        self.next_slots = []  # a practitioner can be checked several times (daemon mode)
+        self.answered_triples = set()
+        # we take an old start day to make sure no appointment will be available, so we can simply fetch the "next_slot" value
+        queries = self.plan_availability_queries(start_day="2000-01-01")
+        self.logger.debug("%d availability requests planned for %d motive/agenda/practice combinations", len(queries), len(self.get_valid_triples()))
+
+        urls_to_check = [query["url"] for query in queries]
+        if max_concurrent_requests and max_concurrent_requests > 1 and len(queries) > 1:
+            # executor.map keeps the order of the queries, so the next_slots order is deterministic
+            with ThreadPoolExecutor(max_workers=min(int(max_concurrent_requests), len(queries))) as executor:
+                responses = list(executor.map(DoctolibUrlCom().request_from_json_url, urls_to_check))
+        else:
+            responses = [DoctolibUrlCom().request_from_json_url(url) for url in urls_to_check]
+
+        for query, json_data in zip(queries, responses):
+            if json_data:
+                self.add_answered_query(query)
+                for agenda_id, date in self.split_query_answer(query, json_data):
+                    next_slot = {}
+                    next_slot["date"] = date
+                    next_slot["motive_id"] = query["motive_id"]
+                    next_slot["agenda_id"] = agenda_id
+                    next_slot["agenda_ids"] = list(query["agenda_ids"])  # the agendas the slot can belong to
+                    next_slot["practice_id"] = int(query["practice_id"])
+                    next_slot["send_reminder"] = False
+                    self.next_slots.append(next_slot)
+                    found_slot = True
+                    self.logger.info(f"Next available slot for {self.visit_motives[query['motive_id']]} : {next_slot['date']}")
         if not found_slot:
             self.logger.info(f"This practitionner does not have any future available slots.")
         return found_slot
 
+    def fetch_query_window(self, query, start_day, max_day):
+        """
+        pages availabilities.json for the query from start_day to max_day (included), AVAILABILITIES_MAX_DAYS_PER_REQUEST days
+        per request. When a page has no slot, its next_slot tells when the next one is, so the empty pages are skipped, and
+        paging stops as soon as next_slot is after max_day.
+        :param start_day, max_day - str : YYYY-MM-DD
+        :return (slots, next_date, is_answered) : slots within the window (see split_window_answer), the date of the next slot
+                                                  after the window when none was found in it, else None, and False if a request
+                                                  failed, in which case slots may be missing
+        """
+        slots = []
+        day = datetime.strptime(start_day, "%Y-%m-%d")
+        last_day = datetime.strptime(max_day, "%Y-%m-%d")
+        while day <= last_day:
+            limit = min(AVAILABILITIES_MAX_DAYS_PER_REQUEST, (last_day - day).days + 1)
+            json_data = DoctolibUrlCom().request_from_json_url(self.get_availabilities_url(query, day.strftime("%Y-%m-%d"), limit))
+            if not json_data:
+                return (slots, None, False)
+            page_slots = [slot for slot in self.split_window_answer(query, json_data) if slot["date"] <= max_day]
+            slots += page_slots
+            day = day + timedelta(days=limit)
+            next_slot = json_data.get("next_slot")
+            if not page_slots and next_slot and "Aucune" not in next_slot:
+                next_day = datetime.strptime(next_slot.split("T")[0], "%Y-%m-%d")
+                if next_day > last_day:
+                    return (slots, None, True) if slots else (slots, next_day.strftime("%Y-%m-%d"), True)
+                day = max(day, next_day)
+            elif not page_slots and not next_slot:
+                break  # nothing left to book at all
+        return (slots, None, True)
+
+    def get_available_slots_in_window(self, max_day, max_concurrent_requests=1):
+        """
+        like get_next_available_appointment, but looks at every slot from today to max_day. next_slots still has one entry per
+        motive/agenda/practice with the earliest date, and each entry's "slots" lists the slots within the window, with their
+        time and the practice's address. When there are none, the date is the one of the next slot after the window.
+        :param max_day - str : YYYY-MM-DD, the last day to look at
+        :return bool : True if any slot was found
+        """
+        self.logger.info(f"Looking into the agendas and visit motives, and checking the available slots up to {max_day}...")
+        self.next_slots = []
+        self.answered_triples = set()
+        start_day = datetime.today().strftime("%Y-%m-%d")
+        queries = self.plan_availability_queries(start_day=start_day)
+        fetch = lambda query: self.fetch_query_window(query, start_day, max_day)
+        if max_concurrent_requests and max_concurrent_requests > 1 and len(queries) > 1:
+            with ThreadPoolExecutor(max_workers=min(int(max_concurrent_requests), len(queries))) as executor:
+                answers = list(executor.map(fetch, queries))
+        else:
+            answers = [fetch(query) for query in queries]
+
+        for query, (slots, next_date, is_answered) in zip(queries, answers):
+            if is_answered:
+                self.add_answered_query(query)
+            slots_by_agenda = {}
+            group_agenda_id = self.get_group_agenda_id(query)
+            for slot in sorted(slots, key=lambda slot: slot["start_date"]):
+                slots_by_agenda.setdefault(slot.pop("agenda_id"), []).append(slot)
+            if next_date is not None:
+                slots_by_agenda[group_agenda_id] = []
+            address = self.practice_address_by_id.get(int(query["practice_id"]))
+            for agenda_id, agenda_slots in slots_by_agenda.items():
+                for slot in agenda_slots:
+                    slot["address"] = address
+                next_slot = {}
+                next_slot["date"] = agenda_slots[0]["date"] if agenda_slots else next_date
+                next_slot["motive_id"] = query["motive_id"]
+                next_slot["agenda_id"] = agenda_id
+                # the slots that didn't say which agenda they are from can belong to any of the group
+                next_slot["agenda_ids"] = list(query["agenda_ids"]) if agenda_id == group_agenda_id else [agenda_id]
+                next_slot["practice_id"] = int(query["practice_id"])
+                next_slot["send_reminder"] = False
+                next_slot["slots"] = agenda_slots
+                self.next_slots.append(next_slot)
+                self.logger.info(f"{len(agenda_slots)} slots until {max_day} for {self.visit_motives[query['motive_id']]}, next one : {next_slot['date']}")
+        if not self.next_slots:
+            self.logger.info(f"This practitionner does not have any future available slots.")
+        return len(self.next_slots) > 0
+
 if __name__ == "__main__":
     my_pract = Practitioner.from_url("https://www.doctolib.fr/dentiste/paris/rita-halhal?pid=practice-3680")
     if my_pract and my_pract.is_ok:
@@ -0,0 +1,162 @@
+"""
+Local catalog of the practitioners' profiles, so that runs don't fetch profiles that hardly ever change again. It is a SQLite
+database storing, per slug, the projected profile (see Practitioner.project_profile_data), the members of organizations and
+the time they were fetched at. Practices (with their coordinates) are stored in their own table, so the practices around an
+address are found without loading every profile. The profile links found by address searches are stored too, with the
+circles they covered (see GeoIndex).
+AvailabilityReminder builds its practitioners from the catalog, and refreshes the entries older than max_age_s in the
+background, so that on a normal cycle only the availabilities are requested.
+"""
+import sys
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+if "sample" not in sys.path:
+    sys.path.insert(0, "sample")
+import utils
+
+CURR_FOLDER = Path(__file__).parent.resolve()
+CATALOG_FILE = CURR_FOLDER.parent/"data"/"practitioner_catalog.sqlite3"
+
+
+class PractitionerCatalog:
+    def __init__(self, db_file=CATALOG_FILE, max_age_s=7*24*60*60):
+        """
+        :param db_file - pathlib.Path : SQLite file, can be shared by several processes
+        :param max_age_s - float : entries fetched longer ago than this are stale, and should be refreshed
+        """
+        self.logger = utils.logger
+        self.db_file = Path(db_file)
+        self.max_age_s = max_age_s
+        self._local = threading.local()  # sqlite connections can't be shared between threads
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS practitioners (slug TEXT PRIMARY KEY, speciality_id INTEGER, "
+                           "is_organization INTEGER NOT NULL, profile TEXT NOT NULL, organization_members TEXT, fetched_at REAL NOT NULL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS practices (slug TEXT NOT NULL, practice_id INTEGER NOT NULL, latitude REAL, longitude REAL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS practices_by_slug ON practices (slug)")
+        connection.execute("CREATE TABLE IF NOT EXISTS searches (search_key TEXT PRIMARY KEY, links TEXT NOT NULL, fetched_at REAL NOT NULL)")
+        # circles searched in full around an address, and the profile links found by searches of each practitioner type
+        connection.execute("CREATE TABLE IF NOT EXISTS search_coverage (practitioner_type TEXT NOT NULL, latitude REAL NOT NULL, "
+                           "longitude REAL NOT NULL, radius_km REAL NOT NULL, fetched_at REAL NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS search_coverage_by_type ON search_coverage (practitioner_type)")
+        connection.execute("CREATE TABLE IF NOT EXISTS search_links (practitioner_type TEXT NOT NULL, slug TEXT NOT NULL, link TEXT NOT NULL, "
+                           "PRIMARY KEY (practitioner_type, slug))")
+        connection.execute("CREATE TABLE IF NOT EXISTS geocodes (address TEXT PRIMARY KEY, latitude REAL NOT NULL, longitude REAL NOT NULL)")
+
+    @classmethod
+    def from_config(cls, config_data):
+        """
+        :return PractitionerCatalog, None if the config's practitioner_catalog isn't set. It is stored in the config's
+                catalog_file (relative to the repository's root) if any, CATALOG_FILE otherwise
+        """
+        if not config_data.get("practitioner_catalog"):
+            return None
+        db_file = CURR_FOLDER.parent/config_data["catalog_file"] if config_data.get("catalog_file") else CATALOG_FILE
+        max_age_s = config_data.get("catalog_max_age_s")
+        return cls(db_file, max_age_s=7*24*60*60 if max_age_s is None else float(max_age_s))
+
+    def _connection(self):
+        if getattr(self._local, "connection", None) is None:
+            # isolation_level=None so we can handle transactions ourselves with BEGIN IMMEDIATE
+            self._local.connection = sqlite3.connect(str(self.db_file), timeout=30.0, isolation_level=None)
+        return self._local.connection
+
+    def get(self, slug_name):
+        """ :return (profile, organization_members, fetched_at) - (dict, list of str or None, float), None if the slug isn't in the catalog """
+        row = self._connection().execute("SELECT profile, organization_members, fetched_at FROM practitioners WHERE slug = ?",
+                                         (slug_name,)).fetchone()
+        if row is None:
+            return None
+        (profile, organization_members, fetched_at) = row
+        return (utils.json_loads(profile), json.loads(organization_members) if organization_members else None, fetched_at)
+
+    def is_stale(self, fetched_at, now=None):
+        return (time.time() if now is None else now) - fetched_at > self.max_age_s
+
+    def put(self, slug_name, profile, organization_members=None, now=None):
+        """
+        stores a profile, replacing the previous one
+        :param profile - dict : projected profile, see Practitioner.project_profile_data
+        :param organization_members - list of str : profile urls of the organization's practitioners, if it is one
+        """
+        now = time.time() if now is None else now
+        profile_data = profile.get("profile") or {}
+        speciality = profile_data.get("speciality") or {}
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("INSERT OR REPLACE INTO practitioners (slug, speciality_id, is_organization, profile, organization_members, fetched_at) "
+                               "VALUES (?, ?, ?, ?, ?, ?)",
+                               (slug_name, speciality.get("id"), int(bool(profile_data.get("organization"))), json.dumps(profile),
+                                json.dumps(organization_members) if organization_members is not None else None, now))
+            connection.execute("DELETE FROM practices WHERE slug = ?", (slug_name,))
+            connection.executemany("INSERT INTO practices (slug, practice_id, latitude, longitude) VALUES (?, ?, ?, ?)",
+                                   [(slug_name, practice_id, place.get("latitude"), place.get("longitude"))
+                                    for place in profile.get("places") or [] for practice_id in place.get("practice_ids") or []])
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def get_search(self, search_key):
+        """ :return (links, fetched_at) - (list of str, float) : profile links found by the search, None if it isn't in the catalog """
+        row = self._connection().execute("SELECT links, fetched_at FROM searches WHERE search_key = ?", (search_key,)).fetchone()
+        if row is None:
+            return None
+        return (json.loads(row[0]), row[1])
+
+    def put_search(self, search_key, links, now=None):
+        """
+        :param search_key - str : identifies the search, e.g. its url and maximum distance
+        :param links - list of str : profile links found by the search, in order
+        """
+        self._connection().execute("INSERT OR REPLACE INTO searches (search_key, links, fetched_at) VALUES (?, ?, ?)",
+                                   (search_key, json.dumps(links), time.time() if now is None else now))
+
+    def put_search_coverage(self, practitioner_type, latitude, longitude, radius_km, links, now=None):
+        """
+        records that every practitioner of practitioner_type within radius_km of (latitude, longitude) was searched.
+        :param links - list of str : profile links (/type/city/name) found by the search
+        """
+        now = time.time() if now is None else now
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("INSERT INTO search_coverage (practitioner_type, latitude, longitude, radius_km, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                               (practitioner_type, latitude, longitude, radius_km, now))
+            connection.executemany("INSERT OR REPLACE INTO search_links (practitioner_type, slug, link) VALUES (?, ?, ?)",
+                                   [(practitioner_type, link.split("?")[0].rstrip("/").split("/")[-1], link) for link in links])
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def get_search_coverage(self, practitioner_type):
+        """ :return list of (latitude, longitude, radius_km, fetched_at) : the circles searched for practitioner_type """
+        return self._connection().execute("SELECT latitude, longitude, radius_km, fetched_at FROM search_coverage WHERE practitioner_type = ?",
+                                          (practitioner_type,)).fetchall()
+
+    def get_search_practices(self, practitioner_type):
+        """ :return list of (link, latitude, longitude) : the practices of the practitioners found by searches of practitioner_type """
+        return self._connection().execute("SELECT search_links.link, practices.latitude, practices.longitude FROM search_links "
+                                          "JOIN practices ON practices.slug = search_links.slug WHERE search_links.practitioner_type = ? "
+                                          "AND practices.latitude IS NOT NULL AND practices.longitude IS NOT NULL",
+                                          (practitioner_type,)).fetchall()
+
+    def get_geocode(self, address):
+        """ :return (latitude, longitude), None if the address wasn't geocoded yet """
+        return self._connection().execute("SELECT latitude, longitude FROM geocodes WHERE address = ?", (address,)).fetchone()
+
+    def put_geocode(self, address, latitude, longitude):
+        self._connection().execute("INSERT OR REPLACE INTO geocodes (address, latitude, longitude) VALUES (?, ?, ?)", (address, latitude, longitude))
+
+    def count(self, now=None):
+        """ :return (num_of_entries, num_of_stale_entries) : number of profiles in the catalog, and how many of them are stale """
+        now = time.time() if now is None else now
+        return self._connection().execute("SELECT COUNT(*), COALESCE(SUM(fetched_at < ?), 0) FROM practitioners",
+                                          (now - self.max_age_s,)).fetchone()
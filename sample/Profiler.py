@@ -0,0 +1,117 @@
+"""
+Profiles a run (python main.py --profile [REPORT_FILE]) to find where the CPU time goes, apart from the time spent waiting
+on the network:
+- CPU time is measured by cProfile, with time.process_time as its clock, so sleeping and waiting on sockets count for nothing
+- network wait (request durations) and rate limiter waits are taken from the metrics DoctolibUrlCom records, see Metrics.py
+cProfile only follows the thread it is enabled in, so the profiled run is serial (max_concurrent_requests = 1): discovery
+and probing are then run in the main thread, and the background catalog refreshes are left out.
+The report ranks the hot functions when printed, and is written as json with sorted keys and paths relative to the
+repository, so the reports of two releases can be diffed.
+"""
+import sys
+import json
+import time
+import pstats
+import cProfile
+from pathlib import Path
+
+if "sample" not in sys.path:
+    sys.path.insert(0, "sample")
+import utils
+from Metrics import metrics
+
+ROOT_FOLDER = utils.CURR_FOLDER.parent
+DEFAULT_REPORT_FILE = ROOT_FOLDER/"data"/"profile_report.json"
+NUM_OF_PRINTED_FUNCTIONS = 25
+
+
+def get_function_name(func):
+    """
+    :param func - tuple (file_name, line_number, function_name) as found in pstats
+    :return str : 'path/to/file.py:line(function)' with a path that doesn't depend on where python or the repository is installed
+    """
+    file_name, line_number, function_name = func
+    if file_name == "~":  # built-in functions
+        return function_name
+    path = Path(file_name)
+    try:
+        file_name = path.resolve().relative_to(ROOT_FOLDER).as_posix()
+    except ValueError:
+        # standard library and site-packages : keep the path from the package on
+        parts = path.parts
+        for marker in ("site-packages", "dist-packages"):
+            if marker in parts:
+                parts = parts[parts.index(marker)+1:]
+                break
+        else:
+            parts = parts[-2:]
+        file_name = "/".join(parts)
+    return f"{file_name}:{line_number}({function_name})"
+
+
+def get_histogram_sum(metrics_dict, name):
+    return sum(h["sum"] for h in metrics_dict["histograms"] if h["name"] == name)
+
+
+def build_report(stats, wall_time_s):
+    """
+    :param stats - pstats.Stats
+    :return dict : the totals, the time spent in each stage, and functions[name] = {calls, cpu_s, cumulative_cpu_s}
+    """
+    functions = {}
+    for func, (_, num_of_calls, total_time, cumulative_time, _) in stats.stats.items():
+        name = get_function_name(func)
+        entry = functions.setdefault(name, {"calls": 0, "cpu_s": 0.0, "cumulative_cpu_s": 0.0})
+        entry["calls"] += num_of_calls
+        entry["cpu_s"] += total_time
+        entry["cumulative_cpu_s"] += cumulative_time
+    for entry in functions.values():
+        entry["cpu_s"] = round(entry["cpu_s"], 6)
+        entry["cumulative_cpu_s"] = round(entry["cumulative_cpu_s"], 6)
+
+    metrics_dict = metrics.to_dict()
+    return {
+        "wall_time_s": round(wall_time_s, 3),
+        "cpu_time_s": round(stats.total_tt, 3),
+        "network_wait_s": round(get_histogram_sum(metrics_dict, "request_duration_seconds"), 3),
+        "rate_limiter_wait_s": round(get_histogram_sum(metrics_dict, "rate_limiter_wait_seconds"), 3),
+        "stages_s": {h["labels"]["stage"]: round(h["sum"], 3) for h in metrics_dict["histograms"] if h["name"] == "stage_duration_seconds"},
+        "functions": functions,
+    }
+
+
+def format_report(report, num_of_functions=NUM_OF_PRINTED_FUNCTIONS):
+    """ :return str : the totals, then the num_of_functions functions that use the most CPU time by themselves """
+    lines = [f"wall time: {report['wall_time_s']}s, CPU time: {report['cpu_time_s']}s, network wait: {report['network_wait_s']}s, "
+             f"rate limiter wait: {report['rate_limiter_wait_s']}s"]
+    for stage, duration_s in sorted(report["stages_s"].items(), key=lambda item: -item[1]):
+        lines.append(f"  stage {stage}: {duration_s}s")
+    lines.append(f"{'cpu_s':>10} {'cumul_s':>10} {'calls':>10}  function")
+    ranked = sorted(report["functions"].items(), key=lambda item: (-item[1]["cpu_s"], item[0]))
+    for name, entry in ranked[:num_of_functions]:
+        lines.append(f"{entry['cpu_s']:>10.4f} {entry['cumulative_cpu_s']:>10.4f} {entry['calls']:>10}  {name}")
+    return "\n".join(lines)
+
+
+def profile_run(run, report_file=DEFAULT_REPORT_FILE):
+    """
+    :param run - function without arguments running the reminder
+    :param report_file - str/Path : where the json report is written
+    :return dict : the report
+    """
+    profiler = cProfile.Profile(time.process_time)
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        run()
+    finally:
+        profiler.disable()
+        wall_time_s = time.perf_counter() - start
+    report = build_report(pstats.Stats(profiler), wall_time_s)
+    print(format_report(report))
+    report_file = Path(report_file)
+    report_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=4, sort_keys=True)
+    utils.logger.info(f"profile report written to {report_file}")
+    return report
@@ -0,0 +1,127 @@
+"""
+Token buckets used by DoctolibUrlCom to limit the number of requests made towards doctolib.fr.
+Each bucket holds at most `rate` tokens and refills continuously at rate/period_s tokens per second, so checking a request costs
+O(1) whatever the amount of requests already made. When doctolib answers with 429 (too many requests) or 403, the limiter blocks
+that type of request for a while and then resumes gradually.
+The clock and sleep functions can be injected, so the limiter can be driven without waiting for real time.
+"""
+import time
+import threading
+
+# status codes that mean we are requesting too much
+BACKOFF_STATUS_CODES = (403, 429)
+
+
+class TokenBucket:
+    def __init__(self, rate, period_s, tokens=None, updated_at=None):
+        """
+        :param rate - int : number of requests allowed within period_s
+        :param period_s - float : period in seconds
+        :param tokens - float : tokens currently available, full bucket if None
+        :param updated_at - float : clock time at which tokens was computed
+        """
+        self.capacity = float(rate)
+        self.refill_per_s = float(rate) / float(period_s)
+        self.tokens = self.capacity if tokens is None else min(float(tokens), self.capacity)
+        self.updated_at = updated_at
+
+    def refill(self, now):
+        if self.updated_at is not None and now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_s)
+        self.updated_at = now
+
+    def time_until_token(self, now):
+        """ :return seconds to wait until a token is available, 0.0 if one is available now """
+        self.refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.refill_per_s
+
+    def take(self, now):
+        """ takes a token if one is available. :return bool """
+        if self.time_until_token(now) > 0.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+class RateLimiter:
+    """
+    one TokenBucket per key (UrlType), plus a backoff per key that is triggered by 403/429 answers.
+    After a backoff, requests are spaced by a penalty that is halved on every successful request, until it vanishes.
+    """
+    def __init__(self, limits, clock=time.time, sleep=time.sleep, initial_backoff_s=30.0, max_backoff_s=30*60.0, min_penalty_s=0.5):
+        """
+        :param limits - dict : limits[key] = (rate, period_s)
+        :param clock - function returning the current time in seconds
+        :param sleep - function sleeping the given amount of seconds
+        :param initial_backoff_s - float : blocking time after a first 403/429, doubled on every following one
+        :param max_backoff_s - float : maximum blocking time
+        :param min_penalty_s - float : below this spacing, the limiter goes back to the token bucket only
+        """
+        self.clock = clock
+        self.sleep = sleep
+        self.initial_backoff_s = initial_backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.min_penalty_s = min_penalty_s
+        self._lock = threading.Lock()
+        self._buckets = {key: TokenBucket(rate, period_s) for key, (rate, period_s) in limits.items()}
+        self._penalty_s = {key: 0.0 for key in limits}
+        self._next_allowed_at = {key: 0.0 for key in limits}
+
+    def _time_until_allowed(self, key, now):
+        return max(self._next_allowed_at[key] - now, self._buckets[key].time_until_token(now))
+
+    def try_acquire(self, key):
+        """ takes a token for key if a request is allowed right now. :return bool """
+        with self._lock:
+            now = self.clock()
+            if self._time_until_allowed(key, now) > 0.0:
+                return False
+            self._take(key, now)
+            return True
+
+    def acquire(self, key, timeout=None):
+        """
+        waits until a request of type key is allowed and takes a token.
+        :param timeout - float : maximum number of seconds to wait, None to wait as long as needed
+        :return bool : False if the token couldn't be taken within timeout
+        """
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            with self._lock:
+                now = self.clock()
+                wait_s = self._time_until_allowed(key, now)
+                if wait_s <= 0.0:
+                    self._take(key, now)
+                    return True
+            if deadline is not None:
+                if now + wait_s > deadline:
+                    return False
+            self.sleep(wait_s)
+
+    def release(self, key):
+        """ gives back a token taken by try_acquire or acquire, when the request it was taken for isn't made after all """
+        with self._lock:
+            bucket = self._buckets[key]
+            bucket.refill(self.clock())
+            bucket.tokens = min(bucket.capacity, bucket.tokens + 1.0)
+
+    def report_response(self, key, status_code):
+        """ to be called with the status code of every answer, so the limiter can back off or recover """
+        with self._lock:
+            if key not in self._buckets:
+                return
+            now = self.clock()
+            if status_code in BACKOFF_STATUS_CODES:
+                backoff_s = min(self.max_backoff_s, max(self.initial_backoff_s, 2 * self._penalty_s[key]))
+                self._penalty_s[key] = backoff_s
+                self._next_allowed_at[key] = now + backoff_s
+            elif self._penalty_s[key] > 0.0:
+                self._penalty_s[key] /= 2
+                if self._penalty_s[key] < self.min_penalty_s:
+                    self._penalty_s[key] = 0.0
+
+    def _take(self, key, now):
+        self._buckets[key].take(now)
+        self._next_allowed_at[key] = now + self._penalty_s[key]
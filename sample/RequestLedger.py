@@ -0,0 +1,88 @@
+"""
+Persistent ledger of the requests made towards doctolib.fr. It is a SQLite database, so several processes of the machine
+(overlapping runs, sharded workers...) can share it and enforce one global request budget.
+Recording a request is a single insert, and the rows that are older than every rate limit period are removed periodically.
+"""
+import sys
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from datetime import datetime
+
+if "sample" not in sys.path:
+    sys.path.insert(0, "sample")
+import utils
+
+CURR_FOLDER = Path(__file__).parent.resolve()
+LEDGER_FILE = CURR_FOLDER.parent/"data"/"doctolib_url_com_data.sqlite3"
+
+
+class RequestLedger:
+    def __init__(self, db_file=LEDGER_FILE, max_period_s=24*60*60, compaction_interval=500):
+        """
+        :param db_file - pathlib.Path : SQLite file shared by every process
+        :param max_period_s - float : requests older than this are not needed anymore and can be removed
+        :param compaction_interval - int : old requests are removed every compaction_interval recorded requests
+        """
+        self.logger = utils.logger
+        self.db_file = Path(db_file)
+        self.max_period_s = max_period_s
+        self.compaction_interval = compaction_interval
+        self._local = threading.local()  # sqlite connections can't be shared between threads
+        self._num_of_records = 0
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS requests (url_type TEXT NOT NULL, requested_at REAL NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS requests_by_type ON requests (url_type, requested_at)")
+
+    def _connection(self):
+        if getattr(self._local, "connection", None) is None:
+            # isolation_level=None so we can handle transactions ourselves with BEGIN IMMEDIATE
+            self._local.connection = sqlite3.connect(str(self.db_file), timeout=30.0, isolation_level=None)
+        return self._local.connection
+
+    def try_record(self, url_type_name, rate, period_s, now=None):
+        """
+        records a request of given type if less than rate requests were made within the last period_s seconds, by any process.
+        :return retry_after_s - float : 0.0 if the request was recorded, otherwise seconds until the oldest request leaves the window
+        """
+        now = time.time() if now is None else now
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")  # locks the database for writing, so the check and the insert are atomic
+        try:
+            (num_of_requests, oldest) = connection.execute("SELECT COUNT(*), MIN(requested_at) FROM requests WHERE url_type = ? AND requested_at > ?",
+                                                           (url_type_name, now - period_s)).fetchone()
+            if num_of_requests >= rate:
+                connection.execute("COMMIT")
+                return max(oldest + period_s - now, 0.001)
+            connection.execute("INSERT INTO requests (url_type, requested_at) VALUES (?, ?)", (url_type_name, now))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        self._num_of_records += 1
+        if self._num_of_records % self.compaction_interval == 0:
+            self.compact(now)
+        return 0.0
+
+    def compact(self, now=None):
+        """ removes the requests that are older than max_period_s """
+        now = time.time() if now is None else now
+        self._connection().execute("DELETE FROM requests WHERE requested_at <= ?", (now - self.max_period_s,))
+
+    def import_request_dates(self, url_type_name, request_dates):
+        """
+        imports dates of requests stored by older versions of DoctolibUrlCom, format '%Y-%m-%d %H:%M:%S.%f'.
+        Dates older than max_period_s are skipped
+        """
+        connection = self._connection()
+        min_timestamp = time.time() - self.max_period_s
+        rows = [(url_type_name, t) for t in (datetime.strptime(d, '%Y-%m-%d %H:%M:%S.%f').timestamp() for d in request_dates) if t > min_timestamp]
+        connection.execute("BEGIN IMMEDIATE")
+        connection.executemany("INSERT INTO requests (url_type, requested_at) VALUES (?, ?)", rows)
+        connection.execute("COMMIT")
+
+    def is_empty(self):
+        return self._connection().execute("SELECT 1 FROM requests LIMIT 1").fetchone() is None
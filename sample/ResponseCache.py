@@ -0,0 +1,121 @@
+"""
+On-disk cache of the json responses received from doctolib.fr. Since doctolib.fr is very limiting in the number of requests
+allowed, responses that barely change (profiles, organizations...) can be stored and served again for a while instead of being
+requested at every run.
+Entries are indexed by normalized URL, so a lookup never has to scan the cache folder, and the least recently used entries are
+evicted once the cache is full.
+"""
+import sys
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+if "sample" not in sys.path:
+    sys.path.insert(0, "sample")
+import utils
+
+CURR_FOLDER = Path(__file__).parent.resolve()
+CACHE_FOLDER = CURR_FOLDER.parent/"data"/"url_cache"
+INDEX_FILE_NAME = "index.json"
+
+
+class ResponseCache:
+    """
+    LRU cache of json responses. Each response is stored in its own file, and index.json keeps
+    index[normalized_url] = {"file": str, "stored_at": float} in least to most recently used order.
+    """
+    def __init__(self, cache_folder=CACHE_FOLDER, max_entries=5000, index_save_interval=50):
+        """
+        :param cache_folder - pathlib.Path : folder where responses and the index are stored
+        :param max_entries - int : number of responses kept before evicting the least recently used one
+        :param index_save_interval - int : the index is written to disk every index_save_interval modifications, and on save()
+        """
+        self.logger = utils.logger
+        self.cache_folder = Path(cache_folder)
+        self.max_entries = max_entries
+        self.index_save_interval = index_save_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._unsaved_changes = 0
+        self._index = OrderedDict()
+        self.cache_folder.mkdir(parents=True, exist_ok=True)
+        index_data = utils.get_file_json_data(self.cache_folder/INDEX_FILE_NAME) if (self.cache_folder/INDEX_FILE_NAME).exists() else None
+        if index_data and isinstance(index_data.get("entries"), list):
+            for key, entry in index_data["entries"]:
+                self._index[key] = entry
+
+    @staticmethod
+    def normalize_url(url):
+        """ lower cases scheme and host, sorts the query parameters and drops the fragment, so equivalent URLs share an entry """
+        parts = urlsplit(url.strip())
+        query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ""))
+
+    def get(self, url, ttl_s):
+        """
+        returns the cached json data of url if it has been stored less than ttl_s seconds ago, None otherwise
+        :param url - str
+        :param ttl_s - float : time to live of the entry, in seconds
+        """
+        key = self.normalize_url(url)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None or time.time() - entry["stored_at"] > ttl_s:
+                self.misses += 1
+                return None
+            try:
+                with (self.cache_folder/entry["file"]).open() as f:
+                    json_data = json.load(f)
+            except Exception as e:
+                self.logger.warn(f"couldn't read cached response of {url}, dropping it : {e}")
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+            return json_data
+
+    def put(self, url, json_data):
+        """ stores json_data as the response of url, evicting the least recently used entries if the cache is full """
+        key = self.normalize_url(url)
+        file_name = hashlib.sha1(key.encode()).hexdigest() + ".json"
+        with self._lock:
+            try:
+                with (self.cache_folder/file_name).open('w') as f:
+                    json.dump(json_data, f)
+            except Exception as e:
+                self.logger.warn(f"couldn't store the response of {url} in cache : {e}")
+                return
+            self._index[key] = {"file": file_name, "stored_at": time.time()}
+            self._index.move_to_end(key)
+            while len(self._index) > self.max_entries:
+                self._remove(next(iter(self._index)))
+            self._unsaved_changes += 1
+            if self._unsaved_changes >= self.index_save_interval:
+                self._save_index()
+
+    def save(self):
+        """ writes the index to disk, if it changed since it was last written """
+        with self._lock:
+            if self._unsaved_changes:
+                self._save_index()
+
+    def stats(self):
+        """ :return dict with the hits, misses and number of entries of the cache """
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._index)}
+
+    def _remove(self, key):
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            (self.cache_folder/entry["file"]).unlink(missing_ok=True)
+            self._unsaved_changes += 1
+
+    def _save_index(self):
+        with (self.cache_folder/INDEX_FILE_NAME).open('w') as f:
+            json.dump({"entries": list(self._index.items())}, f)
+        self._unsaved_changes = 0
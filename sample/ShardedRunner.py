@@ -0,0 +1,99 @@
+"""
+Splits the watched practitioners across several worker processes (python main.py --shards N), for watchlists too large for
+a single interpreter:
+- every practitioner belongs to one shard, chosen by hashing its slug (see get_shard_of_slug), so the split is the same in
+  every process and every run. The practitioners of an organization belong to the organization's shard, so a practitioner
+  watched directly and through an organization (or through two organizations) can be probed by two shards. The coordinator
+  only keeps one of them, see merge_shards
+- each worker process has its own DoctolibUrlCom, so its own connection pool (and IP with the gateway transport). It
+  discovers and probes the practitioners of its shard, and hands them back with their next slots
+- the coordinator (the calling process) then evaluates every slot at once, against its slot state, and sends the reminders,
+  so that there is a single notification step and a single writer of the slot state
+Without save_url_request_time, each worker only gets its share of the request budget. With it, the RequestLedger already
+enforces the budget across processes.
+"""
+import sys
+import multiprocessing
+
+if "sample" not in sys.path:
+    sys.path.insert(0, "sample")
+import utils
+from AvailabilityReminder import AvailabilityReminder
+from DoctolibUrlCom import DoctolibUrlCom, REQUEST_RATE_PER_TIME_LIMIT, REQUEST_TIME_LIMIT_S
+
+
+def get_shard_request_limits(config_data, num_of_shards):
+    """ :return dict : request_limits of a worker (see DoctolibUrlCom), None to use the defaults """
+    if config_data.get("save_url_request_time"):
+        return None
+    return {url_type: (max(1, REQUEST_RATE_PER_TIME_LIMIT[url_type] // num_of_shards), REQUEST_TIME_LIMIT_S[url_type])
+            for url_type in REQUEST_TIME_LIMIT_S.keys()}
+
+
+def run_shard(config_data, shard_index, num_of_shards):
+    """
+    runs in a worker process : discovers and probes the practitioners of the shard, without notifying anything.
+    :return list of Practitioner, with their next_slots
+    """
+    DoctolibUrlCom.from_config(config_data, request_limits=get_shard_request_limits(config_data, num_of_shards))
+    ar = AvailabilityReminder(config_data=config_data)
+    ar.shard = (shard_index, num_of_shards)
+    ar.fetch_practitioners_data()
+    max_date = ar.get_max_reminder_date()
+    for p in ar.practitioners:
+        ar.narrow_practitioner(p)
+        ar.fetch_practitioner_slots(p, max_date)
+    ar.wait_for_catalog_refresh()  # the pool's processes may be stopped as soon as we return
+    DoctolibUrlCom().flush()
+    utils.logger.info(f"shard {shard_index}/{num_of_shards} probed {len(ar.practitioners)} practitioners")
+    return ar.practitioners
+
+
+def merge_shards(shards):
+    """
+    :param shards - list of list of Practitioner : as returned by run_shard, in shard order
+    :return list of Practitioner : in shard order, each shard's practitioners being in discovery order, so the reminders are
+                                   deterministic. A practitioner found by several shards is only kept once, the first time
+    """
+    practitioners = []
+    seen_slugs = set()
+    for shard_practitioners in shards:
+        for practitioner in shard_practitioners:
+            if practitioner.slug_name not in seen_slugs:
+                seen_slugs.add(practitioner.slug_name)
+                practitioners.append(practitioner)
+    return practitioners
+
+
+class ShardedRunner:
+    def __init__(self, num_of_shards, config_data=None):
+        """
+        :param num_of_shards - int : number of worker processes
+        :param config_data - dict : as read from config.yaml. If None, config/config.yaml is read
+        """
+        self.logger = utils.logger
+        self.num_of_shards = max(1, int(num_of_shards))
+        self.config_data = config_data if config_data is not None else utils.read_config_file()
+        self.coordinator = AvailabilityReminder(config_data=self.config_data)
+
+    def run(self):
+        """ probes every shard in its own process, then evaluates and notifies all the slots found at once """
+        # spawn, as the parent may already have threads (rate limiter, outbox...) that fork would copy in a broken state
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(processes=self.num_of_shards) as pool:
+            shards = pool.starmap(run_shard, [(self.config_data, i, self.num_of_shards) for i in range(self.num_of_shards)])
+
+        coordinator = self.coordinator
+        coordinator.practitioners = merge_shards(shards)
+        self.logger.info(f"{self.num_of_shards} shards probed {len(coordinator.practitioners)} practitioners "
+                         f"({', '.join(str(len(practitioners)) for practitioners in shards)})")
+        available_slots = coordinator.evaluate_slots(coordinator.practitioners, coordinator.get_max_reminder_date())
+        if coordinator.slot_state is not None:
+            coordinator.slot_state.save()
+        if available_slots:
+            coordinator.send_reminders()
+        else:
+            self.logger.info("no available slots were found")
+        coordinator.notifier.flush()
+        DoctolibUrlCom().flush()
+        coordinator.export_metrics()
@@ -0,0 +1,101 @@
+"""
+Keeps track of the next slot that has been seen within the reminder window for every (practitioner, motive, agenda, practice),
+so that reminders are only sent for slots that are new, or earlier than the ones seen during the previous runs. Slots after the
+window aren't remembered, so they are reminded once the window reaches them.
+The state is stored in a json snapshot. Updates are appended to a journal next to it, and the journal is only folded into the
+snapshot once it has grown past compaction_threshold lines, so a run never rewrites the whole state for a few changes.
+"""
+import sys
+import json
+import threading
+from pathlib import Path
+
+if "sample" not in sys.path:
+    sys.path.insert(0, "sample")
+import utils
+
+
+class SlotState:
+    def __init__(self, state_file, compaction_threshold=1000):
+        """
+        :param state_file - pathlib.Path : json snapshot, {"slots": {key: date}}
+        :param compaction_threshold - int : number of journal lines after which the journal is folded into the snapshot
+        """
+        self.logger = utils.logger
+        self.state_file = Path(state_file)
+        self.journal_file = self.state_file.parent/(self.state_file.stem + ".journal.jsonl")
+        self.compaction_threshold = compaction_threshold
+        self._lock = threading.Lock()
+        self._dates = {}         # _dates[key] = "YYYY-MM-DD"
+        self._keys_by_slug = {}  # _keys_by_slug[slug_name] = set of keys, so a practitioner's slots are found without a full scan
+        self._num_of_journal_lines = 0
+        self._load()
+
+    @staticmethod
+    def get_key(slug_name, slot):
+        """ :return str key of the slot, unique per practitioner, motive, agenda and practice """
+        return f"{slug_name}|{slot['motive_id']}|{slot['agenda_id']}|{slot['practice_id']}"
+
+    def _load(self):
+        if self.state_file.exists() and self.state_file.stat().st_size > 0:
+            state_data = utils.get_file_json_data(self.state_file)
+            if state_data and isinstance(state_data["slots"], dict):
+                for key, date in state_data["slots"].items():
+                    self._apply(key, date)
+        if self.journal_file.exists():
+            with self.journal_file.open() as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a run might have been interrupted while writing its last line
+                    self._apply(entry["key"], entry["date"])
+                    self._num_of_journal_lines += 1
+
+    def _apply(self, key, date):
+        slug_keys = self._keys_by_slug.setdefault(key.split("|")[0], set())
+        if date is None:
+            self._dates.pop(key, None)
+            slug_keys.discard(key)
+        else:
+            self._dates[key] = date
+            slug_keys.add(key)
+
+    def is_new_or_earlier(self, slug_name, slot):
+        """ :return bool : True if the slot hasn't been seen yet, or if it is earlier than the last seen one """
+        previous_date = self._dates.get(self.get_key(slug_name, slot))
+        return previous_date is None or slot["date"] < previous_date
+
+    def update_practitioner(self, slug_name, slots, answered_triples):
+        """
+        stores the current next slots of a practitioner within the reminder window. Its other slots of the answered queries (not
+        available anymore, or out of the window) are forgotten, so they'll be reported again if they come back within the window.
+        The slots of the queries that failed are kept as they were.
+        :param slots - list of slot dicts within the reminder window, see Practitioner.next_slots
+        :param answered_triples - set of (motive_id, agenda_id, practice_id), see Practitioner.answered_triples
+        """
+        current_dates = {self.get_key(slug_name, slot): slot["date"] for slot in slots}
+        answered_keys = {self.get_key(slug_name, {"motive_id": motive_id, "agenda_id": agenda_id, "practice_id": practice_id})
+                         for motive_id, agenda_id, practice_id in answered_triples}
+        with self._lock:
+            changes = [(key, None) for key in self._keys_by_slug.get(slug_name, ()) if key not in current_dates and key in answered_keys]
+            changes += [(key, date) for key, date in current_dates.items() if self._dates.get(key) != date]
+            if not changes:
+                return
+            with self.journal_file.open('a') as f:
+                for key, date in changes:
+                    self._apply(key, date)
+                    f.write(json.dumps({"key": key, "date": date}) + "\n")
+            self._num_of_journal_lines += len(changes)
+
+    def save(self):
+        """ folds the journal into the snapshot if it has grown past compaction_threshold lines """
+        with self._lock:
+            if self._num_of_journal_lines < self.compaction_threshold:
+                return
+            tmp_file = self.state_file.with_suffix(".tmp")
+            with tmp_file.open('w') as f:
+                json.dump({"slots": self._dates}, f, indent=4, sort_keys=True)
+            tmp_file.replace(self.state_file)
+            self.journal_file.unlink(missing_ok=True)
+            self._num_of_journal_lines = 0
@@ -0,0 +1,66 @@
+"""
+Columnar store of the next slots found during a run, so that filtering them on the reminder window or finding the N
+earliest slots are vectorized operations on numpy arrays, instead of loops over the next_slots dicts of every practitioner.
+Each row is a slot dict of a Practitioner's next_slots (see get_next_available_appointment). The dicts themselves are
+kept, so rows can be handed back (e.g. to set their send_reminder flag).
+numpy is only imported when a store is built, so it doesn't weigh on the cold start of runs that find no slot.
+"""
+
+
+class SlotStore:
+    def __init__(self, practitioners):
+        """
+        :param practitioners - list of Practitioner, whose next_slots are stored
+        """
+        import numpy as np
+        self.practitioners = list(practitioners)
+        self.slots = []              # slots[row] = slot dict
+        practitioner_indexes, dates, motive_ids, agenda_indexes, practice_ids = [], [], [], [], []
+        self.agenda_ids = []         # agenda_ids[agenda_index] = agenda_id
+        agenda_index_by_id = {}
+        for practitioner_index, practitioner in enumerate(self.practitioners):
+            for slot in practitioner.next_slots:
+                self.slots.append(slot)
+                practitioner_indexes.append(practitioner_index)
+                dates.append(slot["date"])
+                motive_ids.append(slot["motive_id"])
+                if slot["agenda_id"] not in agenda_index_by_id:
+                    agenda_index_by_id[slot["agenda_id"]] = len(self.agenda_ids)
+                    self.agenda_ids.append(slot["agenda_id"])
+                agenda_indexes.append(agenda_index_by_id[slot["agenda_id"]])
+                practice_ids.append(slot["practice_id"])
+        self.practitioner_indexes = np.array(practitioner_indexes, dtype=np.int32)
+        self.dates = np.array(dates, dtype="datetime64[D]")
+        self.motive_ids = np.array(motive_ids, dtype=np.int64)
+        self.agenda_indexes = np.array(agenda_indexes, dtype=np.int32)
+        self.practice_ids = np.array(practice_ids, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def rows_before(self, max_date):
+        """
+        :param max_date - str : YYYY-MM-DD, excluded
+        :return numpy array of the rows whose date is before max_date, in insertion order
+        """
+        import numpy as np
+        return np.flatnonzero(self.dates < np.datetime64(max_date, "D"))
+
+    def earliest_rows(self, num_of_rows, rows=None):
+        """
+        :param rows - numpy array of rows to pick from (see rows_before), every row if None
+        :return numpy array of the num_of_rows earliest rows, sorted by date
+        """
+        import numpy as np
+        rows = np.arange(len(self)) if rows is None else rows
+        if len(rows) > num_of_rows:
+            rows = rows[np.argpartition(self.dates[rows], num_of_rows - 1)[:num_of_rows]]
+        return rows[np.argsort(self.dates[rows], kind="stable")]
+
+    def get_practitioner(self, row):
+        return self.practitioners[self.practitioner_indexes[row]]
+
+    def describe_row(self, row):
+        """ :return str : 'date : motive (practitioner)' """
+        practitioner = self.get_practitioner(row)
+        return f"{self.slots[row]['date']} : {practitioner.visit_motives.get(self.slots[row]['motive_id'])} ({practitioner.practitioner_name})"
@@ -0,0 +1,249 @@
+"""
+Transport layer used by DoctolibUrlCom to send its requests. Every transport that reaches the network keeps a single requests.Session, with one
+pooled adapter mounted per host (scheme + domain) the first time that host is requested, so the session's adapters stay
+the same whatever the number of requests made.
+Available transports:
+- direct: requests are sent as is
+- gateway: requests towards doctolib.fr go through requests_ip_rotator's ApiGateway, so the IP rotates
+- local: requests towards doctolib.fr are sent to a local stand-in server instead (tests, benchmarks...)
+- record: requests are sent by another transport, and every exchange is stored in an ExchangeArchive
+- replay: exchanges are served back from an ExchangeArchive, without any network access
+"""
+import sys
+import time
+import zlib
+import sqlite3
+import threading
+import requests
+
+from datetime import date
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from requests.adapters import HTTPAdapter
+
+if "sample" not in sys.path:
+    sys.path.insert(0, "sample")
+import utils
+from ResponseCache import ResponseCache
+
+DOCTOLIB_BASE_URL = "https://www.doctolib.fr"
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
+}
+
+
+class Transport:
+    """ sends GET requests through a session that has one pooled adapter per host """
+    # True for transports that never reach the network, requests made through them don't count in the request budget
+    is_offline = False
+    # False for transports that must only reach doctolib.fr or its stand-in : the requests to other services (geocoding) are skipped
+    reaches_third_parties = True
+
+    def __init__(self, pool_connections=4, pool_maxsize=10, keep_alive=True, timeout_s=30.0):
+        """
+        :param pool_connections - int : number of hosts a pooled adapter keeps connections for
+        :param pool_maxsize - int : maximum number of connections kept alive per host, should be >= max_concurrent_requests
+        :param keep_alive - bool : if False, connections are closed after every request
+        :param timeout_s - float : connect and read timeout of the requests
+        """
+        self.logger = utils.logger
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout_s = timeout_s
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+        self._mounted_hosts = set()
+        self._mount_lock = threading.Lock()
+
+    @staticmethod
+    def get_host(url):
+        """ :return str 'scheme://domain' of the url """
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def create_adapter(self, host):
+        """ :return the adapter that'll be mounted for all requests towards host """
+        return HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+
+    def _mount(self, url):
+        host = self.get_host(url)
+        if host in self._mounted_hosts:
+            return
+        with self._mount_lock:
+            if host not in self._mounted_hosts:
+                self.session.mount(host + "/", self.create_adapter(host))
+                self._mounted_hosts.add(host)
+
+    def get(self, url):
+        """ :return requests.Response """
+        self._mount(url)
+        return self.session.get(url, timeout=self.timeout_s)
+
+    def close(self):
+        self.session.close()
+
+
+class DirectTransport(Transport):
+    pass
+
+
+class GatewayTransport(Transport):
+    """
+    requests towards the gateway_hosts go through an ApiGateway, the other ones are sent directly.
+    Starting a gateway takes a while, so it is only done on the first request towards its host
+    """
+    def __init__(self, gateway_hosts=(DOCTOLIB_BASE_URL,), *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.gateway_hosts = set(gateway_hosts)
+        self._gateways = []
+
+    def create_adapter(self, host):
+        if host not in self.gateway_hosts:
+            return super().create_adapter(host)
+        from requests_ip_rotator import ApiGateway  # heavy (boto3), only loaded when rotation is used
+        gateway = ApiGateway(host)
+        gateway.start()
+        self._gateways.append(gateway)
+        return gateway
+
+    def close(self):
+        for gateway in self._gateways:
+            gateway.shutdown()
+        self._gateways = []
+        super().close()
+
+
+class LocalTransport(Transport):
+    """ sends the requests towards doctolib.fr to a local server, e.g. 'http://127.0.0.1:8080' """
+    reaches_third_parties = False
+
+    def __init__(self, local_base_url="http://127.0.0.1:8080", *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.local_base_url = local_base_url.rstrip("/")
+
+    def get(self, url):
+        if url.startswith(DOCTOLIB_BASE_URL):
+            url = self.local_base_url + url[len(DOCTOLIB_BASE_URL):]
+        return super().get(url)
+
+
+class ExchangeArchive:
+    """
+    SQLite file storing one exchange (status code and zlib compressed body) per exchange key (see get_exchange_key). The last
+    exchange recorded for a key replaces the previous one.
+    """
+    def __init__(self, archive_file):
+        self.archive_file = str(archive_file)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.archive_file, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS exchanges (url TEXT PRIMARY KEY, status_code INTEGER NOT NULL, "
+                                 "body BLOB NOT NULL, recorded_at REAL NOT NULL)")
+        self._connection.commit()
+
+    @staticmethod
+    def get_exchange_key(url, today=None):
+        """
+        :return str : the normalized url. A start_date that is the current day (the first page of a slot window) is replaced by
+                      'today', so a run replayed on a later day finds it. The other dates are kept : the next slot placeholder
+                      (2000-01-01) and the pages starting at a recorded next_slot are the same whatever the day
+        :param today - datetime.date : defaults to the current day
+        """
+        parts = urlsplit(ResponseCache.normalize_url(url))
+        today = (today or date.today()).isoformat()
+        params = [(name, "today" if name == "start_date" and value == today else value)
+                  for name, value in parse_qsl(parts.query, keep_blank_values=True)]
+        return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(params), ""))
+
+    def put(self, url, status_code, body):
+        """ :param body - bytes """
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO exchanges (url, status_code, body, recorded_at) VALUES (?, ?, ?, ?)",
+                                     (self.get_exchange_key(url), status_code, zlib.compress(body), time.time()))
+            self._connection.commit()
+
+    def load_all(self):
+        """ :return dict : exchanges[exchange_key] = (status_code, body) """
+        with self._lock:
+            rows = self._connection.execute("SELECT url, status_code, body FROM exchanges").fetchall()
+        return {url: (status_code, zlib.decompress(body)) for url, status_code, body in rows}
+
+    def close(self):
+        self._connection.close()
+
+
+class RecordingTransport(Transport):
+    """
+    sends the requests through another transport, and stores every exchange in an ExchangeArchive. It has no session of its
+    own, the inner transport's one is used
+    """
+    def __init__(self, archive_file, inner="gateway", inner_options=None, **kwargs):
+        """
+        :param archive_file - path of the ExchangeArchive
+        :param inner - str : name of the transport that really sends the requests
+        :param inner_options - dict : given to the inner transport's constructor
+        :param kwargs : session options (pool_maxsize, keep_alive...), given to the inner transport's constructor as well
+        """
+        self.logger = utils.logger
+        self.archive = ExchangeArchive(archive_file)
+        self.inner = create_transport(inner, **dict(kwargs, **(inner_options or {})))
+
+    def get(self, url):
+        response = self.inner.get(url)
+        self.archive.put(url, response.status_code, response.content)
+        return response
+
+    def close(self):
+        self.inner.close()
+        self.archive.close()
+
+
+class ReplayTransport(Transport):
+    """
+    serves the exchanges of an ExchangeArchive from memory. URLs that were not recorded get a 404.
+    latency_s can be set to simulate the network
+    """
+    is_offline = True
+    reaches_third_parties = False
+
+    def __init__(self, archive_file, latency_s=0.0, **kwargs):
+        """ :param kwargs : session options, unused as nothing is sent """
+        self.logger = utils.logger
+        archive = ExchangeArchive(archive_file)
+        self.exchanges = archive.load_all()
+        archive.close()
+        self.latency_s = latency_s
+        self.logger.info(f"replaying {len(self.exchanges)} exchanges from {archive_file}")
+
+    def get(self, url):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        (status_code, body) = self.exchanges.get(ExchangeArchive.get_exchange_key(url), (404, b""))
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = body
+        response.url = url
+        response.encoding = "utf-8"
+        return response
+
+    def close(self):
+        pass
+
+
+TRANSPORTS = {
+    "direct": DirectTransport,
+    "gateway": GatewayTransport,
+    "local": LocalTransport,
+    "record": RecordingTransport,
+    "replay": ReplayTransport,
+}
+
+
+def create_transport(name="gateway", **kwargs):
+    """
+    :param name - str : one of TRANSPORTS' keys
+    :param kwargs : given to the transport's constructor
+    """
+    if name not in TRANSPORTS:
+        raise Exception(f"unknown transport '{name}', available transports are {list(TRANSPORTS.keys())}")
+    return TRANSPORTS[name](**kwargs)
@@ -0,0 +1,83 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent/"sample"))
+import DoctolibUrlCom as url_com_module
+from AvailabilityReminder import AvailabilityReminder, SearchResult
+
+ADDRESS = {"street_number": 1, "street_name": "rue des lois", "zipcode": "31000", "city": "Toulouse", "max_dist_from_address_km": 5.0}
+
+
+class SearchUrlCom:
+    """ answers two pages of dentists, and fails on page failing_page if given """
+    def __init__(self, failing_page=None):
+        self.failing_page = failing_page
+
+    def request_from_json_url(self, url):
+        if url.startswith("https://api-adresse.data.gouv.fr/"):
+            return {"features": [{"geometry": {"coordinates": [1.44, 43.6]}}]}
+        page = int(url.split("page=")[1]) if "page=" in url else 1
+        if page == self.failing_page:
+            return None
+        if page > 2:
+            return {"data": {"doctors": []}}
+        return {"data": {"doctors": [{"link": f"/dentiste/toulouse/doctor-{page}-{i}", "distance": 1.0} for i in range(2)]}}
+
+
+def create_reminder(tmp_path, monkeypatch, url_com, max_search_pages=None, transport="gateway", transport_options=None):
+    # a new DoctolibUrlCom with the transport, the singleton of the other tests is put back afterwards
+    monkeypatch.setattr(url_com_module.Singleton, "_instances", {})
+    for name, value in (("ES_SERVER_NAME", "localhost"), ("ES_PORT_NUMBER", "25"), ("ES_EMAIL_USER_NAME", "test"), ("ES_EMAIL_PASSWORD", "test")):
+        monkeypatch.setenv(name, value)
+    return AvailabilityReminder(url_com=url_com, config_data={
+        "visiting_motive_keywords": ["consultation"],
+        "visiting_motive_forbidden_keywords": [],
+        "send_email_reminder": False,
+        "practitioner_catalog": True,
+        "catalog_file": str(tmp_path/"catalog.sqlite"),
+        "max_search_pages": max_search_pages,
+        "transport": transport,
+        "transport_options": transport_options,
+    })
+
+
+def search(reminder):
+    """ :return (links, SearchResult) of the search of dentists around ADDRESS, as stored in the catalog """
+    links = list(reminder._iter_searched_doctor_links("dentiste", ADDRESS, None))
+    doctors = reminder.iter_doctors_around_address("dentiste", ADDRESS)
+    while True:
+        try:
+            next(doctors)
+        except StopIteration as stop:
+            return (links, stop.value)
+
+
+def test_search_failing_on_a_later_page_is_not_stored(tmp_path, monkeypatch):
+    reminder = create_reminder(tmp_path, monkeypatch, SearchUrlCom(failing_page=2))
+    (links, result) = search(reminder)
+    assert result == SearchResult.FAILED
+    assert len(links) == 2
+    assert reminder.catalog.get_search(reminder.get_search_key("dentiste", ADDRESS)) is None
+
+
+def test_complete_and_truncated_searches_are_stored(tmp_path, monkeypatch):
+    reminder = create_reminder(tmp_path, monkeypatch, SearchUrlCom())
+    (links, result) = search(reminder)
+    assert result == SearchResult.COMPLETE
+    assert reminder.catalog.get_search(reminder.get_search_key("dentiste", ADDRESS))[0] == links
+
+    reminder = create_reminder(tmp_path, monkeypatch, SearchUrlCom(), max_search_pages=1)
+    (links, result) = search(reminder)
+    assert result == SearchResult.MAX_PAGES_REACHED
+    assert reminder.catalog.get_search(reminder.get_search_key("dentiste", ADDRESS))[0] == links
+
+
+def test_addresses_are_only_geocoded_by_the_transports_reaching_third_parties(tmp_path, monkeypatch):
+    reminder = create_reminder(tmp_path, monkeypatch, SearchUrlCom(), transport="direct")
+    assert reminder.get_address_location(ADDRESS) == (43.6, 1.44)
+
+    # replay is offline : nothing is sent, and the address has to be given its coordinates
+    reminder = create_reminder(tmp_path, monkeypatch, SearchUrlCom(), transport="replay",
+                               transport_options={"archive_file": str(tmp_path/"exchanges.sqlite")})
+    assert reminder.get_address_location(dict(ADDRESS, city="Muret")) is None
+    assert reminder.get_address_location(dict(ADDRESS, city="Muret", latitude=43.46, longitude=1.33)) == (43.46, 1.33)
@@ -0,0 +1,37 @@
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent/"sample"))
+sys.path.insert(0, str(Path(__file__).parent.parent/"benchmarks"))
+from EmailSender import EmailSender
+from EmailOutbox import EmailOutbox
+from fake_smtp_server import FakeSmtpServer
+
+
+def test_outbox_merges_and_retries_on_a_single_connection():
+    server = FakeSmtpServer(("127.0.0.1", 0), fail_every=2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    email_sender = EmailSender("127.0.0.1", server.server_address[1], "me@test", "password", use_starttls=False)
+    outbox = EmailOutbox(email_sender, initial_backoff_s=0.05)
+    try:
+        # queued before the worker starts, so they are all in its first batch
+        start_worker = outbox._start_worker
+        outbox._start_worker = lambda: None
+        for i in range(3):
+            outbox.enqueue(f"slot {i}", f"reminder {i}", "alice@test")
+        outbox.enqueue("slot 3", "reminder 3", "bob@test")
+        outbox._start_worker = start_worker
+        outbox._start_worker()
+        assert outbox.flush(timeout_s=10.0)
+    finally:
+        email_sender.close()
+        server.shutdown()
+        server.server_close()
+
+    stats = server.get_stats()
+    assert (stats["connections"], stats["logins"]) == (1, 1)
+    # alice's 3 reminders are merged into one email. Bob's one gets the 2nd attempt's 451, and is sent on its retry
+    assert (stats["attempts"], stats["failures"]) == (3, 1)
+    assert sorted((recipients, message.get_payload(0).get_payload().replace("\r\n", "\n")) for recipients, message in server.messages) == [
+        (["alice@test"], "reminder 0\n\nreminder 1\n\nreminder 2"), (["bob@test"], "reminder 3")]
@@ -0,0 +1,42 @@
+import sys
+import random
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent/"sample"))
+from KeywordMatcher import KeywordMatcher, normalize_text
+
+
+def select_motives_by_substrings(visit_motives, keywords, forbidden_keywords):
+    """ the rule narrow_search_based_on_keywords used before KeywordMatcher, one substring search per keyword and motive """
+    keywords = [normalize_text(k) for k in keywords]
+    forbidden_keywords = [normalize_text(k) for k in forbidden_keywords]
+    highest_num_of_keyword_matches = max([0] + [sum(k in motive for k in keywords) for motive in visit_motives.values()])
+    return {id for id, motive in visit_motives.items()
+            if not any(word in motive for word in forbidden_keywords) and sum(word in motive for word in keywords) >= highest_num_of_keyword_matches}
+
+
+def assert_same_selection(visit_motives, keywords, forbidden_keywords):
+    visit_motives = {id: normalize_text(motive) for id, motive in visit_motives.items()}
+    expected = select_motives_by_substrings(visit_motives, keywords, forbidden_keywords)
+    assert KeywordMatcher(keywords, forbidden_keywords).select_motives(visit_motives) == expected, (visit_motives, keywords, forbidden_keywords)
+
+
+def test_overlapping_and_duplicate_keywords():
+    visit_motives = {1: "Première consultation", 2: "Consultation de suivi", 3: "Première consultation enfant",
+                     4: "Urgence", 5: "Consultation consultation"}
+    assert_same_selection(visit_motives, ["consultation", "sultat", "première"], [])
+    assert_same_selection(visit_motives, ["consultation", "consultation", "suivi"], [])  # a duplicate counts twice
+    assert_same_selection(visit_motives, ["premiere", "consultation"], ["enfant", "fant"])
+    assert_same_selection(visit_motives, ["consultation"], ["consultation"])
+    assert_same_selection(visit_motives, [], ["urgence"])
+    assert_same_selection(visit_motives, ["aaa"], [])
+
+
+def test_random_keywords_select_the_same_motives_as_substrings():
+    rng = random.Random(0)
+    random_text = lambda max_length: "".join(rng.choice("abé ") for _ in range(rng.randint(1, max_length)))
+    for _ in range(500):
+        visit_motives = {id: random_text(12) for id in range(rng.randint(1, 6))}
+        keywords = [random_text(3).strip() or "a" for _ in range(rng.randint(0, 4))]
+        forbidden_keywords = [random_text(4).strip() or "b" for _ in range(rng.randint(0, 2))]
+        assert_same_selection(visit_motives, keywords, forbidden_keywords)
@@ -0,0 +1,70 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent/"sample"))
+from Practitioner import Practitioner, fetch_json_data_from_profile_url
+from MultiTenantRunner import SharedUrlCom
+from DoctolibUrlCom import UrlType
+
+PROFILE_URL = "https://www.doctolib.fr/dentiste/toulouse/jane-doe"
+
+
+def get_profile_answer():
+    """ a profile with a first consultation and a follow-up motive, the follow-up being the only one booked at practice 2 """
+    return {"data": {
+        "profile": {"name_with_title": "Dr Jane Doe", "organization": False, "speciality": {"id": 1, "slug": "dentiste", "name": "Dentiste"}},
+        "places": [{"practice_ids": [1], "address": "1 rue des lois", "zipcode": "31000", "city": "Toulouse"},
+                   {"practice_ids": [2], "address": "2 rue de metz", "zipcode": "31000", "city": "Toulouse"}],
+        "visit_motives": [{"id": 10, "name": "Première consultation", "speciality_id": 1},
+                          {"id": 11, "name": "Consultation de suivi", "speciality_id": 1}],
+        "agendas": [{"id": 100, "booking_disabled": False, "booking_temporary_disabled": False, "speciality_id": 1,
+                     "visit_motive_ids_by_practice_id": {"1": [10, 11], "2": [11]}}],
+    }}
+
+
+class FakeUrlCom:
+    def __init__(self):
+        self.num_of_requests = 0
+
+    def get_url_type(self, url):
+        return UrlType.ONLINE_BOOKING
+
+    def request_from_json_url(self, url):
+        self.num_of_requests += 1
+        return get_profile_answer()
+
+
+def test_tenants_sharing_a_profile_narrow_it_independently():
+    url_com = FakeUrlCom()
+    shared_url_com = SharedUrlCom(url_com)
+    tenants = [Practitioner(*fetch_json_data_from_profile_url(PROFILE_URL, shared_url_com)) for _ in range(2)]
+    assert url_com.num_of_requests == 1
+
+    # tenant A doesn't want follow-ups, so practice 2 is removed from its agenda. Tenant B wants them
+    tenants[0].narrow_search_based_on_keywords(keywords=["consultation"], forbidden_keywords=["suivi"])
+    tenants[1].narrow_search_based_on_keywords(keywords=["consultation"], forbidden_keywords=[])
+
+    assert set(tenants[0].get_valid_triples()) == {(10, 100, "1")}
+    assert set(tenants[1].get_valid_triples()) == {(10, 100, "1"), (11, 100, "1"), (11, 100, "2")}
+
+
+def test_slots_of_a_group_of_agendas_are_dispatched_to_every_tenant_of_the_group():
+    from MultiTenantRunner import MultiTenantRunner
+    tenant_a = Practitioner("jane-doe", get_profile_answer()["data"])
+    profile_b = get_profile_answer()["data"]
+    profile_b["agendas"][0]["visit_motive_ids_by_practice_id"] = {"2": [11]}
+    profile_b["agendas"].append({"id": 101, "booking_disabled": False, "booking_temporary_disabled": False, "speciality_id": 1,
+                                 "visit_motive_ids_by_practice_id": {"1": [10]}})
+    tenant_b = Practitioner("jane-doe", profile_b)
+    merged = MultiTenantRunner.merge_practitioners([tenant_a, tenant_b])
+    query = [q for q in merged.plan_availability_queries() if q["motive_id"] == 10 and q["practice_id"] == "1"][0]
+    assert sorted(query["agenda_ids"]) == [100, 101]
+
+    # doctolib only gives the group's next slot, reported under the lowest agenda id whatever the agendas' order
+    assert merged.split_query_answer(query, {"next_slot": "2026-11-02T09:00:00.000+01:00"}) == [(100, "2026-11-02")]
+    assert merged.split_query_answer(dict(query, agenda_ids=[101, 100]), {"next_slot": "2026-11-02"}) == [(100, "2026-11-02")]
+
+    # tenant B only watches agenda 101 for this motive, the group's slot is still its own
+    merged.next_slots = [{"date": "2026-11-02", "motive_id": 10, "agenda_id": 100, "agenda_ids": [100, 101], "practice_id": 1}]
+    MultiTenantRunner.dispatch_slots(merged, tenant_b)
+    assert [slot["date"] for slot in tenant_b.next_slots] == ["2026-11-02"]
@@ -0,0 +1,101 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent/"sample"))
+from RateLimiter import RateLimiter
+
+
+class FakeClock:
+    """ time only moves when sleep is called """
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def create_limiter(clock, rate=2, period_s=10.0, **kwargs):
+    return RateLimiter({"key": (rate, period_s)}, clock=clock.time, sleep=clock.sleep, **kwargs)
+
+
+def test_tokens_are_refilled_over_time():
+    clock = FakeClock()
+    limiter = create_limiter(clock)
+    assert limiter.try_acquire("key") and limiter.try_acquire("key")
+    assert not limiter.try_acquire("key")
+    clock.now += 4.9
+    assert not limiter.try_acquire("key")
+    clock.now += 0.1  # 2 tokens per 10s : one more every 5s
+    assert limiter.try_acquire("key")
+    assert clock.sleeps == []
+
+
+def test_acquire_waits_for_a_token_unless_it_takes_longer_than_timeout():
+    clock = FakeClock()
+    limiter = create_limiter(clock)
+    limiter.try_acquire("key")
+    limiter.try_acquire("key")
+    assert not limiter.acquire("key", timeout=4.0)
+    assert clock.sleeps == []
+    assert limiter.acquire("key", timeout=6.0)
+    assert clock.sleeps == [5.0]
+
+
+def test_backoff_after_429_and_penalty_halving():
+    clock = FakeClock()
+    limiter = create_limiter(clock, rate=100, initial_backoff_s=30.0, min_penalty_s=10.0)
+    assert limiter.try_acquire("key")
+    limiter.report_response("key", 429)
+    assert not limiter.try_acquire("key")
+    clock.now += 30.0
+    assert limiter.try_acquire("key")
+    # a second 429 doubles the backoff
+    limiter.report_response("key", 429)
+    clock.now += 59.0
+    assert not limiter.try_acquire("key")
+    clock.now += 1.0
+    assert limiter.try_acquire("key")
+
+    # the request after the backoff is followed by the whole penalty. Then every successful request halves the penalty
+    # spacing the following ones : 60 -> 30 -> 15 -> 0 (below min_penalty_s)
+    limiter.report_response("key", 200)
+    clock.now += 59.0
+    assert not limiter.try_acquire("key")
+    clock.now += 1.0
+    assert limiter.try_acquire("key")
+    limiter.report_response("key", 200)
+    clock.now += 29.0
+    assert not limiter.try_acquire("key")
+    clock.now += 1.0
+    assert limiter.try_acquire("key")
+    limiter.report_response("key", 200)
+    clock.now += 15.0
+    assert limiter.try_acquire("key")
+    assert limiter.try_acquire("key")
+
+def test_backoff_is_capped():
+    clock = FakeClock()
+    limiter = create_limiter(clock, rate=100, initial_backoff_s=30.0, max_backoff_s=100.0)
+    for _ in range(5):
+        limiter.report_response("key", 403)
+    clock.now += 100.0
+    assert limiter.try_acquire("key")
+
+
+def test_released_token_can_be_taken_again():
+    clock = FakeClock()
+    limiter = create_limiter(clock)
+    assert limiter.try_acquire("key") and limiter.try_acquire("key")
+    limiter.release("key")
+    assert limiter.try_acquire("key")
+    assert not limiter.try_acquire("key")
+    # a full bucket doesn't grow past its capacity
+    clock.now += 100.0
+    limiter.release("key")
+    assert limiter.try_acquire("key") and limiter.try_acquire("key")
+    assert not limiter.try_acquire("key")
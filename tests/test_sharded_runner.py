@@ -0,0 +1,23 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent/"sample"))
+from Practitioner import Practitioner
+from ShardedRunner import merge_shards
+
+PROFILE = {
+    "profile": {"name_with_title": "Dr Jane Doe", "organization": False, "speciality": {"id": 1, "slug": "dentiste", "name": "Dentiste"}},
+    "places": [{"practice_ids": [1], "address": "1 rue des lois", "zipcode": "31000", "city": "Toulouse"}],
+    "visit_motives": [{"id": 10, "name": "Première consultation", "speciality_id": 1}],
+    "agendas": [{"id": 100, "booking_disabled": False, "booking_temporary_disabled": False, "speciality_id": 1,
+                 "visit_motive_ids_by_practice_id": {"1": [10]}}],
+}
+
+
+def test_practitioner_probed_by_two_shards_is_kept_once():
+    # jane-doe is watched directly (shard 0) and through an organization of shard 1
+    shards = [[Practitioner("jane-doe", PROFILE), Practitioner("john-doe", PROFILE)],
+              [Practitioner("clinic-doctor", PROFILE), Practitioner("jane-doe", PROFILE)]]
+    practitioners = merge_shards(shards)
+    assert [p.slug_name for p in practitioners] == ["jane-doe", "john-doe", "clinic-doctor"]
+    assert practitioners[0] is shards[0][0]
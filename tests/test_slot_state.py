@@ -0,0 +1,81 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent/"sample"))
+import Practitioner as practitioner_module
+from Practitioner import Practitioner
+from AvailabilityReminder import AvailabilityReminder
+
+PROFILE = {
+    "profile": {"name_with_title": "Dr Jane Doe", "organization": False, "speciality": {"id": 1, "slug": "dentiste", "name": "Dentiste"}},
+    "places": [{"practice_ids": [1], "address": "1 rue des lois", "zipcode": "31000", "city": "Toulouse"}],
+    "visit_motives": [{"id": 10, "name": "Première consultation", "speciality_id": 1}],
+    "agendas": [{"id": 100, "booking_disabled": False, "booking_temporary_disabled": False, "speciality_id": 1,
+                 "visit_motive_ids_by_practice_id": {"1": [10]}}],
+}
+
+
+def create_reminder(tmp_path, monkeypatch):
+    for name, value in (("ES_SERVER_NAME", "localhost"), ("ES_PORT_NUMBER", "25"), ("ES_EMAIL_USER_NAME", "test"), ("ES_EMAIL_PASSWORD", "test")):
+        monkeypatch.setenv(name, value)
+    return AvailabilityReminder(config_data={
+        "visiting_motive_keywords": ["consultation"],
+        "visiting_motive_forbidden_keywords": [],
+        "only_notify_new_slots": True,
+        "send_email_reminder": False,
+        "availability_reminder_data_file": str(tmp_path/"availability_reminder_data.json"),
+    })
+
+
+def evaluate_run(reminder, date, max_date):
+    """
+    :return list of str : the dates reminded by a run finding the practitioner's next slot at date. If date is None, the
+                          availability request failed
+    """
+    practitioner = Practitioner("jane-doe", PROFILE)
+    if date is not None:
+        practitioner.next_slots = [{"date": date, "motive_id": 10, "agenda_id": 100, "practice_id": 1, "send_reminder": False}]
+        practitioner.answered_triples = {(10, 100, 1)}
+    reminder.slot_events = []
+    reminder.evaluate_slots([practitioner], max_date)
+    return [event.date for event in reminder.slot_events]
+
+
+def test_slot_after_the_window_is_reminded_once_the_window_reaches_it(tmp_path, monkeypatch):
+    reminder = create_reminder(tmp_path, monkeypatch)
+    assert evaluate_run(reminder, "2026-11-20", max_date="2026-10-28") == []
+    assert evaluate_run(reminder, "2026-11-20", max_date="2026-11-10") == []
+    # the window moved past the slot: it is reminded, once
+    assert evaluate_run(reminder, "2026-11-20", max_date="2026-11-25") == ["2026-11-20"]
+    assert evaluate_run(reminder, "2026-11-20", max_date="2026-11-26") == []
+    # the state is read back by the next process
+    assert evaluate_run(create_reminder(tmp_path, monkeypatch), "2026-11-20", max_date="2026-11-27") == []
+
+
+def test_earlier_slot_is_reminded_again(tmp_path, monkeypatch):
+    reminder = create_reminder(tmp_path, monkeypatch)
+    assert evaluate_run(reminder, "2026-10-20", max_date="2026-10-28") == ["2026-10-20"]
+    assert evaluate_run(reminder, "2026-10-22", max_date="2026-10-28") == []
+    assert evaluate_run(reminder, "2026-10-15", max_date="2026-10-28") == ["2026-10-15"]
+
+
+def test_slot_is_not_reminded_again_after_a_failed_request(tmp_path, monkeypatch):
+    reminder = create_reminder(tmp_path, monkeypatch)
+    assert evaluate_run(reminder, "2026-10-20", max_date="2026-10-28") == ["2026-10-20"]
+    assert evaluate_run(reminder, None, max_date="2026-10-28") == []
+    assert evaluate_run(reminder, "2026-10-20", max_date="2026-10-28") == []
+
+
+def test_failed_requests_leave_their_triples_unanswered(monkeypatch):
+    class FailingUrlCom:
+        def request_from_json_url(self, url):
+            return None if "practice_ids=1" in url else {"next_slot": "2026-11-02"}
+    monkeypatch.setattr(practitioner_module, "DoctolibUrlCom", FailingUrlCom)
+    profile = dict(PROFILE, places=PROFILE["places"] + [{"practice_ids": [2], "address": "2 rue de metz", "zipcode": "31000", "city": "Toulouse"}],
+                   agendas=[dict(PROFILE["agendas"][0], visit_motive_ids_by_practice_id={"1": [10], "2": [10]})])
+    practitioner = Practitioner("jane-doe", profile)
+    practitioner.get_next_available_appointment()
+    assert practitioner.answered_triples == {(10, 100, 2)}
+    assert [slot["practice_id"] for slot in practitioner.next_slots] == [2]
+    practitioner.get_available_slots_in_window("2026-10-28")
+    assert practitioner.answered_triples == {(10, 100, 2)}
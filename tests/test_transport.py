@@ -0,0 +1,66 @@
+import sys
+from datetime import date
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).parent.parent/"sample"))
+import Transport
+from Transport import RecordingTransport, ReplayTransport
+
+
+def get_availabilities_url(start_day):
+    return f"https://www.doctolib.fr/availabilities.json?start_date={start_day}&visit_motive_ids=10&agenda_ids=100&practice_ids=1&limit=7"
+
+
+class FakeTransport(Transport.Transport):
+    def get(self, url):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"next_slot": "2026-11-02"}'
+        return response
+
+
+def set_today(monkeypatch, day):
+    class FakeDate(date):
+        @classmethod
+        def today(cls):
+            return day
+    monkeypatch.setattr(Transport, "date", FakeDate)
+
+
+def test_exchanges_recorded_one_day_are_replayed_the_next(tmp_path, monkeypatch):
+    monkeypatch.setitem(Transport.TRANSPORTS, "fake", FakeTransport)
+    archive_file = tmp_path/"exchanges.sqlite"
+    set_today(monkeypatch, date(2026, 10, 18))
+    recording = RecordingTransport(archive_file, inner="fake")
+    recording.get(get_availabilities_url("2000-01-01"))  # next slot placeholder
+    recording.get(get_availabilities_url("2026-10-18"))  # first page of a window
+    recording.get(get_availabilities_url("2026-11-02"))  # page starting at a recorded next_slot
+    recording.close()
+
+    set_today(monkeypatch, date(2026, 10, 19))
+    replay = ReplayTransport(archive_file)
+    assert replay.get(get_availabilities_url("2000-01-01")).status_code == 200
+    assert replay.get(get_availabilities_url("2026-10-19")).status_code == 200
+    assert replay.get(get_availabilities_url("2026-11-02")).status_code == 200
+    assert replay.get(get_availabilities_url("2026-10-18")).status_code == 404
+
+
+def test_replayed_responses_are_not_cached(tmp_path, monkeypatch):
+    import DoctolibUrlCom as url_com_module
+    from ResponseCache import ResponseCache
+    monkeypatch.setattr(url_com_module, "ResponseCache", lambda max_entries: ResponseCache(cache_folder=tmp_path/"url_cache", max_entries=max_entries))
+    # a new DoctolibUrlCom, the singleton of the other tests is put back afterwards
+    monkeypatch.setattr(url_com_module.Singleton, "_instances", {})
+    archive_file = tmp_path/"exchanges.sqlite"
+    archive = Transport.ExchangeArchive(archive_file)
+    profile_url = "https://www.doctolib.fr/online_booking/api/slot_selection_funnel/v1/info.json?profile_slug=jane-doe"
+    archive.put(profile_url, 200, b'{"data": {}}')
+    archive.close()
+
+    url_com = url_com_module.DoctolibUrlCom(cache_responses=True, transport="replay", transport_options={"archive_file": archive_file})
+    assert url_com.request_from_json_url(profile_url) == {"data": {}}
+    assert url_com.response_cache is None
+    url_com.flush()
+    assert list((tmp_path/"url_cache").iterdir()) == []